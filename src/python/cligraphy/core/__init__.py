@@ -5,7 +5,7 @@
 Cligraphy tools
 """
 
-from attrdict import AttrDict
+from cligraphy.core.config import ConfigNode
 
 import yaml
 try:
@@ -14,6 +14,7 @@ except ImportError:
     from yaml import Loader, Dumper
 
 import collections
+import marshal
 import os
 import os.path
 import re
@@ -50,11 +51,10 @@ __CONF_SUBST_RE = re.compile(r'(%cfg.([a-zA-Z0-9.-_]+)%)')
 
 
 def dictify_recursive(obj):
-    """Transforms an attrdict tree into regular python dicts"""
-    for key, val in obj.iteritems():
-        if isinstance(val, AttrDict):
-            obj[key] = dictify_recursive(val)
-    return dict(**obj)
+    """Transforms a configuration tree (eg. ConfigNodes) into regular python dicts"""
+    if isinstance(obj, ConfigNode):
+        return obj.to_dict()
+    return dict((key, dictify_recursive(val) if isinstance(val, collections.Mapping) else val) for key, val in obj.iteritems())
 
 
 def update_recursive(base, overlay):
@@ -85,34 +85,92 @@ def get(root, confkey):
     return find_node(root, confkey.split('.'))
 
 
-def _resolve_config(root, subst_re, node=None):
-    """recursive helper for resolve_config"""
-    if node is None:
-        node = root
-    remaining = []
-    for key, val in node.iteritems():
-        if isinstance(val, collections.Mapping):
-            remaining.extend(_resolve_config(root, subst_re, node=val))
-        elif isinstance(val, basestring):
-            for match, confkey in subst_re.findall(val):
-                confval = get(root, confkey)
-                if confval is not None and (not isinstance(confval, basestring) or subst_re.search(confval) is None):
-                    node[key] = val = val.replace(match, str(confval))
-                else:
-                    remaining.append('%s: %s' % (key, val))
-    return remaining
+def _find_references(root, subst_re):
+    """Returns a {path: (node, key, references)} dict of all the string values of a configuration tree that contain
+    references to other configuration keys. Paths are tuples of keys, references (match, referenced path) tuples.
+    """
+    found = {}
+    todo = [((), root)]
+    while todo:
+        path, node = todo.pop()
+        for key, val in node.iteritems():
+            if isinstance(val, collections.Mapping):
+                todo.append((path + (key,), val))
+            elif isinstance(val, basestring):
+                references = [(match, tuple(confkey.split('.'))) for match, confkey in subst_re.findall(val)]
+                if references:
+                    found[path + (key,)] = (node, key, references)
+    return found
 
 
 def resolve_config(cfg):
-    """performs variable substitution in a configuration tree"""
-    remaining = []
-    for _ in range(16):  # 16 maximum substitution passes
-        remaining_prev = remaining
-        remaining = _resolve_config(cfg, __CONF_SUBST_RE)
-        if not remaining or len(remaining) == len(remaining_prev):
-            break
-    if remaining:
-        raise Exception('Incorrect configuration file: could not resolve some configuration variables:  %s' % remaining)
+    """performs variable substitution in a configuration tree
+
+    All %cfg.key% references are collected first; each value is then substituted once, after the values it references
+    (depth first, so that resolving is linear in the number of references). Circular references are reported with
+    their full reference chain.
+    """
+    pending = _find_references(cfg, __CONF_SUBST_RE)
+
+    # referencing a whole sub tree depends on all the values to substitute below it
+    below = collections.defaultdict(list)
+    for path in pending:
+        for length in range(1, len(path)):
+            below[path[:length]].append(path)
+
+    def _dependencies(path):
+        for _, confpath in pending[path][2]:
+            if confpath in pending:
+                yield confpath
+            else:
+                for sub_path in below.get(confpath, ()):
+                    yield sub_path
+
+    visiting, done = object(), object()
+    state = {}
+    unresolved = {}  # path: reason
+
+    def _substitute(path):
+        node, key, references = pending[path]
+        val = node[key]
+        for match, confpath in references:
+            blocked = [dependency for dependency in ([confpath] + below.get(confpath, [])) if dependency in unresolved]
+            if blocked:
+                unresolved[path] = '%s: %s (references unresolved %s)' % ('.'.join(path), val, '.'.join(blocked[0]))
+                return
+            confval = find_node(cfg, confpath)
+            if confval is None:
+                unresolved[path] = '%s: %s (no such configuration key: %s)' % ('.'.join(path), val, '.'.join(confpath))
+                return
+            val = val.replace(match, str(confval))
+        node[key] = val
+
+    for start in pending:
+        if start in state:
+            continue
+        state[start] = visiting
+        stack = [(start, _dependencies(start))]
+        while stack:
+            path, dependencies = stack[-1]
+            for dependency in dependencies:
+                dependency_state = state.get(dependency)
+                if dependency_state is None:
+                    state[dependency] = visiting
+                    stack.append((dependency, _dependencies(dependency)))
+                    break
+                elif dependency_state is visiting:
+                    chain = [item[0] for item in stack]
+                    chain = chain[chain.index(dependency):] + [dependency]
+                    raise Exception('Incorrect configuration file: circular configuration variable references: %s' %
+                                    ' -> '.join('.'.join(item) for item in chain))
+            else:
+                _substitute(path)
+                state[path] = done
+                stack.pop()
+
+    if unresolved:
+        raise Exception('Incorrect configuration file: could not resolve some configuration variables:  %s' %
+                        sorted(unresolved.values()))
 
 
 def automatic_configuration(cligraph, layer_name):
@@ -142,19 +200,83 @@ def automatic_configuration(cligraph, layer_name):
     return auto_data
 
 
+CONF_CACHE_VERSION = 1
+
+
+def _file_fingerprint(filename):
+    """Returns the (mtime, size) of filename, or None if it does not exist"""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+
+def read_compiled_configuration(filename, key):
+    """Read a compiled configuration (merged and resolved configuration, and layers data) if it was compiled from the
+    same inputs (key). Returns None otherwise.
+    """
+    try:
+        with open(filename, 'rb') as fpin:
+            compiled = marshal.load(fpin)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(compiled, dict) or compiled.get('version') != CONF_CACHE_VERSION or compiled.get('key') != key:
+        return None
+    return compiled
+
+
+def write_compiled_configuration(filename, key, cfg, layers):
+    """Atomically save a compiled configuration. Best effort: we'll just read our layers again if this fails"""
+    compiled = {
+        'version': CONF_CACHE_VERSION,
+        'key': key,
+        'cfg': cfg,
+        'layers': dict((layer_name, layer_data[1]) for layer_name, layer_data in layers.items()),
+    }
+    filename_new = filename + '.new'
+    try:
+        data = marshal.dumps(compiled)
+        with open(filename_new, 'wb') as fpout:
+            fpout.write(data)
+        os.rename(filename_new, filename)
+    except (IOError, OSError, ValueError) as exc:  # ValueError: yaml gave us something marshal can't handle
+        logging.debug('Could not save compiled configuration to %s: %s', filename, exc)
+
+
 def read_configuration(cligraph, custom_suffix=''):
     """Read configuration dict for the given tool
+
+    The merged and resolved configuration is cached (conf.cache in the user dotdir), keyed on the automatic layers data
+    and on the mtime and size of each layer file.
     """
 
     cfg = {}
+    dotdir = os.path.abspath(os.path.expanduser('~/.' + cligraph.tool_shortname))
     layers = collections.OrderedDict()
     layers['auto'] = [automatic_configuration, None]
     layers['shared'] = [os.path.join(cligraph.tool_path, 'conf/%s.yaml' % cligraph.tool_shortname), None]
-    layers['custom'] = [os.path.join(os.path.abspath(os.path.expanduser('~/.' + cligraph.tool_shortname)), '%s.yaml%s' % (cligraph.tool_shortname, custom_suffix)), None]
+    layers['custom'] = [os.path.join(dotdir, '%s.yaml%s' % (cligraph.tool_shortname, custom_suffix)), None]
 
+    key = []
     for layer_name, layer_data in layers.items():
         if callable(layer_data[0]):
-            layer = layer_data[0](cligraph, layer_name)
+            layer_data[1] = layer_data[0](cligraph, layer_name)
+            key.append((layer_name, layer_data[1]))
+        else:
+            key.append((layer_name, layer_data[0], _file_fingerprint(layer_data[0])))
+
+    cache_filename = None if custom_suffix else os.path.join(dotdir, 'conf.cache')
+    compiled = cache_filename and read_compiled_configuration(cache_filename, key)
+    if compiled:
+        for layer_name, layer_data in layers.items():
+            if not callable(layer_data[0]):
+                layer_data[1] = compiled['layers'].get(layer_name)
+        return ConfigNode(compiled['cfg']), layers
+
+    for layer_name, layer_data in layers.items():
+        if callable(layer_data[0]):
+            layer = layer_data[1]
         else:
             if not os.path.exists(layer_data[0]):
                 continue
@@ -165,7 +287,10 @@ def read_configuration(cligraph, custom_suffix=''):
             update_recursive(cfg, layer)
 
     resolve_config(cfg)
-    return AttrDict(**cfg), layers
+
+    if cache_filename and os.path.isdir(dotdir):
+        write_compiled_configuration(cache_filename, key, cfg, layers)
+    return ConfigNode(cfg), layers
 
 
 def write_configuration_file(filename, conf):
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Batch mode: run many commands in one process
+
+oc --batch FILE (or - for stdin) reads one command line per line, and runs each command in turn, with the configuration
+and parsers loaded once. Lines are either shell-like command lines, or json records: a list of arguments, or an object
+with an "args" list (or string) and an optional "id". Blank lines and lines starting with # are ignored.
+
+For each command, a json line with its exit status and timing is written to --batch-results FILE, or stderr (the
+commands write to stdout).
+"""
+
+import argparse
+import json
+import shlex
+
+
+BATCH_OPTION = '--batch'
+BATCH_RESULTS_OPTION = '--batch-results'
+VALUE_OPTIONS = (BATCH_OPTION, BATCH_RESULTS_OPTION)  # global options taking a value (the next argument)
+
+
+class BatchCommand(object):
+    """A command read from a batch file"""
+
+    __slots__ = ('line', 'args', 'id', 'error')
+
+    def __init__(self, line, args=None, id=None, error=None):  # pylint:disable=redefined-builtin
+        self.line = line
+        self.args = args
+        self.id = id
+        self.error = error
+
+
+def parse_line(text):
+    """Returns the (args, id) of a batch file line. Raises ValueError if it is not a valid command"""
+    if text[0] in '[{':
+        record = json.loads(text)
+        record_id = None
+        if isinstance(record, dict):
+            record_id = record.get('id')
+            record = record.get('args')
+        if isinstance(record, basestring):
+            record = shlex.split(record.encode('utf-8'))
+        if not isinstance(record, list) or not all(isinstance(arg, basestring) for arg in record):
+            raise ValueError('expected a list of arguments')
+        args = [arg.encode('utf-8') if isinstance(arg, unicode) else arg for arg in record]  # like our argv
+    else:
+        args = shlex.split(text)
+        record_id = None
+    if not args:
+        raise ValueError('empty command')
+    return args, record_id
+
+
+def read_commands(fpin):
+    """Yields a BatchCommand for each command in a batch file; invalid ones have their error set"""
+    for number, text in enumerate(fpin, 1):
+        text = text.strip()
+        if not text or text.startswith('#'):
+            continue
+        try:
+            args, record_id = parse_line(text)
+        except ValueError as exc:
+            yield BatchCommand(number, error=str(exc))
+        else:
+            yield BatchCommand(number, args, record_id)
+
+
+def write_result(fpout, command, status, elapsed, error=None):
+    """Write a command's result as a json line"""
+    result = {'line': command.line, 'args': command.args, 'status': status, 'elapsed': round(elapsed, 6)}
+    if command.id is not None:
+        result['id'] = command.id
+    if error:
+        result['error'] = error
+    fpout.write(json.dumps(result, sort_keys=True) + '\n')
+    fpout.flush()
+
+
+def _is_batch_option(arg):
+    return arg == BATCH_OPTION or arg.startswith(BATCH_OPTION + '=')
+
+
+def parse_options(args):
+    """Spot batch mode in our command line arguments. Returns our batch options, and the other arguments (global
+    options, which apply to every command), or (None, args) if batch mode is not enabled.
+
+    Only our global options - the arguments before the first non-option word - are looked at: a command can have its
+    own --batch option.
+    """
+    position = 0
+    while position < len(args) and args[position].startswith('-') and args[position] != '--':
+        position += 2 if args[position] in VALUE_OPTIONS else 1  # --batch FILE, but also --batch=FILE
+    if not any(_is_batch_option(arg) for arg in args[:position]):
+        return None, args
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(BATCH_OPTION, dest='filename')
+    parser.add_argument('--batch-fork', dest='fork', action='store_true')
+    parser.add_argument(BATCH_RESULTS_OPTION, dest='results')
+    options, global_args = parser.parse_known_args(args[:position])
+    return options, global_args + args[position:]
+
+
+def exit_status(code):
+    """Returns the process exit status of a sys.exit() code"""
+    if code is None:
+        return 0
+    if isinstance(code, (int, long)):
+        return code
+    return 1
@@ -6,10 +6,20 @@
 from cligraphy.core.capture import ptysnoop
 
 from abc import abstractmethod
+import collections
+import logging
+import threading
+import time
+
+
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'coalesce')
 
 
 class Recorder(object):
 
+    records_output = True  # if False, terminal output is forwarded without going through record_server_output
+    event_time = None  # if set, when (as in time.time()) the event being recorded happened - default is now
+
     def start(self):
         pass
 
@@ -49,6 +59,8 @@ class Player(object):
 
 class NoopOutputRecorder(Recorder):
 
+    records_output = False
+
     def output_as_string(self):
         return '(output discarded)'
 
@@ -80,6 +92,212 @@ class BufferingOutputRecorder(Recorder):
         return ''.join(self._buffer)
 
 
+class HeadTailOutputRecorder(Recorder):
+    """Recorder that keeps the first max_head_size bytes of output, and the last max_tail_size bytes of what follows
+    (in a ring buffer). Both buffers are preallocated: recording output does not allocate memory"""
+
+    def __init__(self, max_head_size, max_tail_size):
+        super(HeadTailOutputRecorder, self).__init__()
+        self._head = bytearray(max_head_size)
+        self._head_size = 0
+        self._tail = bytearray(max_tail_size)
+        self._tail_position = 0  # where the next tail byte goes
+        self._tail_size = 0
+        self._total_size = 0
+
+    def record_server_output(self, data):
+        """record terminal output (user + server originated)
+        """
+        self._total_size += len(data)
+        view = memoryview(data)
+
+        if self._head_size < len(self._head):
+            count = min(len(view), len(self._head) - self._head_size)
+            self._head[self._head_size:self._head_size + count] = view[:count]
+            self._head_size += count
+            view = view[count:]
+
+        capacity = len(self._tail)
+        if not len(view) or not capacity:
+            return
+        if len(view) > capacity:
+            view = view[len(view) - capacity:]
+        count = len(view)
+        first = min(count, capacity - self._tail_position)
+        self._tail[self._tail_position:self._tail_position + first] = view[:first]
+        if first < count:
+            self._tail[:count - first] = view[first:]
+        self._tail_position = (self._tail_position + count) % capacity
+        self._tail_size = min(capacity, self._tail_size + count)
+
+    @property
+    def total_size(self):
+        return self._total_size
+
+    @property
+    def elided_size(self):
+        """Number of output bytes recorded in neither the head nor the tail"""
+        return self._total_size - self._head_size - self._tail_size
+
+    def head(self):
+        return str(self._head[:self._head_size])
+
+    def tail(self):
+        if self._tail_size < len(self._tail):
+            return str(self._tail[:self._tail_size])
+        return str(self._tail[self._tail_position:] + self._tail[:self._tail_position])
+
+    def output_as_string(self):
+        if not self.elided_size:
+            return self.head() + self.tail()
+        return '%s\n... [%d bytes elided] ...\n%s' % (self.head(), self.elided_size, self.tail())
+
+
+class AsyncRecorder(Recorder):
+    """Recorder adapter handing events over to another recorder, called from a writer thread: a slow recorder does not
+    delay terminal I/O anymore.
+
+    At most max_queue_events events and max_queue_size bytes are queued. Past that, depending on overflow: block waits
+    for the writer, drop-oldest drops the oldest queued events, and coalesce merges data into the last queued event of
+    the same type (and blocks if that's not enough).
+
+    The queue is a deque (whose appends and pops are atomic) and each counter is only updated by one thread, so
+    queuing an event takes no lock.
+    """
+
+    wait_period = 0.1  # seconds; waiting threads also check for progress that often
+
+    def __init__(self, recorder, overflow='block', max_queue_events=1024, max_queue_size=1024 * 1024):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy [%s], expected one of %s' % (overflow, ', '.join(OVERFLOW_POLICIES)))
+        super(AsyncRecorder, self).__init__()
+        self.recorder = recorder
+        self.overflow = overflow
+        self.max_queue_events = max_queue_events
+        self.max_queue_size = max_queue_size
+        self.queued_size = 0  # bytes queued, dropped or not (updated by the recording thread)
+        self.dropped_size = 0  # bytes dropped (recording thread)
+        self.dropped_events = 0
+        self.coalesced_events = 0
+        self.written_size = 0  # bytes handed over to recorder (writer thread)
+        self._queue = collections.deque()
+        self._queued = threading.Event()
+        self._written = threading.Event()
+        self._thread = None
+        self._failed = False
+
+    @property
+    def records_output(self):
+        return self.recorder.records_output
+
+    @property
+    def pending_size(self):
+        """Number of bytes queued, waiting for the writer thread"""
+        return self.queued_size - self.written_size - self.dropped_size
+
+    def start(self):
+        self.recorder.start()
+        self._thread = threading.Thread(target=self._write_events, name='oc-recorder-thread')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def end(self, exitcode=0):
+        """Wait for the writer thread to write all queued events, and finish the session record
+        """
+        if self._thread is not None:
+            self._queue.append((None, None, None, 0))
+            self._queued.set()
+            self._thread.join()
+        logging.debug('Recorded %d bytes asynchronously (dropped %d bytes in %d events, coalesced %d events)',
+                      self.queued_size, self.dropped_size, self.dropped_events, self.coalesced_events)
+        if not self._failed:
+            self.recorder.event_time = None
+            self.recorder.end(exitcode)
+
+    def record_window_resize(self, lines, columns):
+        self._record('record_window_resize', (lines, columns), 0)
+
+    def record_user_input(self, data):
+        self._record('record_user_input', [data], len(data))
+
+    def record_server_output(self, data):
+        self._record('record_server_output', [data], len(data))
+
+    def _overflows(self, size):
+        pending_size = self.pending_size
+        return len(self._queue) >= self.max_queue_events or (pending_size > 0 and pending_size + size > self.max_queue_size)
+
+    def _record(self, kind, args, size):
+        """Queue an event (a kind - the recorder method to call, a timestamp, args and a size in bytes). The args of
+        data events are a list of data chunks, joined by the writer thread"""
+        event = (kind, time.time(), args, size)
+        while self._overflows(size):
+            if self.overflow == 'drop-oldest' and self._drop_oldest():
+                continue
+            if self.overflow == 'coalesce' and self._coalesce(event):
+                return
+            self._written.clear()
+            if self._overflows(size):
+                self._written.wait(self.wait_period)
+        self._queue.append(event)
+        self.queued_size += size
+        self._queued.set()
+
+    def _drop_oldest(self):
+        """Drop the oldest queued event. Returns False if there was none"""
+        try:
+            _, _, _, size = self._queue.popleft()
+        except IndexError:
+            return False
+        self.dropped_size += size
+        self.dropped_events += 1
+        return True
+
+    def _coalesce(self, event):
+        """Merge event's data into the last queued event, if it's of the same kind and the merged data fits. Returns
+        True if it was merged. Merging appends a chunk: queued data is only copied once, when the writer joins it"""
+        kind, _, args, size = event
+        if size == 0 or self.pending_size + size > self.max_queue_size:
+            return False
+        try:
+            last = self._queue.pop()  # if the writer thread got it first, there's nothing to merge with
+        except IndexError:
+            return False
+        if last[0] != kind:
+            self._queue.append(last)
+            return False
+        last[2].extend(args)  # we own last while it's out of the queue
+        self._queue.append((kind, last[1], last[2], last[3] + size))
+        self.queued_size += size
+        self.coalesced_events += 1
+        self._queued.set()
+        return True
+
+    def _write_events(self):
+        """Writer thread: hand queued events over to recorder, until the end of the session"""
+        while True:
+            self._queued.clear()
+            while True:
+                try:
+                    kind, timestamp, args, size = self._queue.popleft()
+                except IndexError:
+                    break
+                if kind is None:
+                    return
+                if not self._failed:
+                    if isinstance(args, list):  # data chunks
+                        args = (''.join(args),)
+                    self.recorder.event_time = timestamp
+                    try:
+                        getattr(self.recorder, kind)(*args)
+                    except Exception:  # pylint:disable=broad-except
+                        logging.warning('Session recorder failed, not recording anymore', exc_info=True)
+                        self._failed = True
+                self.written_size += size
+                self._written.set()
+            self._queued.wait(self.wait_period)
+
+
 def spawn_and_record(recorder, func, parent_func, *args, **kwargs):
     script = ptysnoop.Script(recorder)
     return script.run(func, parent_func, *args, **kwargs)
@@ -9,6 +9,7 @@ from cligraphy.core.capture.termsize import get_terminal_size, set_terminal_size
 
 import os.path
 import os
+import threading
 import time
 
 
@@ -64,10 +65,11 @@ class CapnpSessionRecorder(capture.Recorder):
         self.out_fp.flush()
         self.last_ts = time.time()
 
-    def _timecode(self):
+    def _timecode(self, now=None):
         """Returns the current time code
         """
-        now = time.time()
+        if now is None:
+            now = self.event_time or time.time()
         ret = max(now - self.last_ts, 0.0)
         self.last_ts = now
         return ret
@@ -79,9 +81,15 @@ class CapnpSessionRecorder(capture.Recorder):
         event.timecode = self._timecode()
         event.type = 'sessionEnd'
         event.status = exitcode
-        event.write_packed(self.out_fp)
+        self._write_event(event)
+        self.close()
+
+    def close(self):
         self.out_fp.close()
 
+    def _write_event(self, event):
+        event.write_packed(self.out_fp)
+
     def record_window_resize(self, lines, columns):
         """Record a window resizing event
         """
@@ -90,7 +98,7 @@ class CapnpSessionRecorder(capture.Recorder):
         event.type = 'windowResized'
         window_size = event.init('windowSize')
         window_size.lines, window_size.columns = lines, columns
-        event.write_packed(self.out_fp)
+        self._write_event(event)
 
     def record_user_input(self, data):
         """record user input separately from terminal output
@@ -99,7 +107,7 @@ class CapnpSessionRecorder(capture.Recorder):
         event.timecode = self._timecode()
         event.type = 'userInput'
         event.data = data
-        event.write_packed(self.out_fp)
+        self._write_event(event)
 
     def record_server_output(self, data):
         """record terminal output (user + server originated)
@@ -108,7 +116,105 @@ class CapnpSessionRecorder(capture.Recorder):
         event.timecode = self._timecode()
         event.type = 'ptyInput'
         event.data = data
-        event.write_packed(self.out_fp)
+        self._write_event(event)
+
+
+class BatchedCapnpSessionRecorder(CapnpSessionRecorder):
+    """Records a pty session, coalescing consecutive user input or terminal output events happening within granularity
+    seconds of the first one into a single event (so replay timing is off by granularity seconds at most), and
+    buffering writes: they happen every flush_period seconds, when max_buffer_size bytes are buffered, and at the end
+    of the session. Recorded sessions are the same format, and play the same
+    """
+
+    def __init__(self, granularity=0.05, flush_period=1.0, max_event_size=65536, max_buffer_size=262144):
+        super(BatchedCapnpSessionRecorder, self).__init__()
+        self.granularity = granularity
+        self.flush_period = flush_period
+        self.max_event_size = max_event_size
+        self.max_buffer_size = max_buffer_size
+        self.pending = None  # event being coalesced: [type, time, timecode, data chunks, size]
+        self.buffer = []
+        self.buffer_size = 0
+        self.lock = threading.RLock()
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+
+    def start(self):
+        super(BatchedCapnpSessionRecorder, self).start()
+        self.flush_thread = threading.Thread(target=self._flush_periodically, name='oc-session-flush-thread')
+        self.flush_thread.daemon = True
+        self.flush_thread.start()
+
+    def end(self, exitcode=0):
+        self.stop_event.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+        with self.lock:
+            self._write_pending()
+            super(BatchedCapnpSessionRecorder, self).end(exitcode)
+
+    def close(self):
+        self.flush()
+        super(BatchedCapnpSessionRecorder, self).close()
+
+    def record_window_resize(self, lines, columns):
+        with self.lock:
+            self._write_pending()
+            super(BatchedCapnpSessionRecorder, self).record_window_resize(lines, columns)
+
+    def record_user_input(self, data):
+        self._record_data('userInput', data)
+
+    def record_server_output(self, data):
+        self._record_data('ptyInput', data)
+
+    def _record_data(self, event_type, data):
+        now = self.event_time or time.time()
+        with self.lock:
+            pending = self.pending
+            if pending is not None and pending[0] == event_type and now - pending[1] <= self.granularity \
+                    and pending[4] + len(data) <= self.max_event_size:
+                pending[3].append(data)
+                pending[4] += len(data)
+                return
+            self._write_pending()
+            self.pending = [event_type, now, self._timecode(now), [data], len(data)]
+
+    def _write_pending(self):
+        """Write the event being coalesced, if any"""
+        if self.pending is None:
+            return
+        event_type, _, timecode, chunks, _ = self.pending
+        self.pending = None
+        event = self.session_capnp.Event.new_message()
+        event.timecode = timecode
+        event.type = event_type
+        event.data = ''.join(chunks)
+        self._write_event(event)
+
+    def _write_event(self, event):
+        data = event.to_bytes_packed()
+        with self.lock:
+            self.buffer.append(data)
+            self.buffer_size += len(data)
+            if self.buffer_size >= self.max_buffer_size:
+                self.flush()
+
+    def flush(self):
+        """Write buffered events to our file"""
+        with self.lock:
+            if self.buffer:
+                self.out_fp.write(''.join(self.buffer))
+                self.out_fp.flush()
+                self.buffer = []
+                self.buffer_size = 0
+
+    def _flush_periodically(self):
+        """Flush thread: write the event being coalesced and buffered events every flush_period seconds"""
+        while not self.stop_event.wait(self.flush_period):
+            with self.lock:
+                self._write_pending()
+                self.flush()
 
 
 class CapnpSessionPlayer(capture.Player):
@@ -8,6 +8,7 @@ Basically a python reimplementation of ye old 'script' utility
 
 import errno
 import fcntl
+import io
 import logging
 import os
 import select
@@ -15,13 +16,22 @@ import signal
 import struct
 import termios
 import threading
-import multiprocessing
 import time
 
 STDIN, STDOUT, STDERR = 0, 1, 2
 DEFAULT_BUFF_SIZE = 128
+MAX_BUFF_SIZE = 65536
 WAKEUP = '!'
 
+# how pty output gets to our stdout when it's not recorded: readinto (through a reused buffer), splice (inside the
+# kernel, linux only), or read (like recorded output). auto is readinto: pty reads are small (a few KiB at most), so
+# splice's extra syscall per read costs more than the copy it saves (see the dev bench capture command)
+FORWARDING_MODES = ('auto', 'splice', 'readinto', 'read')
+
+SPLICE_F_MOVE = 1
+SPLICE_F_NONBLOCK = 2
+_SPLICE = []
+
 
 def xwrite(fileno, data):
     """Write data to fileno
@@ -34,13 +44,114 @@ def xwrite(fileno, data):
         offset += count
 
 
+def _get_splice():
+    """Returns libc's splice function, or None if it's not available"""
+    if not _SPLICE:
+        try:
+            import ctypes
+            splice = ctypes.CDLL(None, use_errno=True).splice
+            splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+            splice.restype = ctypes.c_ssize_t
+            _SPLICE.append((splice, ctypes.get_errno))
+        except (ImportError, OSError, AttributeError):
+            _SPLICE.append(None)
+    return _SPLICE[0]
+
+
+class SpliceForwarder(object):
+    """Moves data from a file descriptor to another inside the kernel, through a pipe (see splice(2), linux only)
+    """
+
+    def __init__(self, size):
+        functions = _get_splice()
+        if functions is None:
+            raise OSError(errno.ENOSYS, 'splice is not available')
+        self.splice, self.get_errno = functions
+        self.size = size
+        self.pipe_r, self.pipe_w = os.pipe()
+
+    def _splice(self, fd_in, fd_out, size, flags):
+        count = self.splice(fd_in, None, fd_out, None, size, flags)
+        if count < 0:
+            error = self.get_errno()
+            raise OSError(error, os.strerror(error))
+        return count
+
+    def forward(self, fd_in, fd_out):
+        """Forward what's available on fd_in to fd_out. Returns the number of bytes forwarded (0 on end of file), or
+        None if nothing was available after all (try again after the next poll)
+        """
+        try:
+            count = self._splice(fd_in, self.pipe_w, self.size, SPLICE_F_MOVE | SPLICE_F_NONBLOCK)
+        except OSError as ose:
+            if ose.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+            return None
+        remaining = count
+        while remaining > 0:
+            try:
+                remaining -= self._splice(self.pipe_r, fd_out, remaining, SPLICE_F_MOVE)
+            except OSError as ose:
+                if ose.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    select.select([], [fd_out], [])  # non blocking fd_out is full: what we read must still get there
+                elif ose.errno == errno.EINVAL:
+                    xwrite(fd_out, os.read(self.pipe_r, remaining))  # fd_out does not support splice, eg. O_APPEND files
+                    remaining = 0
+                else:
+                    raise
+        return count
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class BufferForwarder(object):
+    """Moves data from a file descriptor to another through a reused buffer
+    """
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.readers = {}
+
+    def forward(self, fd_in, fd_out):
+        """Forward what's available on fd_in to fd_out. Returns the number of bytes forwarded (0 on end of file), or
+        None if nothing was available after all (try again after the next poll)
+        """
+        reader = self.readers.get(fd_in)
+        if reader is None:
+            reader = self.readers[fd_in] = io.FileIO(fd_in, 'r', closefd=False)
+        try:
+            count = reader.readinto(self.buffer)
+        except IOError as ioe:
+            raise OSError(ioe.errno, ioe.strerror)
+        if count is None:  # non blocking fd_in
+            return None
+        offset = 0
+        while offset < count:
+            offset += os.write(fd_out, self.view[offset:count])
+        return count
+
+    def close(self):
+        self.readers.clear()
+
+
 class Script(object):
     """A python reimplementation of the script utility
     """
 
-    def __init__(self, recorder, buff_size=DEFAULT_BUFF_SIZE, idle_timeout=0, select_timeout=1):
+    def __init__(self, recorder, buff_size=DEFAULT_BUFF_SIZE, idle_timeout=0, select_timeout=1, max_buff_size=MAX_BUFF_SIZE,
+                 forwarding='auto'):
+        import multiprocessing  # only needed when capturing, while this module is imported on every run
+        if forwarding not in FORWARDING_MODES:
+            raise ValueError('Unknown forwarding mode [%s], expected one of %s' % (forwarding, ', '.join(FORWARDING_MODES)))
         self.recorder = recorder
+        self.forwarding = forwarding
+        self.forwarder = None
         self.buff_size = buff_size
+        self.max_buff_size = max(buff_size, max_buff_size)
+        self.read_sizes = {}
         self.idle_timeout = idle_timeout
         self.select_timeout = select_timeout
         self.activity_stamp = time.time()
@@ -53,10 +164,22 @@ class Script(object):
         self.tcattr = None
         self.wakeup_r, self.wakeup_w = os.pipe()
 
+    def _read(self, fileno):
+        """Read what's available on fileno. Read sizes adapt to throughput: they double (up to max_buff_size) when
+        reads fill them, and halve (down to buff_size) when reads use less than a quarter of them
+        """
+        size = self.read_sizes.get(fileno, self.buff_size)
+        data = os.read(fileno, size)
+        if len(data) == size:
+            self.read_sizes[fileno] = min(size * 2, self.max_buff_size)
+        elif len(data) < size // 4:
+            self.read_sizes[fileno] = max(size // 2, self.buff_size)
+        return data
+
     def _on_stdin_input(self):
         """User typing something
         """
-        data = os.read(STDIN, self.buff_size)
+        data = self._read(STDIN)
 
         if len(data) == 0:  # EOF
             self.stop_event.set()
@@ -64,10 +187,25 @@ class Script(object):
             xwrite(self.master, data)
             self.recorder.record_user_input(data)
 
+    def _get_forwarder(self, mode):
+        """Returns the forwarder to use for pty output in the given forwarding mode, or None if pty output is recorded
+        """
+        if mode == 'read' or getattr(self.recorder, 'records_output', True):
+            return None
+        if mode == 'splice':
+            return SpliceForwarder(self.max_buff_size)
+        return BufferForwarder(self.max_buff_size)
+
     def _on_pty_input(self):
         """Some data has been displayed on screen
         """
-        data = os.read(self.master, self.buff_size)
+        if self.forwarder is not None:
+            count = self.forwarder.forward(self.master, STDOUT)
+            if count == 0:  # None is not end of file: nothing to forward yet
+                self.stop_event.set()
+            return
+
+        data = self._read(self.master)
 
         if len(data) == 0:
             self.stop_event.set()
@@ -75,6 +213,22 @@ class Script(object):
             xwrite(1, data)
             self.recorder.record_server_output(data)
 
+    def _drain_pty(self):
+        """Forward whatever output is left in the pty, eg. after our child exited
+        """
+        fcntl.fcntl(self.master, fcntl.F_SETFL, fcntl.fcntl(self.master, fcntl.F_GETFL) | os.O_NONBLOCK)
+        while True:
+            try:
+                data = os.read(self.master, self.max_buff_size)
+            except OSError as ose:
+                if ose.errno in (errno.EAGAIN, errno.EIO):
+                    return
+                raise
+            if not data:
+                return
+            xwrite(1, data)
+            self.recorder.record_server_output(data)
+
     def _on_wakeup(self):
         """Our main thread woke us up
         """
@@ -99,9 +253,71 @@ class Script(object):
             self.wakeup_r: self._on_wakeup,
         }
 
-        rlist = io_actions.keys()
-
         self.recorder.start()
+        self.forwarder = self._get_forwarder(self.forwarding)
+
+        try:
+            epoll = self._get_epoll(io_actions)
+            if epoll is not None:
+                try:
+                    self._epoll_io_loop(epoll, io_actions)
+                finally:
+                    epoll.close()
+            else:
+                self._select_io_loop(io_actions)
+        finally:
+            if self.forwarder is not None:
+                self.forwarder.close()
+
+        self._drain_pty()
+
+    def _get_epoll(self, io_actions):
+        """Returns an epoll object watching our input file descriptors, or None if epoll is not available (eg. not on
+        linux) or can't watch them (eg. regular files)
+        """
+        if not hasattr(select, 'epoll'):
+            return None
+        epoll = select.epoll()
+        try:
+            for fileno in io_actions:
+                epoll.register(fileno, select.EPOLLIN)
+        except (IOError, OSError):
+            logging.debug('Cannot use epoll, falling back to select', exc_info=True)
+            epoll.close()
+            return None
+        return epoll
+
+    def _epoll_io_loop(self, epoll, io_actions):
+        """epoll based I/O loop: we only wake up on I/O (including our wakeup pipe, on signals), or when our idle timeout
+        expires
+        """
+        while not self.stop_event.is_set():
+            timeout = -1
+            if self.idle_timeout > 0:
+                timeout = max(0, self.activity_stamp + self.idle_timeout - time.time())
+            try:
+                events = epoll.poll(timeout)
+            except IOError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                raise
+
+            if events:
+                self.activity_stamp = time.time()
+            elif self.idle_timeout > 0 and time.time() >= self.activity_stamp + self.idle_timeout:
+                self.stop_event.set()
+
+            for active_fd, _ in events:
+                try:
+                    io_actions[active_fd]()
+                except OSError as ose:
+                    assert ose.errno != errno.EINTR, 'Should not be getting interrupted syscalls in thread'
+                    raise
+
+    def _select_io_loop(self, io_actions):
+        """select based I/O loop, polling with a timeout of select_timeout seconds
+        """
+        rlist = io_actions.keys()
 
         while not self.stop_event.is_set():
             try:
@@ -5,18 +5,16 @@
 
 """Command line tools entry point."""
 
-from cligraphy.core import capture, decorators, read_configuration, ctx
+from cligraphy.core import batch, capture, decorators, read_configuration, ctx, trace
+from cligraphy.core.completion import fast_complete, get_completion_words
+from cligraphy.core.discovery import imap_isolated
 from cligraphy.core.log import setup_logging
-from cligraphy.core.parsers import AutoDiscoveryCommandMap, SmartCommandMapParser, ParserError, CustomDescriptionFormatter
+from cligraphy.core.parsers import AutoDiscoveryCommandMap, ExecCommandMap, SmartCommandMapParser, ParserError, CustomDescriptionFormatter, \
+    FUZZY_PARSED, RECENT_SUB_PARSERS, UNAVAILABLE_MODULES, warn_unavailable_modules
 from cligraphy.core.reporting import ToolsPadReporter, NoopReporter
-from cligraphy.core.util import undecorate_func, pdb_wrapper, profiling_wrapper, call_chain
+from cligraphy.core.util import pdb_wrapper, profiling_wrapper, call_chain, memoize, when_imported, call_convention, \
+    CALL_NONE, CALL_KWARGS
 
-from remember.memoize import memoize
-
-import faulthandler
-from setproctitle import setproctitle  # pylint:disable=no-name-in-module
-
-import argcomplete
 import argparse
 import logging
 import logging.config
@@ -24,6 +22,7 @@ import os
 import signal
 import subprocess
 import sys
+import time
 
 
 def _warn_about_bad_non_ascii_chars(args):
@@ -63,6 +62,20 @@ def _warn_about_bad_path(env_root, path):
         return
 
 
+@memoize
+def _register_fault_handler():
+    """Dump tracebacks on SIGUSR2 - once per process"""
+    import faulthandler
+    faulthandler.register(signal.SIGUSR2, all_threads=True, chain=False)  # pylint:disable=no-member
+
+
+def _setup_process(title):
+    """Set our process title, and dump tracebacks on SIGUSR2"""
+    from setproctitle import setproctitle  # pylint:disable=no-name-in-module
+    setproctitle(title)
+    _register_fault_handler()
+
+
 class _VersionAction(argparse.Action):
     """Shows last commit information"""
     def __call__(self, *args, **kwargs):
@@ -77,6 +90,9 @@ class _VersionAction(argparse.Action):
 
 class Cligraph(object):
     reporter_cls = ToolsPadReporter
+    lazy_parser = True  # only build the sub-parsers needed by the command line being parsed
+    build_processes = None  # autodiscover commands modules in that many worker processes (default: cpu count; 1: serially)
+    build_timeout = 600  # seconds autodiscovering a commands module can take in a worker process
 
     def __init__(self, name, shortname, path):
         assert name
@@ -85,9 +101,21 @@ class Cligraph(object):
         self.tool_name = name
         self.tool_shortname = shortname
         self.tool_path = path
-        self.conf, self.conf_layers = read_configuration(self)
-        ctx.cligraph = self
+        self.configure()
         self.reporter = None
+        self._audit_command = None  # the command our requests audit headers name
+
+    def configure(self):
+        """Start startup tracing (if enabled) and read our configuration, for the current command line and environment.
+        Zygote children call it again, with the command line and environment of their client"""
+        if trace.is_enabled(self.tool_shortname):
+            trace.start('%s %s' % (self.tool_shortname, ' '.join(sys.argv[1:])), self.get_trace_filename)
+        with trace.span('read_configuration'):
+            self.conf, self.conf_layers = read_configuration(self)
+        ctx.cligraph = self
+
+    def get_trace_filename(self):
+        return os.path.join(self.conf.user.dotdir, 'startup-trace.json')
 
     def setup_reporter(self, args):
         """
@@ -106,45 +134,47 @@ class Cligraph(object):
 
     # FIXME(stf/oss): header names for octools
     def _setup_requests_audit_headers(self, command):
-        """Setup requests user-agent and x-user/x-app headers.
+        """Setup requests user-agent and x-user/x-app headers, once (and if) the command imports requests.
+        requests is only patched once per process; the headers name the current command (batch mode runs many).
         Just best effort - we don't care that much if this fails"""
-        try:
-            import requests
-            def _default_user_agent(*args):
-                return 'requests (cligraphy/%s)' % command
-            requests.utils.default_user_agent = _default_user_agent
-
-            base_default_headers = requests.utils.default_headers
-            def _default_headers(*args):
-                headers = base_default_headers()
-                headers['X-User'] = os.getenv('USER')
-                headers['X-App'] = 'cligraphy/%s' % command
-                return headers
-            requests.utils.default_headers = _default_headers
-            requests.sessions.default_headers = _default_headers
-        except:
-            logging.warn("Could set up requests audit headers, continuing anyway")
-            pass
+        already_setup = self._audit_command is not None
+        self._audit_command = command
+        if already_setup:
+            return
+
+        def _setup(requests):
+            try:
+                def _default_user_agent(*args):
+                    return 'requests (cligraphy/%s)' % self._audit_command
+                requests.utils.default_user_agent = _default_user_agent
+
+                base_default_headers = requests.utils.default_headers
+                def _default_headers(*args):
+                    headers = base_default_headers()
+                    headers['X-User'] = os.getenv('USER')
+                    headers['X-App'] = 'cligraphy/%s' % self._audit_command
+                    return headers
+                requests.utils.default_headers = _default_headers
+                requests.sessions.default_headers = _default_headers
+            except:
+                logging.warn("Could set up requests audit headers, continuing anyway")
+                pass
+        when_imported('requests', _setup)
 
     # pylint:disable=protected-access
     def _run(self, args):
-        """Run command by calling the main() function correctly (how we pass args depends on its actual signature)."""
-        # if the main method has been decorated, we need to look at the original function's argspec (but call the wrapper)
-        import inspect
-        orig_func, _ = undecorate_func(args._func)
-        argspec = inspect.getargspec(orig_func)
-        if len(argspec.args) == 0:
+        """Run command by calling the main() function correctly (how we pass args depends on its actual signature,
+        which autodiscovery records in the command map; we only introspect main() if it's not there)."""
+        convention, params = getattr(args, '_call', None) or call_convention(args._func)
+        if convention == CALL_NONE:
             return args._func()
-        elif argspec.varargs or argspec.keywords or len(argspec.args) > 1:
-            kwargs = dict(**vars(args))
-            for kw in kwargs.keys():
-                if kw.startswith('_'):
-                    logging.debug('removing internal arg %s', kw)
-                    del kwargs[kw]
+        elif convention == CALL_KWARGS:
+            if params is None:
+                kwargs = dict((kw, val) for kw, val in vars(args).iteritems() if not kw.startswith('_'))
+            else:
+                kwargs = dict((name, getattr(args, name)) for name in params if hasattr(args, name))
             return args._func(**kwargs)
         else:
-            if argspec.args[0] != 'args':
-                raise Exception('Programming error in command: if main() only has one argument it must be called "args"')
             func = args._func
             for kw in vars(args).keys():
                 if kw.startswith('_') and kw not in ('_parser', '_cligraph'):  #FIXME(stf/oss) maybe just expose cligraph
@@ -152,14 +182,15 @@ class Cligraph(object):
                     delattr(args, kw)
             return func(args)
 
-    def _run_command_process(self, args):
-        """Command (child) process entry point. args contains the function to execute and all arguments."""
+    def _run_command_process(self, args, batch_mode=False):
+        """Command (child) process entry point. args contains the function to execute and all arguments.
+        In batch mode, logging is set up once for the whole batch (see run_batch)."""
 
-        setup_logging(args._level)
+        if not batch_mode:
+            setup_logging(args._level)
 
         command = ' '.join(sys.argv[1:])
-        setproctitle('oc/command/%s' % command)
-        faulthandler.register(signal.SIGUSR2, all_threads=True, chain=False)  # pylint:disable=no-member
+        _setup_process('oc/command/%s' % command)
         self._setup_requests_audit_headers(command)
 
         ret = 1
@@ -185,6 +216,9 @@ class Cligraph(object):
         NB! counter-intuitively, this function also messes around with logging levels.
         """
 
+        if '_ARGCOMPLETE' in os.environ:
+            fast_complete(self)  # completes command and namespace names straight from our command maps
+
         # We want some of our options to take effect as early as possible, as they affect command line parsing.
         # For these options we resort to some ugly, basic argv spotting
 
@@ -200,9 +234,39 @@ class Cligraph(object):
             logging.debug('Autodiscover enabled')
             autodiscover = True
 
+        with trace.span('get_command_maps'):
+            command_maps = self.get_command_maps(autodiscover)
+
+        with trace.span('build parser'):
+            parser = self._build_parser(command_maps)
+
+        if '_ARGCOMPLETE' in os.environ:
+            # completion works off the parser tree, so build the parts of it the line being completed goes through,
+            # including the actual parser of the command whose options or arguments are being completed
+            words = get_completion_words()
+            parser.finish_command(words[0] if words else os.getenv('COMP_LINE', '').split()[1:])
+            import argcomplete
+            argcomplete.autocomplete(parser)
+
+        _warn_about_bad_non_ascii_chars(sys.argv)
+        _warn_about_bad_path(os.getenv('VIRTUAL_ENV'), os.getenv('PATH'))
+
+        with trace.span('parse command line'):
+            args = parser.parse_args()
+        args._parser = parser  # deprecated
+
+        # pylint:disable=protected-access
+        if args._level is not None:
+            logging.getLogger().setLevel(args._level)
+
+        return args
+
+    def _build_parser(self, command_maps):
+        """Build our top level parser, with the given command maps"""
         parser = SmartCommandMapParser(prog=self.tool_shortname,
                                        description="Cligraphy command line tools",
-                                       formatter_class=CustomDescriptionFormatter)
+                                       formatter_class=CustomDescriptionFormatter,
+                                       lazy=self.lazy_parser)
 
         self.parser = parser  # expose to eg. ctx
 
@@ -215,57 +279,109 @@ class Cligraph(object):
         parser.add_argument("--profile", help="enable profiling", dest="_profile", action="store_true", default=False)
         parser.add_argument("--autodiscover", help="re-discover commands and refresh cache (default: read cached commands list)", dest="_autodiscover", action="store_true")
         parser.add_argument("-v", "--verbose", help="enable informational output", dest="_level", action="store_const", const=logging.INFO)
+        parser.add_argument(trace.TRACE_OPTION, help="print where startup time goes, and save it as a chrome trace", dest="_trace_startup", action="store_true")
+        parser.add_argument(batch.BATCH_OPTION, help="run the commands listed in FILE (- for stdin), one per line", metavar="FILE", dest="_batch")
+        parser.add_argument("--batch-fork", help="batch mode: run each command in its own process", dest="_batch_fork", action="store_true")
+        parser.add_argument(batch.BATCH_RESULTS_OPTION, help="batch mode: write results to this file (default: stderr, keeping them apart from the commands output)", metavar="FILE", dest="_batch_results")
 
-        for namespace, command_map in self.get_command_maps(autodiscover):
+        for namespace, command_map in command_maps:
             parser.add_command_map(namespace, command_map)
 
-        argcomplete.autocomplete(parser)
-
-        _warn_about_bad_non_ascii_chars(sys.argv)
-        _warn_about_bad_path(os.getenv('VIRTUAL_ENV'), os.getenv('PATH'))
-
-        args = parser.parse_args()
-        args._parser = parser  # deprecated
-
-        # pylint:disable=protected-access
-        if args._level is not None:
-            logging.getLogger().setLevel(args._level)
-
-        return args
+        return parser
 
-    @memoize()
-    def get_command_maps(self, autodiscover=False):
+    @memoize
+    def get_command_maps(self, autodiscover=False, discovery=None):
         """Get all the command maps defined in our configuration.
 
         If autodiscover is True (defaults to False), python commands will be autodiscovered (instead of simply being obtained
-        from a cached command map).
+        from a cached command map). Python commands modules are then autodiscovered concurrently, in worker processes
+        (see build_processes); results are still returned in configuration order.
 
         :param autodiscover: (default - `False`) Whether or not to autodiscover commands
         :type autodiscover: bool
+        :param discovery: (default - `None`) Discovery mode (import, parallel or static) to use instead of the configured one
+        :type discovery: str
         :return: A dictionary containing the command map
         :rtype: dict
         """
 
+        built = {}
+        if autodiscover and self.build_processes != 1:
+            built = self._build_command_maps_concurrently(discovery)
+
         result = []
         for module, options in self.conf.commands.items():
             try:
-                if options is None:
-                    options = {}
-                logging.debug('Configuring commands module %s with options %s', module, options)
-
-                opt_type = options.get('type', 'python')
-                opt_namespace = options.get('namespace', '')
-
-                if opt_type == 'python':
-                    result.append((opt_namespace, AutoDiscoveryCommandMap(self, module).build(force_autodiscover=autodiscover)))
+                if module in built:
+                    if built[module] is not None:
+                        raise Exception(built[module])
+                    # autodiscovered by a worker process, which saved it to its cache
+                    result.append(self._get_command_map(module, options, False, discovery))
                 else:
-                    raise Exception('Dont know how to handle commands module with type [%s]', opt_type)
+                    result.append(self._get_command_map(module, options, autodiscover, discovery))
             except Exception as exc:  # pylint:disable=broad-except
                 logging.warning('Could not configure commands module [%s] defined in configuration: %s. Skipping it.', module, exc,
-                                exc_info=True)
+                                exc_info=module not in built)
 
         return result
 
+    def _get_command_map(self, module, options, autodiscover, discovery):
+        """Returns the (namespace, command map) tuple of a commands module defined in our configuration"""
+        if options is None:
+            options = {}
+        logging.debug('Configuring commands module %s with options %s', module, options)
+
+        opt_type = options.get('type', 'python')
+        opt_namespace = options.get('namespace', '')
+        opt_cache_format = options.get('cache_format', 'json')
+        opt_discovery = discovery or options.get('discovery', 'import')
+
+        if opt_type == 'python':
+            command_map = AutoDiscoveryCommandMap(self, module, cache_format=opt_cache_format, discovery=opt_discovery)
+        elif opt_type == 'exec':
+            command_map = ExecCommandMap(self, module, options.get('paths'), help_source=options.get('help', 'header'))
+        else:
+            raise Exception('Dont know how to handle commands module with type [%s]', opt_type)
+        return opt_namespace, command_map.build(force_autodiscover=autodiscover)
+
+    def _build_command_maps_concurrently(self, discovery):
+        """Autodiscover our python commands modules in worker processes, which save them to their caches.
+        Returns a dict of module name to None (built) or error message, for the modules we could build that way.
+        Workers send back the modules they found unavailable, which are added to UNAVAILABLE_MODULES."""
+        modules = []
+        for module, options in self.conf.commands.items():
+            options = options or {}
+            if options.get('type', 'python') == 'python' and \
+                    AutoDiscoveryCommandMap(self, module, cache_format=options.get('cache_format', 'json')).can_write_cache():
+                modules.append(module)
+        if len(modules) < 2:
+            return {}
+
+        def _build(module):
+            inherited = len(UNAVAILABLE_MODULES)
+            AutoDiscoveryCommandMap.warn_unavailable = False  # we're in a worker process: our parent warns
+            result = {'retire': True}
+            try:
+                self._get_command_map(module, self.conf.commands[module], True, discovery)
+            except Exception as exc:  # pylint:disable=broad-except
+                logging.debug('Could not build commands module %s', module, exc_info=True)
+                result['error'] = '%s: %s' % (exc.__class__.__name__, exc)
+            result['unavailable'] = UNAVAILABLE_MODULES[inherited:]
+            return result
+
+        logging.debug('Autodiscovering commands modules %s concurrently', modules)
+        built = {}
+        unavailable = []
+        # workers are not daemons: they can start their own workers (parallel discovery)
+        for module, result in imap_isolated(_build, modules, processes=self.build_processes, timeout=self.build_timeout,
+                                            daemon=False):
+            built[module] = result.get('error')
+            unavailable.extend(result.get('unavailable', ()))
+        if unavailable:
+            UNAVAILABLE_MODULES.extend(unavailable)
+            warn_unavailable_modules(unavailable)
+        return built
+
     def before_command_start(self, args, recorder):
         """Called after the args have been parsed but before the command starts
         Reports command start using the configured reporter, sets the process
@@ -281,8 +397,7 @@ class Cligraph(object):
         #   unless the report.enabled conf key is false
         self.reporter.report_command_start(sys.argv)
 
-        setproctitle('oc/parent/%s' % ' '.join(sys.argv[1:]))
-        faulthandler.register(signal.SIGUSR2, all_threads=True, chain=False)  # pylint:disable=no-member
+        _setup_process('oc/parent/%s' % ' '.join(sys.argv[1:]))
 
     def after_command_finish(self, args, recorder, status):
         """Called after a command has finished running.
@@ -298,16 +413,123 @@ class Cligraph(object):
         """
         # report execution details
         self.reporter.report_command_exit(status)
-        self.reporter.report_command_output(recorder.output_as_string())  # TODO(stefan): also report total output size
+        # head and tail of the output, with the number of bytes elided in between if any
+        self.reporter.report_command_output(recorder.output_as_string())
         self.reporter.stop()
 
+    def _fork_command_process(self, args, parent_func, batch_mode=False):
+        """Run the command process in a child process (calling parent_func in ours once it's started), without capture.
+        Returns its exit status."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._run_command_process(args, batch_mode)
+            except SystemExit as exc:
+                status = batch.exit_status(exc.code)
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)  # pylint:disable=protected-access
+        parent_func()
+        _, wait_status = os.waitpid(pid, 0)
+        return os.WEXITSTATUS(wait_status) if os.WIFEXITED(wait_status) else 128 + os.WTERMSIG(wait_status)
+
+    def _run_batch_command(self, parser, args, fork, level):
+        """Parse and run one batch mode command, the way main() does (minus capture), at the given logging level
+        unless the command line sets its own. Returns its exit status"""
+        del FUZZY_PARSED[:]
+        del RECENT_SUB_PARSERS[:]
+        try:
+            args = parser.parse_args(args)
+        except ParserError as pe:
+            try:
+                pe.report()
+            except SystemExit as exc:
+                return batch.exit_status(exc.code)
+        except SystemExit as exc:  # eg. --help
+            return batch.exit_status(exc.code)
+
+        logging.getLogger().setLevel(level if args._level is None else args._level)
+        self.setup_reporter(args)
+        recorder = capture.NoopOutputRecorder()
+        self.before_command_start(args, recorder)
+
+        if fork or getattr(args, '_exec', None):  # exec type commands replace the process they run in
+            status = self._fork_command_process(args, self.reporter.start, batch_mode=True)
+        else:
+            self.reporter.start()
+            try:
+                self._run_command_process(args, batch_mode=True)
+            except SystemExit as exc:
+                status = batch.exit_status(exc.code)
+            sys.stdout.flush()
+
+        self.after_command_finish(args, recorder, status)
+        return status
+
+    def run_batch(self, options, global_args):
+        """Batch mode entry point: run the commands listed in options.filename, with our configuration and parsers
+        loaded once. global_args (our global options) are prepended to each command line.
+        Results are written to options.results, or stderr. Returns 0 if all commands succeeded, 1 otherwise.
+        """
+        try:
+            fpin = sys.stdin if options.filename == '-' else open(options.filename)
+        except IOError as exc:
+            logging.error('Could not read batch file: %s', exc)
+            return 1
+        try:
+            fpout = open(options.results, 'w') if options.results else sys.stderr
+        except IOError as exc:
+            logging.error('Could not write batch results: %s', exc)
+            if fpin is not sys.stdin:
+                fpin.close()
+            return 1
+
+        with trace.span('get_command_maps'):
+            command_maps = self.get_command_maps('--autodiscover' in global_args)
+        with trace.span('build parser'):
+            parser = self._build_parser(command_maps)
+
+        argv = sys.argv
+        level = logging.getLogger().level  # main() set up logging, once for all our commands
+        failed = 0
+        try:
+            for command in batch.read_commands(fpin):
+                start = time.time()
+                if command.error:
+                    logging.error('Line %d: invalid command: %s', command.line, command.error)
+                    status = 2
+                else:
+                    sys.argv = [argv[0]] + command.args  # for our hooks, process titles and reporting
+                    with trace.span('batch line %d' % command.line):
+                        status = self._run_batch_command(parser, global_args + command.args, options.fork, level)
+                batch.write_result(fpout, command, status, time.time() - start, command.error)
+                failed += status != 0
+        finally:
+            sys.argv = argv
+            logging.getLogger().setLevel(level)
+            if fpin is not sys.stdin:
+                fpin.close()
+            if fpout is not sys.stderr:
+                fpout.close()
+        return 1 if failed else 0
+
     def main(self):
         """Main oc wrapper entry point."""
 
-        setup_logging()
+        with trace.span('setup_logging'):
+            setup_logging()
+
+        options, global_args = batch.parse_options(sys.argv[1:])
+        if options is not None:
+            return self.run_batch(options, global_args)
 
         try:
-            args = self._parse_args()
+            with trace.span('parse_args'):
+                args = self._parse_args()
             logging.debug("Parsed args: %r", vars(args))
         except ParserError as pe:
             pe.report()
@@ -316,7 +538,8 @@ class Cligraph(object):
             logging.info('stdin or stdout is not a tty, disabling capture')
             args._capture = False
 
-        self.setup_reporter(args)
+        with trace.span('setup_reporter'):
+            self.setup_reporter(args)
 
         decs = decorators.get_tags(args._func)
         logging.debug("Decorator tags: %s", decs)
@@ -324,23 +547,33 @@ class Cligraph(object):
         if decorators.Tag.interactive in decs or not args._capture:
             recorder = capture.NoopOutputRecorder()
         else:
-            recorder = capture.BufferingOutputRecorder(max_output_size=self.conf.report.max_output_size)
+            recorder = capture.HeadTailOutputRecorder(max_head_size=self.conf.report.max_output_size,
+                                                      max_tail_size=self.conf.report.get('max_output_tail_size', 0))
 
-        self.before_command_start(args, recorder)
+        with trace.span('before_command_start'):
+            self.before_command_start(args, recorder)
 
         if args._capture:
             # go ahead and run out command in a child process, recording all I/O
             logging.debug('Parent process %d ready to execute command process', os.getpid())
-            status = capture.spawn_and_record(recorder, self._run_command_process,
-                                              self.reporter.start, args)
+            with trace.span('command (capture)'):
+                status = capture.spawn_and_record(recorder, self._run_command_process,
+                                                  self.reporter.start, args)
             logging.debug('Command process exited with status %r', status)
+        elif getattr(args, '_exec', None) and not isinstance(self.reporter, NoopReporter):
+            # exec type commands replace the process they run in: run them in a child, to report their exit
+            with trace.span('command (fork)'):
+                status = self._fork_command_process(args, self.reporter.start)
         else:
-            self.reporter.start()
+            with trace.span('reporter start'):
+                self.reporter.start()
             try:
-                self._run_command_process(args)
+                with trace.span('command'):
+                    self._run_command_process(args)
             except SystemExit as exc:
                 status = exc.code
 
-        self.after_command_finish(args, recorder, status)
+        with trace.span('after_command_finish'):
+            self.after_command_finish(args, recorder, status)
 
         return status
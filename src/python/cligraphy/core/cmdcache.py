@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Command map cache formats
+
+The index format is a compact, precomputed representation of a command map that can be memory mapped and searched
+without deserializing the whole command tree. Layout (all integers are little endian uint32):
+
+- header: magic, node count, nodes offset, strings offset, module name offset and length
+- nodes: fixed size records (name, help and desc string references, flags, first child index, child count, main()
+  parameter names string reference). Nodes are laid out breadth first, so the children of a node are contiguous and
+  sorted by name. Command flags include main()'s calling convention
+- strings: utf-8 string table, referenced by (offset, length) pairs
+
+Either way, command maps are sharded: a small json manifest lists top level commands, and each top level package is
+saved in its own shard, only loaded when the command line goes through it.
+"""
+
+from cligraphy.core.util import CALL_NONE, CALL_ARGS, CALL_KWARGS
+
+import collections
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+
+INDEX_MAGIC = 'OCCIDX02'
+INDEX_HEADER = struct.Struct('<8sIIIII')
+INDEX_NODE = struct.Struct('<IIIIIIIIIII')
+
+FLAG_CMD = 1
+FLAG_ERROR = 2
+FLAG_CALL_NONE = 4
+FLAG_CALL_ARGS = 8
+FLAG_CALL_KWARGS = 16
+FLAG_CALL_PARAMS = 32  # CALL_KWARGS with a list of parameter names
+
+CALL_FLAGS = ((CALL_NONE, FLAG_CALL_NONE), (CALL_ARGS, FLAG_CALL_ARGS), (CALL_KWARGS, FLAG_CALL_KWARGS))
+
+MANIFEST_VERSION = 1
+
+
+def _utf8(value):
+    """Encode a (possibly unicode) string to utf-8"""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def is_command(node):
+    """Returns True if a command map node is a command, False if it's a namespace. Lazy namespaces (index nodes and
+    shards) tell without being loaded or searched
+    """
+    return not getattr(node, 'is_namespace', False) and node.get('type') == 'cmd'
+
+
+class _StringTable(object):
+    """Deduplicating string table builder"""
+
+    def __init__(self):
+        self.offsets = {}
+        self.parts = []
+        self.size = 0
+
+    def add(self, value):
+        """Add a string to the table, returning its (offset, length)"""
+        data = _utf8(value or '')
+        offset = self.offsets.get(data)
+        if offset is None:
+            offset = self.offsets[data] = self.size
+            self.parts.append(data)
+            self.size += len(data)
+        return offset, len(data)
+
+
+def write_command_index(filename, command_map):
+    """Write a command map to filename, in index format"""
+    strings = _StringTable()
+    records = [('', command_map['commands'])]
+    nodes = []
+    position = 0
+    while position < len(records):
+        name, node = records[position]
+        name_ref = strings.add(name)
+        params_ref = (0, 0)
+        if is_command(node):
+            flags = FLAG_CMD | (FLAG_ERROR if node.get('error') else 0)
+            help_ref = strings.add(node.get('help'))
+            desc_ref = strings.add(node.get('desc'))
+            first_child, child_count = 0, 0
+            if node.get('call'):
+                convention, params = node['call']
+                flags |= dict(CALL_FLAGS)[convention]
+                if params is not None:
+                    flags |= FLAG_CALL_PARAMS
+                    params_ref = strings.add(' '.join(params))
+        else:
+            flags = 0
+            help_ref = desc_ref = (0, 0)
+            children = sorted(node.iteritems(), key=lambda item: _utf8(item[0]))
+            first_child, child_count = len(records), len(children)
+            records.extend(children)
+        nodes.append(INDEX_NODE.pack(name_ref[0], name_ref[1], help_ref[0], help_ref[1], desc_ref[0], desc_ref[1],
+                                     flags, first_child, child_count, params_ref[0], params_ref[1]))
+        position += 1
+
+    module_ref = strings.add(command_map['module'])
+    nodes_offset = INDEX_HEADER.size
+    strings_offset = nodes_offset + len(nodes) * INDEX_NODE.size
+
+    with open(filename, 'wb') as fpout:
+        fpout.write(INDEX_HEADER.pack(INDEX_MAGIC, len(nodes), nodes_offset, strings_offset, module_ref[0], module_ref[1]))
+        fpout.write(''.join(nodes))
+        fpout.write(''.join(strings.parts))
+
+
+class CommandIndex(object):
+    """Read-only, memory mapped command map in index format"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fpin:
+            if os.fstat(fpin.fileno()).st_size < INDEX_HEADER.size:
+                raise ValueError('%s is not a command index (too short)' % filename)
+            self.mmap = mmap.mmap(fpin.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.node_count, self.nodes_offset, self.strings_offset, module_offset, module_length = \
+            INDEX_HEADER.unpack_from(self.mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('%s is not a command index (bad magic)' % filename)
+        self.module = self.string(module_offset, module_length)
+
+    def node(self, index):
+        """Returns the raw node record tuple at the given index"""
+        return INDEX_NODE.unpack_from(self.mmap, self.nodes_offset + index * INDEX_NODE.size)
+
+    def raw_string(self, offset, length):
+        start = self.strings_offset + offset
+        return self.mmap[start:start + length]
+
+    def string(self, offset, length):
+        return self.raw_string(offset, length).decode('utf-8')
+
+    def find_child(self, index, name):
+        """Binary search the children of node index for name. Returns the child node index, or None"""
+        wanted = _utf8(name)
+        record = self.node(index)
+        low, high = record[7], record[7] + record[8]
+        while low < high:
+            middle = (low + high) // 2
+            child = self.node(middle)
+            child_name = self.raw_string(child[0], child[1])
+            if child_name < wanted:
+                low = middle + 1
+            elif child_name > wanted:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def item(self, index):
+        """Returns a (name, node) tuple for the given node index, decoding only that node"""
+        record = self.node(index)
+        name = self.string(record[0], record[1])
+        flags = record[6]
+        if flags & FLAG_CMD:
+            data = {'type': 'cmd', 'help': self.string(record[2], record[3]), 'desc': self.string(record[4], record[5])}
+            if flags & FLAG_ERROR:
+                data['error'] = True
+            for convention, flag in CALL_FLAGS:
+                if flags & flag:
+                    params = self.string(record[9], record[10]).split() if flags & FLAG_CALL_PARAMS else None
+                    data['call'] = [convention, params]
+            return name, data
+        return name, IndexNode(self, index)
+
+    def command_map(self):
+        """Returns a command map backed by this index"""
+        return {'module': self.module, 'commands': IndexNode(self, 0)}
+
+
+class IndexNode(collections.Mapping):
+    """Namespace node of a CommandIndex, behaving like the equivalent command map dict"""
+
+    is_namespace = True
+
+    def __init__(self, index, position):
+        self.index = index
+        self.position = position
+
+    def _children(self):
+        record = self.index.node(self.position)
+        return xrange(record[7], record[7] + record[8])
+
+    def __getitem__(self, name):
+        child = self.index.find_child(self.position, name)
+        if child is None:
+            raise KeyError(name)
+        return self.index.item(child)[1]
+
+    def __contains__(self, name):
+        return self.index.find_child(self.position, name) is not None
+
+    def __iter__(self):
+        for child in self._children():
+            record = self.index.node(child)
+            yield self.index.string(record[0], record[1])
+
+    def __len__(self):
+        return self.index.node(self.position)[8]
+
+    def iteritems(self):
+        for child in self._children():
+            yield self.index.item(child)
+
+    def items(self):
+        return list(self.iteritems())
+
+
+def shard_digest(node):
+    """Returns a digest of a command map node, to tell whether its shard changed"""
+    return hashlib.sha1(json.dumps(node, sort_keys=True)).hexdigest()
+
+
+class CommandShard(collections.Mapping):
+    """Namespace node of a sharded command map, loaded (by calling load) on first access"""
+
+    is_namespace = True
+
+    def __init__(self, load):
+        self._load = load
+        self._node = None
+
+    @property
+    def node(self):
+        if self._node is None:
+            self._node = self._load()
+        return self._node
+
+    def __getitem__(self, name):
+        return self.node[name]
+
+    def __contains__(self, name):
+        return name in self.node
+
+    def __iter__(self):
+        return iter(self.node)
+
+    def __len__(self):
+        return len(self.node)
+
+    def iteritems(self):
+        return self.node.iteritems()
+
+    def items(self):
+        return list(self.iteritems())
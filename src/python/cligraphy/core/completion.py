@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Shell completion fast path
+
+Completing command and namespace names only needs the cached command maps: we answer those directly, speaking
+argcomplete's protocol, without building any argparse parser or even importing argcomplete. Anything else (options,
+command arguments, quoted words) goes through argcomplete, with the parsers of the command being completed.
+"""
+
+from cligraphy.core.batch import VALUE_OPTIONS
+from cligraphy.core.parsers import LazyCommandLevel
+
+import logging
+import os
+
+
+def get_completion_words():
+    """Returns the (words before the cursor, word being completed) of the command line being completed, or None if
+    it's not simple enough for us, eg. if it uses quotes or escapes.
+    """
+    line = os.environ.get('COMP_LINE', '')
+    point = int(os.environ.get('COMP_POINT', len(line)))
+    line = line[:point]
+    if any(char in line for char in '\'"\\'):
+        return None
+    words = line.split()
+    if line and not line[-1].isspace():
+        current = words.pop()
+    else:
+        current = ''
+    start = int(os.environ.get('_ARGCOMPLETE', 1))  # number of words before our arguments (eg. "python -m x" is 3)
+    return words[start:], current
+
+
+def _unicode(value):
+    """Decode a (possibly utf-8 byte) string to unicode"""
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def get_command_tree(command_maps):
+    """Returns the root LazyCommandLevel for the given (namespace, command map) tuples"""
+    root = LazyCommandLevel('')
+    for namespace, command_map in command_maps:
+        level = root.namespace(namespace) if namespace else root
+        level.add_source(command_map['module'], command_map['commands'])
+    return root
+
+
+def complete_command_names(command_maps, words, current):
+    """Returns a (name, help) tuple for each command or namespace name completing current after words, or None if
+    current is not a command or namespace name (eg. we're completing the options or arguments of a command).
+    """
+    if current.startswith('-') or (words and words[-1] in VALUE_OPTIONS):
+        return None
+    level = get_command_tree(command_maps)
+    option_value = False
+    for word in words:
+        if option_value:
+            option_value = False
+            continue
+        if word.startswith('-'):
+            option_value = word in VALUE_OPTIONS  # other flags (namespace levels only have -h) take no value
+            continue
+        level = level.children.get(word)
+        if level is None:
+            return []
+        if not isinstance(level, LazyCommandLevel):
+            return None
+    result = []
+    for name, child in level.children.iteritems():
+        if name.startswith(current):
+            if isinstance(child, LazyCommandLevel):
+                result.append((name, '%s sub-command group' % name.capitalize()))
+            else:
+                result.append((name, child[1].get('help')))
+    return sorted(result)
+
+
+def output_completions(completions):
+    """Send completions to the shell, the way argcomplete does"""
+    ifs = os.environ.get('_ARGCOMPLETE_IFS', '\013')
+    dfs = os.environ.get('_ARGCOMPLETE_DFS')
+    if dfs:
+        values = [_unicode(dfs).join((_unicode(name), _unicode(help or '').replace(_unicode(ifs), u' ')))
+                  for name, help in completions]
+    else:
+        values = [_unicode(name) for name, _ in completions]
+        if len(values) == 1 and os.environ.get('_ARGCOMPLETE_SUPPRESS_SPACE') != '1':
+            values[0] += ' '
+
+    filename = os.environ.get('_ARGCOMPLETE_STDOUT_FILENAME')
+    if filename is not None:
+        output = open(filename, 'wb')
+    else:
+        output = os.fdopen(8, 'wb')
+    output.write(_unicode(ifs).join(values).encode('utf-8'))
+    output.flush()
+
+
+def fast_complete(cligraph):
+    """Answer a shell completion request from the cached command maps, if we can. Exits (without running any atexit
+    handlers, like argcomplete) if we did; returns otherwise.
+    """
+    words = get_completion_words()
+    if words is None:
+        return
+    completions = complete_command_names(cligraph.get_command_maps(False), *words)
+    if completions is None:
+        return
+    logging.debug('Fast completion of %r: %r', words, completions)
+    output_completions(completions)
+    os._exit(0)
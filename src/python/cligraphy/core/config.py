@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Configuration tree
+
+ConfigNode is an immutable dict with attribute access (conf.report.enabled), built once from our merged configuration.
+Unlike AttrDict, which wraps sub dicts again on every attribute access, the whole tree is converted upfront: attribute,
+item and dotted path lookups are plain dict lookups.
+"""
+
+import collections
+
+
+def freeze(value):
+    """Convert a configuration value: mappings become ConfigNodes, lists tuples"""
+    if isinstance(value, (basestring, bool, int, long, float)) or value is None:
+        return value
+    if isinstance(value, ConfigNode):
+        return value
+    if isinstance(value, collections.Mapping):
+        return ConfigNode(value)
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError('%s is immutable' % self.__class__.__name__)
+
+
+class ConfigNode(dict):
+    """Immutable configuration dict, with attribute access to its keys"""
+
+    __slots__ = ('_paths',)
+
+    def __init__(self, data=None):
+        dict.__init__(self, ((key, freeze(val)) for key, val in (data or {}).iteritems()))
+        object.__setattr__(self, '_paths', None)
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, name))
+
+    __setattr__ = __delattr__ = _immutable
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, dict.__repr__(self))
+
+    def __reduce__(self):
+        return self.__class__, (self.to_dict(),)
+
+    def copy(self):
+        return self  # immutable
+
+    def lookup(self, path, default=None):
+        """Dotted path lookup, eg. conf.lookup('report.enabled'). Uses a flat table of all paths, built on first use"""
+        if self._paths is None:
+            paths = {}
+            todo = [('', self)]
+            while todo:
+                prefix, node = todo.pop()
+                for key, val in node.iteritems():
+                    paths[prefix + key] = val
+                    if isinstance(val, ConfigNode):
+                        todo.append((prefix + key + '.', val))
+            object.__setattr__(self, '_paths', paths)
+        return self._paths.get(path, default)
+
+    def to_dict(self):
+        """Returns this tree as regular python dicts and lists"""
+        def _thaw(value):
+            if isinstance(value, ConfigNode):
+                return value.to_dict()
+            if isinstance(value, tuple):
+                return [_thaw(item) for item in value]
+            return value
+        return dict((key, _thaw(val)) for key, val in self.iteritems())
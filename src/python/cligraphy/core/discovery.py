@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Command modules discovery helpers
+
+Find command modules without importing them, fingerprint their source files so that autodiscovery only has to
+re-import the modules that changed since the last run, and inspect modules either statically (by parsing their
+source) or in isolated worker processes.
+"""
+
+from cligraphy.core.util import CALL_NONE, CALL_ARGS, CALL_KWARGS
+
+import ast
+import collections
+import hashlib
+import json
+import logging
+import os
+import os.path
+import pkgutil
+import select
+import time
+
+
+def scan_command_modules(prefix, path):
+    """Yields a (module name, is package, filename) tuple for all modules and packages under path, without importing
+    them. Packages are listed before their sub modules.
+    """
+    prefix = '%s.' % (prefix)
+    for importer, module_name, is_pkg in pkgutil.iter_modules(path, prefix=prefix):
+        loader = importer.find_module(module_name)
+        if loader is None:
+            continue
+        filename = loader.get_filename(module_name)
+        yield module_name, is_pkg, filename
+        if is_pkg:
+            for item in scan_command_modules(module_name, [os.path.dirname(filename)]):
+                yield item
+
+
+def fingerprint(filename, previous=None):
+    """Returns a [mtime, size, sha1] fingerprint of filename. If the file's mtime and size match those of the previous
+    fingerprint, the file is not read again and the previous fingerprint is returned.
+    """
+    stat = os.stat(filename)
+    if previous and previous[0] == stat.st_mtime and previous[1] == stat.st_size:
+        return previous
+    with open(filename, 'rb') as fpin:
+        digest = hashlib.sha1(fpin.read()).hexdigest()
+    return [stat.st_mtime, stat.st_size, digest]
+
+
+def read_module_records(filename, root_module_name):
+    """Read the module records (fingerprint and command data, by module name) saved by a previous autodiscovery of
+    root_module_name. Returns an empty dict if there are none we can use.
+    """
+    if not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename) as fpin:
+            saved = json.load(fpin)
+    except ValueError:
+        logging.warning('Could not parse existing command modules fingerprints %s, ignoring them', filename)
+        return {}
+    if saved.get('module') != root_module_name:
+        logging.debug('Command modules fingerprints in %s are for another root module, ignoring them', filename)
+        return {}
+    return saved.get('modules', {})
+
+
+def write_module_records(filename, root_module_name, records):
+    """Atomically write module records to filename"""
+    filename_new = filename + '.new'
+    with open(filename_new, 'w') as fpout:
+        json.dump({'module': root_module_name, 'modules': records}, fpout)
+    os.rename(filename_new, filename)
+
+
+def _binds_main(target):
+    """Returns True if the given assignment target (eg. of an assignment or for loop) binds the name main"""
+    return target is not None and any(isinstance(name, ast.Name) and name.id == 'main' for name in ast.walk(target))
+
+
+def _defines_main(node):
+    """Returns True if the given statement binds the name main"""
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return node.name == 'main'
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return any((alias.asname or alias.name) == 'main' for alias in node.names)
+    if isinstance(node, ast.Assign):
+        return any(_binds_main(target) for target in node.targets)
+    return False
+
+
+def _walk_import_time(node):
+    """Like ast.walk, but does not descend into function bodies (which don't run at import time)"""
+    todo = collections.deque([node])
+    while todo:
+        node = todo.popleft()
+        if not isinstance(node, (ast.FunctionDef, ast.Lambda)):
+            todo.extend(ast.iter_child_nodes(node))
+        yield node
+
+
+def _is_dynamic(tree):
+    """Returns True if a module's namespace could be changed in ways we can't follow statically"""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and any(alias.name == '*' for alias in node.names):
+            return True
+        if isinstance(node, ast.Exec):
+            return True
+        if isinstance(node, ast.Name) and (node.id == 'globals'
+                                           or (node.id == '__doc__' and not isinstance(node.ctx, ast.Load))
+                                           or (node.id == 'main' and isinstance(node.ctx, ast.Del))):
+            return True
+        if isinstance(node, ast.Global) and 'main' in node.names:
+            return True
+    for node in _walk_import_time(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'setattr':
+            return True
+        # main bound to whatever a loop, with block or except clause leaves behind (list comprehensions leak too)
+        if isinstance(node, (ast.For, ast.comprehension)) and _binds_main(node.target):
+            return True
+        if isinstance(node, ast.With) and _binds_main(node.optional_vars):
+            return True
+        if isinstance(node, ast.ExceptHandler) and _binds_main(node.name):
+            return True
+    return False
+
+
+def static_module_metadata(filename):
+    """Returns the same metadata as an actual import of a module would (docstring, main presence), by parsing its source
+    file. Returns None if that can't be determined statically, eg. if main is defined conditionally or dynamically.
+
+    NB: missing dependencies are not detected; they are only reported when the command is run.
+    """
+    if not filename.endswith('.py'):
+        return None
+    with open(filename) as fpin:
+        source = fpin.read()
+    try:
+        tree = ast.parse(source, filename)
+    except SyntaxError as se:
+        return {'error': 'SyntaxError: %s' % se}
+
+    if _is_dynamic(tree):
+        return None
+
+    main = None
+    for node in tree.body:
+        if _defines_main(node):
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.Name) and node.value.id == 'None':
+                return None
+            main = node
+        elif any(_defines_main(sub) for sub in ast.walk(node)
+                 if sub is not node and not isinstance(node, (ast.FunctionDef, ast.ClassDef))):
+            return None  # conditionally defined, eg. in an if or try block
+
+    metadata = {'doc': ast.get_docstring(tree, clean=False), 'main': main is not None, 'file': filename}
+    call = _static_call_convention(main)
+    if call is not None:
+        metadata['call'] = call
+    return metadata
+
+
+def _static_call_convention(node):
+    """Same as util.call_convention, for a main function definition node. Returns None if it can't be determined
+    statically, eg. for decorated functions or functions not defined by a def statement.
+    """
+    if not isinstance(node, ast.FunctionDef) or node.decorator_list:
+        return None
+    if not all(isinstance(arg, ast.Name) for arg in node.args.args):
+        return None  # tuple parameters
+    names = [arg.id for arg in node.args.args]
+    if not names:
+        return [CALL_NONE, None]
+    elif node.args.vararg or node.args.kwarg or len(names) > 1:
+        return [CALL_KWARGS, None if node.args.kwarg else names]
+    elif names[0] != 'args':
+        return None  # programming error, which will be reported when running the command
+    return [CALL_ARGS, None]
+
+
+def _worker_loop(func, conn):
+    """Isolated worker process main loop: call func on each item we receive and send back its result"""
+    while True:
+        try:
+            item = conn.recv()
+        except EOFError:
+            return
+        if item is None:
+            return
+        result = func(item)
+        conn.send(result)
+        if result.get('retire'):
+            return
+
+
+class _IsolatedWorker(object):
+    """An isolated worker process, and the item it's currently working on"""
+
+    def __init__(self, func, daemon=True):
+        import multiprocessing  # only needed when discovering in worker processes
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_loop, args=(func, child_conn), name='oc-discovery-worker')
+        self.process.daemon = daemon
+        self.process.start()
+        child_conn.close()
+        self.item = None
+        self.deadline = None
+
+    def submit(self, item, timeout):
+        self.item = item
+        self.deadline = time.time() + timeout
+        self.conn.send(item)
+
+    def stop(self, kill=False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+def imap_isolated(func, items, processes=None, timeout=30, daemon=True):
+    """Call func(item) for each item in isolated worker processes, yielding (item, result) tuples as they complete.
+
+    func must return a dict; if it contains a true 'retire' key, the worker that ran it exits and is replaced.
+    Items for which func takes more than timeout seconds (or for which the worker process dies) are yielded with an
+    {'error': message} result. Workers that start processes themselves must not be daemons.
+
+    items is consumed lazily, as workers become available: a generator can skip items depending on the results
+    yielded so far (eg. modules below a package that could not be imported).
+    """
+    import multiprocessing  # only needed when discovering in worker processes
+    pending = iter(items)
+    exhausted = False
+    processes = processes or multiprocessing.cpu_count()
+    idle = []
+    busy = {}
+    try:
+        while True:
+            while not exhausted and len(busy) < processes:
+                try:
+                    item = next(pending)
+                except StopIteration:
+                    exhausted = True
+                    break
+                worker = idle.pop() if idle else _IsolatedWorker(func, daemon)
+                worker.submit(item, timeout)
+                busy[worker.conn.fileno()] = worker
+            if not busy:
+                break
+
+            wait = max(0, min(worker.deadline for worker in busy.itervalues()) - time.time())
+            ready = select.select(busy.keys(), [], [], wait)[0]
+            for fileno in ready:
+                worker = busy.pop(fileno)
+                try:
+                    result = worker.conn.recv()
+                except EOFError:
+                    worker.stop(kill=True)
+                    result = {'error': 'WorkerError: worker process died while importing %s' % worker.item}
+                else:
+                    if result.pop('retire', False):
+                        worker.stop()
+                    else:
+                        idle.append(worker)
+                yield worker.item, result
+
+            now = time.time()
+            for fileno, worker in busy.items():
+                if worker.deadline <= now:
+                    del busy[fileno]
+                    logging.warning('Timeout while importing %s, abandoning it', worker.item)
+                    worker.stop(kill=True)
+                    yield worker.item, {'error': 'TimeoutError: import took more than %s seconds' % timeout}
+    finally:
+        for worker in idle + busy.values():
+            worker.stop(kill=worker in busy.values())
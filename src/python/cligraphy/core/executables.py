@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Executable commands discovery helpers
+
+Exec type command maps make the executables found in some directories available as commands, without any python
+shim. We index their names and help, taken from their header comment or, optionally, from what they print when run
+with --help.
+"""
+
+import logging
+import os
+import os.path
+import signal
+import subprocess
+import threading
+
+
+HEADER_SIZE = 4096  # we look for a help comment in that many bytes at the start of executables
+PROBE_OUTPUT_SIZE = 4096
+PROBE_TIMEOUT = 2  # seconds an executable has to print its --help
+
+
+def directory_fingerprints(directories):
+    """Returns a [directory, mtime] list for directories (mtime is None for missing directories). Adding, removing or
+    renaming an executable changes the mtime of its directory.
+    """
+    result = []
+    for directory in directories:
+        try:
+            result.append([directory, os.stat(directory).st_mtime])
+        except OSError:
+            result.append([directory, None])
+    return result
+
+
+def scan_executables(directories):
+    """Yields a (command name, filename, stat) tuple for each executable file in directories. The command name is the
+    file name without its extension; if several executables have the same command name, the first one found wins.
+    """
+    seen = set()
+    for directory in directories:
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            logging.debug('Could not list executables directory %s', directory, exc_info=True)
+            continue
+        for filename in names:
+            name = os.path.splitext(filename)[0]
+            if not name or name[0] in '.-_' or name in seen:
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or not os.access(path, os.X_OK):
+                continue
+            seen.add(name)
+            yield name, path, stat
+
+
+def header_help(filename):
+    """Returns the leading comment block of a script (after its #! line), or None if it has none"""
+    try:
+        with open(filename, 'rb') as fpin:
+            header = fpin.read(HEADER_SIZE)
+    except (IOError, OSError):
+        return None
+    if '\0' in header:
+        return None  # binary
+
+    lines = []
+    for number, line in enumerate(header.splitlines()):
+        line = line.strip()
+        if number == 0 and line.startswith('#!'):
+            continue
+        if not line.startswith('#'):
+            if lines or line:
+                break
+            continue
+        line = line.lstrip('#').strip()
+        if not lines and (not line or 'coding' in line or line.startswith('shellcheck')):
+            continue
+        lines.append(line)
+    return '\n'.join(lines).decode('utf-8', 'replace').strip() or None
+
+
+def probe_help(filename, timeout=PROBE_TIMEOUT):
+    """Run filename --help and return what it prints, or None if it fails or takes longer than timeout seconds"""
+    with open(os.devnull, 'r+') as devnull:
+        try:
+            process = subprocess.Popen([filename, '--help'], stdin=devnull, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, close_fds=True)
+        except OSError:
+            logging.debug('Could not run %s --help', filename, exc_info=True)
+            return None
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+        try:
+            output = process.stdout.read(PROBE_OUTPUT_SIZE)
+            process.stdout.close()
+            status = process.wait()
+        finally:
+            timer.cancel()
+    if status not in (0, 1, -signal.SIGPIPE):  # some tools exit with 1 after printing their usage
+        logging.debug('%s --help exited with status %d', filename, status)
+        return None
+    return output.decode('utf-8', 'replace').strip() or None
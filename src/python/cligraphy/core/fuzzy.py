@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Fuzzy command matching
+
+A command line "matches" a command if each of its words appears, in order, in the command's path: eg. "lin" matches
+"dev lint". Matching commands are found through an n-gram index of command paths (built once, and saved alongside the
+commands cache), then ranked: words matching at the start of, or all of, a command path word score higher.
+"""
+
+import array
+import collections
+import marshal
+import os
+
+
+INDEX_VERSION = 1
+GRAM_SIZES = (3, 2)  # we index trigrams, and bigrams for two letter words
+
+WORD_START_SCORE = 10  # a word matches at the start of a command path word
+WHOLE_WORD_SCORE = 5  # a word matches a whole command path word
+UNMATCHED_WORD_SCORE = -2  # for each command path word no word matched
+CLEAR_WIN_MARGIN = 5  # the best candidate is picked if it scores that much more than the next one
+INTERSECT_RATIO = 8  # intersect candidates with postings at most that many times longer
+
+
+def _gram_size(word):
+    """Returns the size of the n-grams we index to look up word, or None if we don't index any that short"""
+    for size in GRAM_SIZES:
+        if len(word) >= size:
+            return size
+    return None
+
+
+def match_score(words, path):
+    """Returns the match score of words against a command path, or None if it does not match"""
+    padded = ' ' + path
+    score = 0
+    position = 0
+    matched = set()
+    for word in words:
+        found = padded.find(' ' + word, position)  # prefer matching at the start of a path word
+        if found < 0:
+            found = path.find(word, position)
+            if found < 0:
+                return None
+        else:
+            score += WORD_START_SCORE
+            end = found + len(word)
+            if end == len(path) or path[end] == ' ':
+                score += WHOLE_WORD_SCORE
+        matched.add(path.count(' ', 0, found))
+        position = found + len(word)
+    score += UNMATCHED_WORD_SCORE * (path.count(' ') + 1 - len(matched))
+    return score
+
+
+def _greedy_match_score(words, path):
+    """match_score, falling back to plain leftmost matching when preferring word starts made a match fail"""
+    score = match_score(words, path)
+    if score is None:
+        position = 0
+        for word in words:
+            position = path.find(word, position)
+            if position < 0:
+                return None
+            position += len(word)
+        score = UNMATCHED_WORD_SCORE * (path.count(' ') + 1)
+    return score
+
+
+class FuzzyIndex(object):
+    """N-gram index of command paths. Postings (the ids of the paths containing a n-gram) are stored as packed
+    arrays of unsigned ints, which keeps the saved index small and quick to load.
+    """
+
+    def __init__(self, paths, postings):
+        self.paths = paths
+        self.postings = postings
+
+    @classmethod
+    def build(cls, paths):
+        paths = [path.encode('utf-8') if isinstance(path, unicode) else path for path in paths]  # like our argv
+        postings = collections.defaultdict(lambda: array.array('I'))
+        for path_id, path in enumerate(paths):
+            grams = set()
+            for word in path.split(' '):
+                for size in GRAM_SIZES:
+                    grams.update(word[start:start + size] for start in range(len(word) - size + 1))
+            for gram in grams:
+                postings[gram].append(path_id)
+        return cls(paths, dict((gram, ids.tostring()) for gram, ids in postings.iteritems()))
+
+    @classmethod
+    def load(cls, filename):
+        """Load an index saved by save(). Raises ValueError if it is not readable"""
+        with open(filename, 'rb') as fpin:
+            try:
+                data = marshal.load(fpin)
+            except (EOFError, TypeError) as exc:
+                raise ValueError('Could not read fuzzy index %s: %s' % (filename, exc))
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            raise ValueError('%s is not a fuzzy index (or has an unsupported version)' % filename)
+        return cls(data['paths'], data['postings'])
+
+    def save(self, filename):
+        """Atomically save this index to filename"""
+        filename_new = filename + '.new'
+        with open(filename_new, 'wb') as fpout:
+            marshal.dump({'version': INDEX_VERSION, 'paths': self.paths, 'postings': self.postings}, fpout)
+        os.rename(filename_new, filename)
+
+    def candidates(self, words):
+        """Returns the ids of the paths that may match words: those containing all the n-grams of all of them"""
+        postings = []
+        for word in words:
+            size = _gram_size(word)
+            if size is None:
+                continue
+            for start in range(len(word) - size + 1):
+                posting = self.postings.get(word[start:start + size])
+                if posting is None:
+                    return ()
+                postings.append(posting)
+        if not postings:
+            return xrange(len(self.paths))  # only one letter words, we have to look at every path
+
+        postings.sort(key=len)
+        ids = array.array('I')
+        ids.fromstring(postings[0])
+        # intersecting with much longer postings costs more than just verifying the candidates we have
+        for posting in postings[1:]:
+            other = array.array('I')
+            if len(posting) > len(ids) * INTERSECT_RATIO * other.itemsize:
+                break
+            other.fromstring(posting)
+            ids = set(ids).intersection(other)
+        return ids
+
+    def search(self, words, prefix=''):
+        """Yields (score, path) for each matching path. Command paths are prefixed with prefix (eg. a namespace) for
+        matching, which must not be indexed itself.
+        """
+        if not prefix:
+            for path_id in self.candidates(words):
+                path = self.paths[path_id]
+                score = _greedy_match_score(words, path)
+                if score is not None:
+                    yield score, path
+            return
+
+        splits = [0]
+        splits.extend(count for count in range(1, len(words) + 1)
+                      if _greedy_match_score(words[:count], prefix) is not None)
+        seen = set()
+        for split in splits:
+            for path_id in self.candidates(words[split:]):
+                if path_id in seen:
+                    continue
+                seen.add(path_id)
+                path = prefix + ' ' + self.paths[path_id]
+                score = _greedy_match_score(words, path)
+                if score is not None:
+                    yield score, path
+
+
+class FuzzyMatcher(object):
+    """Ranked fuzzy matching against command maps, each with its fuzzy index and namespace"""
+
+    max_matches = 20
+
+    def __init__(self):
+        self.sources = []  # (namespace, index loader) tuples
+        self.indexes = {}  # loaded indexes, by source position
+
+    def add_source(self, namespace, load_index):
+        """load_index is only called when actually fuzzy matching"""
+        self.sources.append((namespace, load_index))
+
+    def get_index(self, position):
+        index = self.indexes.get(position)
+        if index is None:
+            index = self.indexes[position] = self.sources[position][1]()
+        return index
+
+    def match(self, words):
+        """Returns a list of the paths matching words, best matches first, and whether the first one clearly wins"""
+        results = []
+        for position, (namespace, _) in enumerate(self.sources):
+            results.extend(self.get_index(position).search(words, namespace))
+        results.sort(key=lambda result: (-result[0], len(result[1]), result[1]))
+        clear_win = len(results) == 1 or (len(results) > 1 and results[0][0] - results[1][0] >= CLEAR_WIN_MARGIN)
+        return [path for _, path in results[:self.max_matches]], clear_win
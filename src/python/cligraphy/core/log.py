@@ -3,9 +3,7 @@
 
 """Command line tools entry point"""
 
-from cligraphy.core.util import try_import
-
-from remember import memoize
+from cligraphy.core.util import try_import, memoize
 
 import json
 import logging
@@ -105,7 +103,7 @@ def silence_verbose_loggers():
     logging.getLogger('requests.packages.urllib3.connectionpool').setLevel(logging.WARN)
 
 
-@memoize.memoize()
+@memoize
 def _get_dict_config():
     dict_config = {
         'version': 1,
@@ -2,26 +2,29 @@
 # Copyright 2013, 2104 Netflix, Inc.
 
 
+from cligraphy.core import trace
+from cligraphy.core.cmdcache import CommandIndex, CommandShard, MANIFEST_VERSION, is_command, shard_digest, \
+    write_command_index
+from cligraphy.core.discovery import scan_command_modules, fingerprint, read_module_records, write_module_records, imap_isolated, \
+    static_module_metadata
+from cligraphy.core.executables import directory_fingerprints, scan_executables, header_help, probe_help
+from cligraphy.core.fuzzy import FuzzyIndex, FuzzyMatcher
+from cligraphy.core.util import call_convention, CALL_ARGS
+
 import argparse
+import collections
 import copy
 import functools
-import imp
 import importlib
 import json
 import logging
 import os
 import os.path
-import pkgutil
+import signal
 import sys
 import time
 from contextlib import contextmanager
 
-
-try:
-    import gevent.monkey as gevent_monkey
-except ImportError:
-    gevent_monkey = None
-
 NO_HELP = 'No help :('
 
 FUZZY_PARSED = []
@@ -29,6 +32,13 @@ RECENT_SUB_PARSERS = []
 UNAVAILABLE_MODULES = []
 
 
+def warn_unavailable_modules(modules):
+    """Log the (module name, error message) of commands modules that could not be imported"""
+    logging.warning('The following modules are not available:')
+    for name, msg in modules:
+        logging.warning('    %s: %s', name, msg)
+
+
 class CustomDescriptionFormatter(argparse.RawTextHelpFormatter):
 
     def _get_help_string(self, action):
@@ -60,9 +70,21 @@ class ParserError(Exception):
         sys.exit(2)
 
 
-def split_args(args):
+def _option_values(parser, arg):
+    """Returns how many of the args following option arg are its values, according to parser"""
+    action = parser._option_string_actions.get(arg) if parser is not None and '=' not in arg else None
+    if action is None:
+        return 0
+    if action.nargs is None or action.nargs == argparse.OPTIONAL:
+        return 1
+    if isinstance(action.nargs, int):
+        return action.nargs
+    return sys.maxint  # as many as there are, like argparse
+
+
+def split_args(args, parser=None):
     """Split command line args in 3 groups:
-    - head, containing the initial options
+    - head, containing the initial options, and their values if the (root) parser defining them is given
     - body, containing everything after head, up to the first option
     - tail, containing everything after body
     """
@@ -70,35 +92,38 @@ def split_args(args):
     head = []
     body = []
     tail = []
+    values = 0  # values the last option of head still takes
     for arg in args:
         if arg.startswith('-'):
             if body:
                 tail.append(arg)
             else:
                 head.append(arg)
+                values = _option_values(parser, arg)
         else:
             if tail:
                 tail.append(arg)
+            elif values and not body:
+                head.append(arg)
+                values -= 1
             else:
                 body.append(arg)
     return head, body, tail
 
 
-def attempt_fuzzy_matching(args, candidates):
-    head, body, tail = split_args(args)
+def attempt_fuzzy_matching(args, matcher, parser=None):
+    """Fuzzy match command line args against commands, using a FuzzyMatcher. Trailing words are dropped (ie. considered
+    to be command arguments) until some commands match. parser is the root parser (see split_args).
+    Returns the corrected args if a command clearly matches (None otherwise), and the ranked list of matching commands.
+    """
+    head, body, tail = split_args(args, parser)
 
     if not body:
         return None, None
 
-    import re
     matches = []
-
     while body:
-        partial_body = body
-        fuzzy_body = '.*'.join(partial_body)
-        for candidate in candidates:
-            if re.search(fuzzy_body, candidate):
-                matches.append(candidate)
+        matches, clear_win = matcher.match(body)
         if matches:
             break
         tail.insert(0, body.pop())
@@ -107,7 +132,7 @@ def attempt_fuzzy_matching(args, candidates):
         logging.debug('No fuzzy matches for command line args %s', args)
         return None, matches
 
-    if len(matches) > 1:
+    if not clear_win:
         logging.debug('Multiple fuzzy matches for command line args %s: %s', args, matches)
         return None, matches
 
@@ -141,13 +166,98 @@ class BaseParser(argparse.ArgumentParser):
             super(BaseParser, self)._check_value(action, value)
 
 
+def iter_commands(module_name, commands, command_path=''):
+    """Walk a command map tree, yielding a (command path, module name, node) tuple for each command"""
+    for name, node in commands.iteritems():
+        if is_command(node):
+            yield (command_path + ' ' + name).strip(), module_name + '.' + name, node
+        else:
+            for item in iter_commands(module_name + '.' + name, node, command_path + ' ' + name):
+                yield item
+
+
+def build_fuzzy_index(command_map):
+    """Build the fuzzy matching index of a command map"""
+    return FuzzyIndex.build(path for path, _, _ in iter_commands(command_map['module'], command_map['commands']))
+
+
+class LazyCommandLevel(object):
+    """A level (root or namespace) of the command tree, expanded from its command maps only when needed"""
+
+    def __init__(self, command_path):
+        self.command_path = command_path
+        self.levels = collections.OrderedDict()  # explicitly added sub levels (configured namespaces)
+        self.sources = []  # (module name, command map node) tuples merged into this level
+        self.sub = None  # argparse sub parsers action this level's items are added to
+        self.built = False
+        self._children = None
+
+    def namespace(self, name):
+        """Get or create the sub level for a configured namespace"""
+        level = self.levels.get(name)
+        if level is None:
+            level = self.levels[name] = LazyCommandLevel((self.command_path + ' ' + name).strip())
+            self._children = None
+        return level
+
+    def add_source(self, module_name, commands):
+        self.sources.append((module_name, commands))
+        self._children = None
+
+    def copy(self):
+        """Returns a new level with the same sub levels and sources"""
+        level = LazyCommandLevel(self.command_path)
+        level.levels.update(self.levels)
+        level.sources.extend(self.sources)
+        return level
+
+    @property
+    def children(self):
+        """Ordered map of item name to either a (module name, command node) tuple or a sub LazyCommandLevel"""
+        if self._children is None:
+            children = collections.OrderedDict(self.levels)
+            for module_name, commands in self.sources:
+                for name, node in commands.iteritems():
+                    if is_command(node):
+                        children[name] = (module_name, node)
+                    else:
+                        level = children.get(name)
+                        if not isinstance(level, LazyCommandLevel):
+                            level = children[name] = LazyCommandLevel((self.command_path + ' ' + name).strip())
+                        elif level is self.levels.get(name):
+                            level = children[name] = level.copy()  # merge into a copy: self.levels must not change
+                        level.add_source(module_name + '.' + name, node)
+            self._children = children
+        return self._children
+
+    def iter_commands(self):
+        """Walk all commands below this level, without expanding it"""
+        for level in self.levels.itervalues():
+            for item in level.iter_commands():
+                yield item
+        for module_name, commands in self.sources:
+            for item in iter_commands(module_name, commands, self.command_path):
+                yield item
+
+
 class SmartCommandMapParser(BaseParser):
 
     def __init__(self, *args, **kwargs):
+        self.lazy = kwargs.pop('lazy', False)
         super(SmartCommandMapParser, self).__init__(*args, **kwargs)
         self.root_sub = self.add_subparsers(help='Available sub-commands', parser_class=BaseParser)
         self.sub_map = {'': self.root_sub}
-        self.flat_map = {}
+        self.lazy_root = LazyCommandLevel('')
+        self.lazy_root.sub = self.root_sub
+        self._flat_map = {}
+        self.fuzzy_matcher = FuzzyMatcher()
+
+    @property
+    def flat_map(self):
+        """Map of full command path (eg. 'dev lint') to command module name"""
+        if self._flat_map is None:
+            self._flat_map = dict((path, module_name) for path, module_name, _ in self.lazy_root.iter_commands())
+        return self._flat_map
 
     def add_namespace(self, namespace, parent):
         desc = '%s sub-command group' % namespace.capitalize()
@@ -161,22 +271,32 @@ class SmartCommandMapParser(BaseParser):
         self.sub_map[namespace] = sub
         return sub
 
+    def add_command(self, subparser, module_name, name, node):
+        parser = subparser.add_parser(name,
+                                      help=node.get('help'),
+                                      description=node.get('desc', node.get('help')),
+                                      formatter_class=CustomDescriptionFormatter,
+                                      add_help=False)
+        if node.get('exec'):
+            parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments passed to %s' % node['exec'])
+            parser.set_defaults(_func=functools.partial(exec_command, node['exec']), _call=[CALL_ARGS, None],
+                                _exec=node['exec'])
+        elif node.get('error'):
+            def _func(*args, **kwargs):
+                logging.error('This command is unavailable: %s', node.get('desc'))
+                logging.error('NB: after fixing the issue, remember to run oc refresh again')
+                sys.exit(1)
+            parser.set_defaults(_func=_func)
+        else:
+            parser.set_defaults(_func=functools.partial(finish_parser, copy.copy(parser), module_name + '.' + name))
+            if node.get('call'):
+                parser.set_defaults(_call=node['call'])  # how Cligraph._run calls main
+        return parser
+
     def add_item(self, subparser, module_name, item, command_path):
         name, node = item
-        if node.get('type') == 'cmd':
-            parser = subparser.add_parser(name,
-                                          help=node.get('help'),
-                                          description=node.get('desc', node.get('help')),
-                                          formatter_class=CustomDescriptionFormatter,
-                                          add_help=False)
-            if node.get('error'):
-                def _func(*args, **kwargs):
-                    logging.error('This command is unavailable: %s', node.get('desc'))
-                    logging.error('NB: after fixing the issue, remember to run oc refresh again')
-                    sys.exit(1)
-                parser.set_defaults(_func=_func)
-            else:
-                parser.set_defaults(_func=functools.partial(finish_parser, copy.copy(parser), module_name + '.' + name))
+        if is_command(node):
+            self.add_command(subparser, module_name, name, node)
             self.flat_map[(command_path + ' ' + name).strip()] = module_name + '.' + name
         else:
             sub = self.add_namespace(name, subparser)
@@ -184,6 +304,13 @@ class SmartCommandMapParser(BaseParser):
                 self.add_item(sub, module_name + '.' + name, sub_node, command_path + ' ' + name)
 
     def add_command_map(self, namespace, command_map):
+        self.fuzzy_matcher.add_source(namespace, command_map.get('fuzzy_index') or functools.partial(build_fuzzy_index, command_map))
+        if self.lazy:
+            level = self.lazy_root.namespace(namespace) if namespace else self.lazy_root
+            level.add_source(command_map['module'], command_map['commands'])
+            self._flat_map = None
+            return
+
         sub = self.sub_map.get(namespace, None)
         if sub is None:
             sub = self.add_namespace(namespace, self.root_sub)
@@ -192,33 +319,106 @@ class SmartCommandMapParser(BaseParser):
         for item in command_map['commands'].iteritems():
             self.add_item(sub, module_name, item, namespace)
 
+    def _build_level(self, level):
+        """Add parsers for all the items of a lazy level"""
+        if level.built:
+            return
+        for name, child in level.children.iteritems():
+            if isinstance(child, LazyCommandLevel):
+                child.sub = self.add_namespace(name, level.sub)
+            else:
+                module_name, node = child
+                self.add_command(level.sub, module_name, name, node)
+        level.built = True
+
+    def materialize(self, args):
+        """Lazy mode: build the parsers needed to parse the given command line arguments, ie. the root level and
+        every namespace level along the command path. Does nothing in eager mode.
+        """
+        if not self.lazy:
+            return
+        _, body, _ = split_args(args, self)
+        level = self.lazy_root
+        self._build_level(level)
+        for token in body:
+            level = level.children.get(token)
+            if not isinstance(level, LazyCommandLevel):
+                break
+            self._build_level(level)
+
+    def resolve_command(self, args):
+        """Walk the parser tree along the command path of the given command line arguments, building the parsers it
+        goes through (lazy mode). Returns the last parser reached (the command's, or a namespace's if the path stops at
+        a namespace), or None if the path goes through an unknown command or namespace.
+        """
+        return self._resolve_command_path(args)[0]
+
+    def _resolve_command_path(self, args):
+        """resolve_command helper: also returns the position, in args, of the first argument after the command path"""
+        self.materialize(args)
+        head, body, _ = split_args(args, self)
+        parser = self
+        position = len(head)
+        for token in body:
+            subparsers = [action for action in parser._actions if isinstance(action, argparse._SubParsersAction)]
+            if not subparsers:
+                break  # reached a command: remaining words are its arguments
+            parser = subparsers[0].choices.get(token)
+            if parser is None:
+                return None, position
+            position += 1
+        return parser, position
+
+    def finish_command(self, args):
+        """Build the actual parser (see finish_parser) of the command the given command line arguments point to, if
+        any, eg. so that its options can be completed.
+        """
+        parser = self.resolve_command(args)
+        func = parser and parser.get_default('_func')
+        if isinstance(func, functools.partial) and func.func is finish_parser:
+            func()
+
     def pre_parse_args(self, args):
-        """Perform our first pass parsing of the given command line arguments.
-        Try fuzzy matching if we can't parse the command line as is.
-        Return the final args (eg. possibly corrected after fuzzy matching) and the actual command function to be executed.
+        """Resolve the command path of the given command line arguments, and build the actual parser of the command.
+        Try fuzzy matching if the command path is invalid.
+        Return the final args (eg. possibly corrected after fuzzy matching) and the actual command function to be executed
+        (None if args point to a namespace, or to no command at all; parsing them will fail).
         """
-        try:
-            parsed_args, _ = self.parse_known_args(args)
-        except ParserError as pe:
-            # if we get 'too few arguments here', user is referencing a command group, and we shouldn't fuzzy match
-            if pe.message == 'too few arguments':
-                pe.report()
-            logging.debug('Could not parse command line args [%s], attempting fuzzy matching', args)
-            fixed_args, matches = attempt_fuzzy_matching(args, self.flat_map.keys())
+        parser = self.resolve_command(args)
+        if parser is None:
+            logging.debug('Could not resolve command line args [%s], attempting fuzzy matching', args)
+            fixed_args, matches = attempt_fuzzy_matching(args, self.fuzzy_matcher, self)
             if fixed_args:
-                logging.info('Your input "%s" matches "%s"', ' '.join(args), ' '.join(fixed_args))
-                FUZZY_PARSED.append((' '.join(args), ' '.join(fixed_args)))
-                args = fixed_args
-                parsed_args, _ = self.parse_known_args(args)
-            elif matches:
-                message = 'Your command line matched the following existing commands:\n    %s\n' % ('\n    '.join(matches))
-                pe.report(force_message=message)
-            else:
-                pe.report()
-
-        return args, parsed_args._func()
+                parser = self.resolve_command(fixed_args)
+            if parser is None:
+                try:
+                    self.parse_known_args(args)  # only to get argparse's error
+                    pe = ParserError(self, 'invalid command')
+                except ParserError as exc:
+                    pe = exc
+                if matches:
+                    message = 'Your command line matched the following existing commands:\n    %s\n' % ('\n    '.join(matches))
+                    pe.report(force_message=message)
+                else:
+                    pe.report()
+            logging.info('Your input "%s" matches "%s"', ' '.join(args), ' '.join(fixed_args))
+            FUZZY_PARSED.append((' '.join(args), ' '.join(fixed_args)))
+            args = fixed_args
+
+        if parser.get_default('_exec'):
+            # everything after the command path goes to the executable, even options (including -h)
+            _, position = self._resolve_command_path(args)
+            args = args[:position] + ['--'] + args[position:]
+
+        func = parser.get_default('_func')
+        if isinstance(func, functools.partial) and func.func is finish_parser:
+            func = func()  # not built yet (parsers can be reused, eg. in batch mode)
+        return args, func
 
     def parse_args(self, args=None):
+        """Parse command line arguments in a single pass: the command path is resolved first, so that the command's
+        parser is complete when argparse goes through the command line.
+        """
         if args is None:
             args = sys.argv[1:]
         fixed_args, _ = self.pre_parse_args(args)
@@ -226,18 +426,10 @@ class SmartCommandMapParser(BaseParser):
 
 
 def detect_monkey_patch():
-    return gevent_monkey and len(gevent_monkey.saved) > 0
+    gevent_monkey = sys.modules.get('gevent.monkey')  # no need to import gevent: if it's not loaded, nothing got patched
+    return gevent_monkey is not None and len(gevent_monkey.saved) > 0
 
 
-def error_module(module_name, exc):
-    message = '%s: %s' % (exc.__class__.__name__, exc)
-    UNAVAILABLE_MODULES.append((module_name, message))
-    mod = imp.new_module(module_name)
-    mod.__file__ = '__%s_error_stub__' % module_name
-    mod.__doc__ = message
-    mod.__error__ = True
-    return mod
-
 @contextmanager
 def import_time_reporting(module_name):
     start = time.time()
@@ -247,68 +439,112 @@ def import_time_reporting(module_name):
         logging.info('slow import: module %s took %.2f seconds' % (module_name, elapsed))
 
 
-def find_command_modules(prefix, path):
-    """Returns a list of all command modules and packages"""
-    prefix = '%s.' % (prefix)
-    for loader, module_name, is_pkg in pkgutil.iter_modules(path, prefix=prefix):
+def inspect_module_metadata(module_name):
+    """Import a module and return what autodiscovery needs to know about it: its docstring ('doc'), whether it has a
+    main function ('main') and its 'file'; or an 'error' message if it could not be imported.
+    Safe to run in an isolated worker process: the result only contains picklable values.
+    """
+    try:
+        with import_time_reporting(module_name):
+            module = importlib.import_module(module_name)
+    except KeyboardInterrupt:
+        raise
+    except BaseException as be:
+        return {'error': '%s: %s' % (be.__class__.__name__, be)}
+
+    if detect_monkey_patch():
+        logging.error('gevent monkey patching detected after module %s was loaded', module_name)
+        # our process is tainted for good: worker processes should retire
+        return {'error': 'Exception: monkey patching is not allowed in oc command modules', 'retire': True}
+
+    metadata = {
+        'doc': getattr(module, '__doc__', None),
+        'main': bool(getattr(module, 'main', None)),
+        'file': getattr(module, '__file__', None),
+    }
+    if metadata['main']:
         try:
-            with import_time_reporting(module_name):
-                mod = importlib.import_module(module_name)
-
-            if detect_monkey_patch():
-                logging.error('gevent monkey patching detected after module %s was loaded', module_name)
-                raise Exception('monkey patching is not allowed in oc command modules')
-
-            if getattr(mod, 'main', None):
-                yield mod
-
-            if is_pkg:
-                with import_time_reporting(module_name):
-                    pkg = importlib.import_module(module_name)
-                for mod in find_command_modules(pkg.__name__, pkg.__path__):
-                    yield mod
-        except KeyboardInterrupt:
-            raise
-        except ImportError as ie:
-            yield error_module(module_name, ie)
-        except SyntaxError as se:
-            yield error_module(module_name, se)
-        except BaseException as be:
-            yield error_module(module_name, be)
+            metadata['call'] = call_convention(module.main)
+        except Exception:  # pylint:disable=broad-except
+            logging.debug('Could not get the calling convention of %s.main', module_name, exc_info=True)
+    return metadata
 
 
 def finish_parser(parser, module_name):
     logging.debug('Build actual parser for module %s', module_name)
-    module = importlib.import_module(module_name)
+    with trace.span('finish_parser %s' % module_name):
+        module = importlib.import_module(module_name)
 
-    if hasattr(module, 'configure'):
-        module.configure(parser)
+        if hasattr(module, 'configure'):
+            with trace.span('configure'):
+                module.configure(parser)
 
     parser.set_defaults(_func=module.main)
     parser.add_argument('-h', '--help', dest='_help', action=argparse._HelpAction)
     return module.main
 
 
+def exec_command(filename, args):
+    """Run an exec type command: replaces our process with the executable"""
+    argv = args.args[1:] if args.args[:1] == ['--'] else args.args  # see pre_parse_args
+    logging.debug('Executing %s %s', filename, argv)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for signum in (signal.SIGPIPE, signal.SIGXFSZ):  # python ignores them, and ignored signals stay ignored across exec
+        signal.signal(signum, signal.SIG_DFL)
+    os.execvp(filename, [filename] + argv)
+
+
+def parse_doc(doc, get_filename):
+    """Returns the (help, description) of a command, given its doc. get_filename is only called if there is no doc"""
+    if doc is None:
+        return NO_HELP, 'No description provided, you could add one! Code is probably located here: %s' % (get_filename().replace('pyc', 'py'))
+    else:
+        halp, _, desc = doc.strip().replace('%', '%%').partition('\n')
+        halp = halp.strip()
+        if not desc:
+            desc = halp
+        return halp, desc
+
+
+def get_commands_cache_filename(cligraph):
+    """Returns the filename our commands caches are named after (<SHORTNAME>_COMMANDS_CACHE, or commands.json in our
+    dotdir): each commands module saves its cache files alongside it, with its extension replaced by the module name.
+    The file itself is no longer written (one left by an older version is simply ignored)"""
+    return os.getenv('%s_COMMANDS_CACHE' % (cligraph.conf.tool.shortname.upper()),
+                     os.path.join(cligraph.conf.user.dotdir, 'commands.json'))
+
+
 class AutoDiscoveryCommandMap(object):
     """Automatically builds a commands map for our oc sub commands"""
 
-    def __init__(self, cligraph, root_module_name):
+    cache_formats = ('json', 'index')
+    discovery_modes = ('import', 'parallel', 'static')
+    # what a discovery mode can tell about a module: static discovery does not see missing dependencies
+    discovery_strengths = {'import': 1, 'parallel': 1, 'static': 0}
+    discovery_processes = None  # parallel discovery: number of worker processes (default: cpu count)
+    discovery_timeout = 30  # parallel discovery: seconds a module import can take before it's abandoned
+    warn_unavailable = True  # whether build() logs UNAVAILABLE_MODULES (not in worker processes: their parent does)
+
+    def __init__(self, cligraph, root_module_name, cache_format='json', discovery='import'):
+        if cache_format not in self.cache_formats:
+            raise ValueError('Unknown command cache format [%s], expected one of %s' % (cache_format, ', '.join(self.cache_formats)))
+        if discovery not in self.discovery_modes:
+            raise ValueError('Unknown discovery mode [%s], expected one of %s' % (discovery, ', '.join(self.discovery_modes)))
         self.cligraph = cligraph
         self.root_node = {}
         self.package_nodes = {'': self.root_node}
         self.root_module_name = root_module_name
+        self.cache_format = cache_format
+        self.discovery = discovery
 
     def parse_help(self, module):
         """Parse docstring to generate usage"""
-        doc = getattr(module, '__doc__', None)
-        if doc is None:
-            return NO_HELP, 'No description provided, you could add one! Code is probably located here: %s' % (module.__file__.replace('pyc', 'py'))
-        else:
-            halp, _, desc = doc.strip().replace('%', '%%').partition('\n')
-            halp = halp.strip()
-            if not desc:
-                desc = halp
-            return halp, desc
+        return self.parse_doc(getattr(module, '__doc__', None), lambda: module.__file__)
+
+    def parse_doc(self, doc, get_filename):
+        """Parse a module docstring to generate usage. get_filename is only called if there is no docstring"""
+        return parse_doc(doc, get_filename)
 
     def get_node(self, package_name):
         """Get or create a sub node"""
@@ -326,47 +562,339 @@ class AutoDiscoveryCommandMap(object):
             sub = parent[package_name] = self.package_nodes[complete_package_name] = {}
         return sub
 
-    def build(self, force_autodiscover=False):
-        root_module = importlib.import_module(self.root_module_name)
+    def get_cache_prefix(self):
+        """Returns the common prefix of our cache filenames: we have our own set of cache files, alongside the
+        commands cache"""
+        return '%s.%s' % (os.path.splitext(get_commands_cache_filename(self.cligraph))[0], self.root_module_name)
+
+    def get_cache_filename(self):
+        """Returns the filename of our commands cache manifest"""
+        return self.get_cache_prefix() + '.json'
+
+    def get_shard_filename(self, package_name):
+        """Returns the commands cache shard filename of a top level package, for our cache format"""
+        return '%s.%s.%s' % (self.get_cache_prefix(), package_name, 'idx' if self.cache_format == 'index' else 'json')
+
+    def can_write_cache(self):
+        filename = self.get_cache_filename()
+        return os.access(os.path.dirname(filename), os.W_OK) and (not os.path.exists(filename) or os.access(filename, os.W_OK))
+
+    def read_manifest(self, filename):
+        """Returns the raw commands cache manifest saved in filename. Raises ValueError if it is not readable"""
+        with open(filename) as fpin:
+            manifest = json.load(fpin)
+        if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError('%s is not a commands cache manifest (or has an unsupported version)' % filename)
+        if manifest.get('module') != self.root_module_name or manifest.get('format') != self.cache_format:
+            raise ValueError('%s is for another root module or cache format' % filename)
+        return manifest
+
+    def read_cache(self, filename):
+        """Read a command map from our cache manifest: top level packages are loaded from their shard on first access.
+        Raises ValueError if the manifest is not readable"""
+        manifest = self.read_manifest(filename)
+        commands = manifest['commands']
+        for package_name in manifest['shards']:
+            commands[package_name] = CommandShard(functools.partial(self.read_shard, package_name))
+        return {'module': self.root_module_name, 'commands': commands}
+
+    def read_shard(self, package_name):
+        """Load the command map node of a top level package from its shard. If the shard is missing or unreadable,
+        commands are autodiscovered again"""
+        filename = self.get_shard_filename(package_name)
+        try:
+            if self.cache_format == 'index':
+                return CommandIndex(filename).command_map()['commands']
+            with open(filename) as fpin:
+                return json.load(fpin)
+        except (IOError, ValueError) as exc:
+            logging.warning('Could not read commands cache shard %s (%s), autodiscovering commands again', filename, exc)
+            if os.path.exists(filename):
+                os.unlink(filename)  # so that it's written again
+            return self.build(force_autodiscover=True)['commands'].get(package_name, {})
+
+    def write_cache(self, filename, command_map):
+        """Write a command map to our sharded cache. Only the shards (and other cache files) whose content changed are
+        written, each atomically. Returns True if anything changed"""
+        try:
+            previous = self.read_manifest(filename)
+        except (IOError, ValueError):
+            previous = {'commands': None, 'shards': {}}
+
+        commands = {}
+        shards = {}
+        for name, node in command_map['commands'].iteritems():
+            if is_command(node):
+                commands[name] = node
+                continue
+            shards[name] = shard_digest(node)
+            shard_filename = self.get_shard_filename(name)
+            if previous['shards'].get(name) == shards[name] and os.path.exists(shard_filename):
+                continue
+            logging.debug('Writing commands cache shard %s', shard_filename)
+            shard_filename_new = shard_filename + '.new'
+            if self.cache_format == 'index':
+                write_command_index(shard_filename_new, {'module': '%s.%s' % (self.root_module_name, name), 'commands': node})
+            else:
+                with open(shard_filename_new, 'w') as fpout:
+                    json.dump(node, fpout, indent=4)
+            os.rename(shard_filename_new, shard_filename)
+
+        for name in set(previous['shards']) - set(shards):
+            try:
+                os.unlink(self.get_shard_filename(name))
+            except OSError:
+                pass
+
+        if previous['commands'] == commands and previous['shards'] == shards and os.path.exists(self.get_fuzzy_filename()):
+            return False
+        build_fuzzy_index(command_map).save(self.get_fuzzy_filename())
+        filename_new = filename + '.new'
+        with open(filename_new, 'w') as fpout:
+            json.dump({'version': MANIFEST_VERSION, 'module': self.root_module_name, 'format': self.cache_format,
+                       'commands': commands, 'shards': shards}, fpout, indent=4)
+        os.rename(filename_new, filename)
+        return True
+
+    def get_fuzzy_filename(self):
+        """Returns the filename our fuzzy matching index is saved to, alongside the commands cache"""
+        return self.get_cache_prefix() + '.fuzzy'
+
+    def read_fuzzy_index(self, command_map):
+        """Load our saved fuzzy matching index, or build it from command_map if it's missing or unreadable"""
+        filename = self.get_fuzzy_filename()
+        try:
+            return FuzzyIndex.load(filename)
+        except (IOError, ValueError):
+            logging.debug('Could not load fuzzy index %s, building it', filename, exc_info=True)
+            return build_fuzzy_index(command_map)
+
+    def get_modules_filename(self):
+        """Returns the filename command modules fingerprints are saved to, alongside the commands cache"""
+        return self.get_cache_prefix() + '.modules.json'
+
+    def command_data(self, module_name, metadata):
+        """Returns the command map data for a module, given its inspection metadata, or None if it is not a command"""
+        if metadata.get('error'):
+            halp, desc = self.parse_doc(metadata['error'], None)
+            return {'type': 'cmd', 'help': halp, 'desc': desc, 'error': True}
+        if metadata.get('main'):
+            halp, desc = self.parse_doc(metadata.get('doc'), lambda: metadata.get('file') or module_name)
+            data = {'type': 'cmd', 'help': halp, 'desc': desc}
+            if metadata.get('call'):
+                data['call'] = metadata['call']
+            return data
+        return None
+
+    def inspect_modules(self, module_names, filenames):
+        """Yields a (module name, metadata) tuple for each of the given modules. Depending on our discovery mode, modules
+        are imported in our process, imported in isolated worker processes, or parsed without being imported (static
+        mode: modules that define main dynamically are still imported).
+        """
+        if self.discovery == 'parallel':
+            return imap_isolated(inspect_module_metadata, module_names, processes=self.discovery_processes,
+                                 timeout=self.discovery_timeout)
+        elif self.discovery == 'static':
+            return self._inspect_modules_statically(module_names, filenames)
+        return ((module_name, inspect_module_metadata(module_name)) for module_name in module_names)
+
+    def _inspect_modules_statically(self, module_names, filenames):
+        """Static discovery mode helper"""
+        for module_name in module_names:
+            try:
+                metadata = static_module_metadata(filenames[module_name])
+            except (IOError, OSError):
+                logging.debug('Could not parse %s', filenames[module_name], exc_info=True)
+                metadata = None
+            if metadata is None:
+                logging.debug('Module %s cannot be inspected statically, importing it', module_name)
+                metadata = dict(inspect_module_metadata(module_name), mode='import')
+            yield module_name, metadata
+
+    def discover(self, root_module, previous):
+        """Find all command modules under root_module. Modules whose source file did not change since the previous
+        records are not imported again: their previous command data is reused (except for unavailable modules, which
+        might have been fixed by eg. installing a missing dependency, and for modules inspected by a weaker discovery
+        mode than ours, eg. statically while we import modules).
+        Returns the new module records, in discovery order.
+        """
+        records = collections.OrderedDict()
+        packages = set()
+        filenames = {}
+        to_inspect = []
+        strength = self.discovery_strengths[self.discovery]
+        for module_name, is_pkg, filename in scan_command_modules(self.root_module_name, root_module.__path__):
+            filenames[module_name] = filename
+            if is_pkg:
+                packages.add(module_name)
 
-        cached_command_map_filename = os.getenv('%s_COMMANDS_CACHE' % (self.cligraph.conf.tool.shortname.upper()),
-                                                os.path.join(self.cligraph.conf.user.dotdir, 'commands.json'))
+            old = previous.get(module_name)
+            try:
+                new_fingerprint = fingerprint(filename, old and old['fingerprint'])
+            except (IOError, OSError):
+                logging.debug('Could not fingerprint %s', filename, exc_info=True)
+                new_fingerprint = None
+
+            if (old is not None and new_fingerprint is not None and old['fingerprint'][2] == new_fingerprint[2]
+                    and not (old['command'] and old['command'].get('error'))
+                    and self.discovery_strengths.get(old.get('mode'), 0) >= strength):
+                records[module_name] = {'fingerprint': new_fingerprint, 'command': old['command'],
+                                        'mode': old.get('mode')}
+            else:
+                records[module_name] = {'fingerprint': new_fingerprint, 'command': None, 'mode': self.discovery}
+                to_inspect.append(module_name)
+
+        # nothing can be imported from an unavailable package: inspect packages first, and skip modules below broken ones
+        broken_packages = set()
+        errors = {}
+
+        def _is_available(module_name):
+            parts = module_name.split('.')
+            return not any('.'.join(parts[:length]) in broken_packages for length in range(1, len(parts)))
+
+        for names in ([name for name in to_inspect if name in packages], [name for name in to_inspect if name not in packages]):
+            for module_name, metadata in self.inspect_modules((name for name in names if _is_available(name)), filenames):
+                logging.debug('Inspected new or changed module %s', module_name)
+                records[module_name]['command'] = self.command_data(module_name, metadata)
+                records[module_name]['mode'] = metadata.get('mode', self.discovery)
+                if metadata.get('error'):
+                    errors[module_name] = metadata['error']
+                    if module_name in packages:
+                        broken_packages.add(module_name)
+
+        for module_name in records.keys():
+            if not _is_available(module_name):
+                del records[module_name]
+            elif module_name in errors:
+                UNAVAILABLE_MODULES.append((module_name, errors[module_name]))
+        return records
+
+    def build(self, force_autodiscover=False, incremental=True):
+        cached_command_map_filename = self.get_cache_filename()
         if not force_autodiscover and os.path.exists(cached_command_map_filename):
             try:
-                with open(cached_command_map_filename) as fpin:
-                    command_map = json.load(fpin)
+                command_map = self.read_cache(cached_command_map_filename)
+                command_map['fuzzy_index'] = functools.partial(self.read_fuzzy_index, command_map)
                 return command_map
             except ValueError:
                 logging.warning("Could not parse existing commands cache %s, ignoring it", cached_command_map_filename)
 
-        for module in find_command_modules(self.root_module_name, root_module.__path__):
-            package_name, _, module_name = module.__name__.rpartition('.')
+        root_module = importlib.import_module(self.root_module_name)
+        modules_filename = self.get_modules_filename()
+        previous = read_module_records(modules_filename, self.root_module_name) if incremental else {}
+        known_unavailable = len(UNAVAILABLE_MODULES)
+        records = self.discover(root_module, previous)
+
+        for full_module_name, record in records.iteritems():
+            if record['command'] is None:
+                continue
+            package_name, _, module_name = full_module_name.rpartition('.')
             assert package_name.startswith(self.root_module_name)
             package_name = package_name[len(self.root_module_name)+1:]
             logging.debug('Configuring parser for %s.%s', package_name, module_name)
-            halp, desc = self.parse_help(module)
-            data = {'type': 'cmd', 'help': halp, 'desc': desc}
-            if getattr(module, '__error__', False):
-                data['error'] = True
-            self.get_node(package_name)[module_name] = data
+            self.get_node(package_name)[module_name] = record['command']
 
-        if UNAVAILABLE_MODULES:
-            logging.warning('The following modules are not available:')
-            for name, msg in UNAVAILABLE_MODULES:
-                logging.warning('    %s: %s', name, msg)
+        if UNAVAILABLE_MODULES[known_unavailable:] and self.warn_unavailable:
+            warn_unavailable_modules(UNAVAILABLE_MODULES[known_unavailable:])
 
         command_map = {'module': self.root_module_name, 'commands': self.root_node}
 
-        if os.access(os.path.dirname(cached_command_map_filename), os.W_OK) and (not os.path.exists(cached_command_map_filename)
-                                                                                 or os.access(cached_command_map_filename, os.W_OK)):
-            logging.debug('Writing command map json to %s', cached_command_map_filename)
-
-            cached_command_map_filename_new = cached_command_map_filename + '.new'
-            with open(cached_command_map_filename_new, 'w') as fpout:
-                json.dump(command_map, fpout, indent=4)
-            os.rename(cached_command_map_filename_new, cached_command_map_filename)
+        if self.can_write_cache():
+            logging.debug('Writing command map %s to %s', self.cache_format, cached_command_map_filename)
+            self.write_cache(cached_command_map_filename, command_map)
+            if records != previous:
+                write_module_records(modules_filename, self.root_module_name, records)
         else:
             logging.warning('Not updating commands cache (%s is not writeable)', cached_command_map_filename)
             logging.warning('Tip: are you using a shared install of octools? If so, no need to run oc refresh.')
 
+        command_map['fuzzy_index'] = functools.partial(self.read_fuzzy_index, dict(command_map))
         return command_map
+
+
+class ExecCommandMap(object):
+    """Builds a commands map of the executables found in some directories. Executables are indexed (name, help, mtime
+    and size) in a cache, which is rebuilt when one of the directories or of the executables changes (eg. an executable
+    edited in place, which does not change its directory); running them does not import any module.
+    """
+
+    help_sources = ('header', 'probe')
+    cache_version = 1
+
+    def __init__(self, cligraph, name, paths, help_source='header'):
+        if help_source not in self.help_sources:
+            raise ValueError('Unknown help source [%s], expected one of %s' % (help_source, ', '.join(self.help_sources)))
+        if isinstance(paths, basestring):
+            paths = [paths]
+        self.cligraph = cligraph
+        self.name = name
+        self.directories = [os.path.join(cligraph.tool_path, os.path.expandvars(os.path.expanduser(path)))
+                            for path in paths or ()]
+        self.help_source = help_source
+
+    def get_cache_filename(self):
+        return os.path.splitext(get_commands_cache_filename(self.cligraph))[0] + '.exec-%s.json' % self.name
+
+    def read_cache(self, filename):
+        """Returns our cached index, or None if there is none we can use"""
+        try:
+            with open(filename) as fpin:
+                cache = json.load(fpin)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(cache, dict) or cache.get('version') != self.cache_version or cache.get('help') != self.help_source:
+            return None
+        return cache
+
+    def get_help(self, filename):
+        doc = header_help(filename)
+        if doc is None and self.help_source == 'probe':
+            doc = probe_help(filename)
+        return doc
+
+    def index(self, previous):
+        """Returns command nodes for our executables. Those that did not change since the previous index keep their help"""
+        commands = {}
+        for name, filename, stat in scan_executables(self.directories):
+            old = previous.get(name)
+            if old is not None and old['exec'] == filename and old['mtime'] == stat.st_mtime and old['size'] == stat.st_size:
+                commands[name] = old
+                continue
+            logging.debug('Indexing executable %s', filename)
+            halp, desc = parse_doc(self.get_help(filename), lambda: filename)
+            commands[name] = {'type': 'cmd', 'help': halp, 'desc': desc, 'exec': filename,
+                              'mtime': stat.st_mtime, 'size': stat.st_size}
+        return commands
+
+    @staticmethod
+    def executables_unchanged(commands):
+        """Whether the executables of indexed commands still have the mtime and size they had when indexed"""
+        for node in commands.itervalues():
+            try:
+                stat = os.stat(node['exec'])
+            except OSError:
+                return False
+            if stat.st_mtime != node['mtime'] or stat.st_size != node['size']:
+                return False
+        return True
+
+    def build(self, force_autodiscover=False):
+        filename = self.get_cache_filename()
+        cache = self.read_cache(filename)
+        directories = directory_fingerprints(self.directories)
+        if cache is not None and not force_autodiscover and cache['directories'] == directories \
+                and self.executables_unchanged(cache['commands']):
+            return {'module': self.name, 'commands': cache['commands']}
+
+        commands = self.index(cache['commands'] if cache else {})
+        if cache is not None and cache['directories'] == directories and cache['commands'] == commands:
+            return {'module': self.name, 'commands': commands}
+        try:
+            filename_new = filename + '.new'
+            with open(filename_new, 'w') as fpout:
+                json.dump({'version': self.cache_version, 'help': self.help_source, 'directories': directories,
+                           'commands': commands}, fpout, indent=4)
+            os.rename(filename_new, filename)
+        except (IOError, OSError) as exc:
+            logging.warning('Not updating executables cache %s: %s', filename, exc)
+        return {'module': self.name, 'commands': commands}
@@ -1,14 +1,12 @@
 #!/usr/bin/env python
 # Copyright 2014 Netflix, Inc.
 
-from cligraphy.core.tracking import TRACKING
+from cligraphy.core import tracking
 
 import threading
 from Queue import Queue, Empty, Full
 import collections
 
-import requests
-
 import logging
 import os
 import socket
@@ -121,6 +119,7 @@ class ToolsPadReporter(ThreadedReporter):
 
     def __init__(self, cligraph):
         super(ToolsPadReporter, self).__init__()
+        import requests  # only needed when reporting is enabled
         self.cligraph = cligraph
         self.requests_session = requests.Session()
         self.requests_session.headers.update({'User-Agent': 'octools:%s@%s' % (os.getenv('USER'), socket.gethostname())})
@@ -135,10 +134,11 @@ class ToolsPadReporter(ThreadedReporter):
         self.requests_session.head(self.idle_endpoint)
 
     def _report_command_start(self, command_line):
+        import requests
         try:
             response = self.requests_session.post(self.create_session_endpoint, data={
-                'uuid': TRACKING.execution_uuid,
-                'session_uuid': TRACKING.session_uuid,
+                'uuid': tracking.TRACKING.execution_uuid,
+                'session_uuid': tracking.TRACKING.session_uuid,
                 'user_email': self.cligraph.conf.user.email,
                 'start_stamp': int(time.time()),
                 'command_line': ' '.join(command_line)
@@ -154,6 +154,7 @@ class ToolsPadReporter(ThreadedReporter):
             logging.debug('Could not report command start', exc_info=True)
 
     def _report_command_output(self, output):
+        import requests
         if not self.created:
             return
         try:
@@ -167,6 +168,7 @@ class ToolsPadReporter(ThreadedReporter):
             logging.debug('Could not report comand output', exc_info=True)
 
     def _report_command_exit(self, exit_code):
+        import requests
         if not self.created:
             return
         try:
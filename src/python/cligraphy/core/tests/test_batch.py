@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Batch mode tests
+"""
+
+from cligraphy.core.batch import exit_status, parse_line, parse_options, read_commands
+
+import StringIO
+import unittest
+
+
+class ParseOptionsTest(unittest.TestCase):
+
+    def test_not_batch(self):
+        self.assertEqual((None, ['dev', 'lint']), parse_options(['dev', 'lint']))
+        self.assertEqual((None, ['--debug', 'dev', 'lint']), parse_options(['--debug', 'dev', 'lint']))
+
+    def test_batch(self):
+        options, global_args = parse_options(['--debug', '--batch', 'commands.txt', '-v'])
+        self.assertEqual('commands.txt', options.filename)
+        self.assertFalse(options.fork)
+        self.assertIsNone(options.results)
+        self.assertEqual(['--debug', '-v'], global_args)
+
+    def test_batch_equals(self):
+        options, global_args = parse_options(['--batch=commands.txt', '--batch-fork', '--batch-results=out.json'])
+        self.assertEqual('commands.txt', options.filename)
+        self.assertTrue(options.fork)
+        self.assertEqual('out.json', options.results)
+        self.assertEqual([], global_args)
+
+    def test_option_values_are_not_options(self):
+        options, global_args = parse_options(['--batch-results', 'out.json', '--batch', '-', '--debug'])
+        self.assertEqual('-', options.filename)
+        self.assertEqual('out.json', options.results)
+        self.assertEqual(['--debug'], global_args)
+
+    def test_command_options_are_left_alone(self):
+        for args in (['dev', 'import', '--batch', 'items.txt'],
+                     ['--debug', 'dev', 'import', '--batch=items.txt'],
+                     ['--', '--batch', 'items.txt']):
+            self.assertEqual((None, args), parse_options(args))
+
+
+class ParseLineTest(unittest.TestCase):
+
+    def test_shell_like(self):
+        self.assertEqual((['dev', 'lint', '--path', 'a b'], None), parse_line('dev lint --path "a b"'))
+
+    def test_json_list(self):
+        args, record_id = parse_line('["dev", "lint", "caf\\u00e9"]')
+        self.assertEqual(['dev', 'lint', 'caf\xc3\xa9'], args)
+        self.assertTrue(all(isinstance(arg, str) for arg in args))
+        self.assertIsNone(record_id)
+
+    def test_json_object(self):
+        self.assertEqual((['dev', 'lint'], 42), parse_line('{"id": 42, "args": ["dev", "lint"]}'))
+        self.assertEqual((['dev', 'lint', 'a b'], 'x'), parse_line('{"id": "x", "args": "dev lint \'a b\'"}'))
+
+    def test_invalid(self):
+        for text in ('[]', '{"id": 1}', '[1, 2]', '{"args": {}}', '[not json', '{"args": ""}', 'dev "unterminated'):
+            self.assertRaises(ValueError, parse_line, text)
+
+    def test_read_commands(self):
+        fpin = StringIO.StringIO('# a comment\n\ndev lint\n[]\n  status  \n')
+        commands = [(command.line, command.args, command.error) for command in read_commands(fpin)]
+        self.assertEqual([(3, ['dev', 'lint'], None), (4, None, 'empty command'), (5, ['status'], None)], commands)
+
+
+class ExitStatusTest(unittest.TestCase):
+
+    def test_exit_status(self):
+        self.assertEqual(0, exit_status(None))
+        self.assertEqual(3, exit_status(3))
+        self.assertEqual(1, exit_status('error message'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Output capture and session recording tests
+"""
+
+from cligraphy.core.capture import AsyncRecorder, HeadTailOutputRecorder, Recorder, fmt_capnp
+
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class HeadTailOutputRecorderTest(unittest.TestCase):
+
+    def record(self, recorder, *chunks):
+        for chunk in chunks:
+            recorder.record_server_output(chunk)
+        return recorder
+
+    def test_short_output(self):
+        recorder = self.record(HeadTailOutputRecorder(8, 4), 'abc', 'def', 'gh', 'ij')
+        self.assertEqual('abcdefgh', recorder.head())
+        self.assertEqual('ij', recorder.tail())
+        self.assertEqual(0, recorder.elided_size)
+        self.assertEqual('abcdefghij', recorder.output_as_string())
+
+    def test_elided(self):
+        recorder = self.record(HeadTailOutputRecorder(4, 6), 'abcdefghij', 'klm', 'nopqrstu', 'vw', 'xyz')
+        self.assertEqual(26, recorder.total_size)
+        self.assertEqual('abcd', recorder.head())
+        self.assertEqual('uvwxyz', recorder.tail())  # wrapped around the ring
+        self.assertEqual(16, recorder.elided_size)
+        self.assertEqual('abcd\n... [16 bytes elided] ...\nuvwxyz', recorder.output_as_string())
+
+    def test_chunks_larger_than_the_tail(self):
+        recorder = self.record(HeadTailOutputRecorder(2, 3), 'ab', 'cdefgh', '', 'ijklmnop')
+        self.assertEqual('ab', recorder.head())
+        self.assertEqual('nop', recorder.tail())
+        self.assertEqual(11, recorder.elided_size)
+
+    def test_no_tail(self):
+        recorder = self.record(HeadTailOutputRecorder(3, 0), 'abcdef')
+        self.assertEqual('', recorder.tail())
+        self.assertEqual('abc\n... [3 bytes elided] ...\n', recorder.output_as_string())
+
+    def test_byte_by_byte(self):
+        output = ''.join(chr(ord('a') + number % 26) for number in range(100))
+        recorder = self.record(HeadTailOutputRecorder(10, 7), *output)
+        self.assertEqual(output[:10], recorder.head())
+        self.assertEqual(output[-7:], recorder.tail())
+        self.assertEqual(83, recorder.elided_size)
+
+
+class _GatedRecorder(Recorder):
+    """Records events once its gate opens, so that events queue up in an AsyncRecorder in front of it"""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.entered = threading.Event()
+        self.events = []
+        self.ended = False
+
+    def _record(self, kind, data):
+        self.entered.set()
+        self.gate.wait()
+        self.events.append((kind, data, self.event_time))
+
+    def record_user_input(self, data):
+        self._record('in', data)
+
+    def record_server_output(self, data):
+        self._record('out', data)
+
+    def end(self, exitcode=0):
+        self.ended = True
+
+
+class AsyncRecorderTest(unittest.TestCase):
+
+    def start(self, overflow, **kwargs):
+        """Returns a started AsyncRecorder, whose writer thread is stuck recording a first output event 'a'"""
+        self.recorder = _GatedRecorder()
+        async_recorder = AsyncRecorder(self.recorder, overflow=overflow, **kwargs)
+        async_recorder.wait_period = 0.01
+        async_recorder.start()
+        async_recorder.record_server_output('a')
+        self.assertTrue(self.recorder.entered.wait(5))
+        return async_recorder
+
+    def in_thread(self, func, *args):
+        thread = threading.Thread(target=func, args=args)
+        thread.daemon = True
+        thread.start()
+        thread.join(0.2)
+        return thread
+
+    def written(self):
+        return [(kind, data) for kind, data, _ in self.recorder.events]
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, AsyncRecorder, _GatedRecorder(), overflow='nope')
+
+    def test_block(self):
+        async_recorder = self.start('block', max_queue_events=2)
+        async_recorder.record_server_output('b')
+        async_recorder.record_user_input('c')
+        thread = self.in_thread(async_recorder.record_server_output, 'd')
+        self.assertTrue(thread.is_alive())  # the queue is full
+
+        self.recorder.gate.set()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        async_recorder.end()
+        self.assertEqual([('out', 'a'), ('out', 'b'), ('in', 'c'), ('out', 'd')], self.written())
+        self.assertTrue(self.recorder.ended)
+        self.assertEqual((4, 4, 0), (async_recorder.queued_size, async_recorder.written_size, async_recorder.pending_size))
+
+    def test_drop_oldest(self):
+        async_recorder = self.start('drop-oldest', max_queue_events=10, max_queue_size=5)
+        for data in ('bb', 'cc', 'dd', 'e', 'f'):
+            async_recorder.record_server_output(data)
+        self.assertEqual(5, async_recorder.pending_size)  # including a, being written
+
+        self.recorder.gate.set()
+        async_recorder.end()
+        self.assertEqual([('out', 'a'), ('out', 'dd'), ('out', 'e'), ('out', 'f')], self.written())
+        self.assertEqual((2, 4), (async_recorder.dropped_events, async_recorder.dropped_size))
+        self.assertEqual(0, async_recorder.pending_size)
+
+    def test_coalesce(self):
+        async_recorder = self.start('coalesce', max_queue_events=2)
+        async_recorder.record_server_output('b')
+        async_recorder.record_server_output('c')
+        async_recorder.record_server_output('d')  # merged with c
+        thread = self.in_thread(async_recorder.record_user_input, 'x')
+        self.assertTrue(thread.is_alive())  # can't be merged with terminal output: blocks
+
+        self.recorder.gate.set()
+        thread.join(5)
+        async_recorder.end()
+        self.assertEqual([('out', 'a'), ('out', 'b'), ('out', 'cd'), ('in', 'x')], self.written())
+        self.assertEqual(1, async_recorder.coalesced_events)
+        self.assertEqual(0, async_recorder.dropped_events)
+        event_times = [event_time for _, _, event_time in self.recorder.events]
+        self.assertEqual(sorted(event_times), event_times)  # coalesced events keep the time of their first part
+
+    def test_coalesce_large_backlog(self):
+        async_recorder = self.start('coalesce', max_queue_events=2, max_queue_size=64 * 1024 * 1024)
+        async_recorder.record_server_output('b')
+        chunk = 'x' * 1023 + '\n'
+        start = time.time()
+        for _ in xrange(16 * 1024):  # 16MB: over a minute when each merge copied the data merged so far
+            async_recorder.record_server_output(chunk)
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(16 * 1024 - 1, async_recorder.coalesced_events)
+
+        self.recorder.gate.set()
+        async_recorder.end()
+        self.assertEqual([('out', 'a'), ('out', 'b'), ('out', chunk * 16 * 1024)], self.written())
+
+    def test_recorder_failure(self):
+        recorder = _GatedRecorder()
+        recorder.gate.set()
+        recorder.record_user_input = None  # not callable
+        async_recorder = AsyncRecorder(recorder)
+        async_recorder.start()
+        async_recorder.record_user_input('a')
+        async_recorder.record_server_output('b')
+        async_recorder.end()
+        self.assertEqual([], recorder.events)
+        self.assertFalse(recorder.ended)
+        self.assertEqual(2, async_recorder.written_size)
+
+
+class _Message(object):
+    """Stands in for Cap'n Proto messages (pycapnp may not be installed): written as json lines"""
+
+    def __init__(self):
+        self.__dict__['fields'] = {}
+
+    def __setattr__(self, name, value):
+        self.fields[name] = value
+
+    def __getattr__(self, name):
+        try:
+            return self.fields[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def init(self, name, count=None):
+        value = self.fields[name] = _Message() if count is None else [_Message() for _ in range(count)]
+        return value
+
+    def to_dict(self):
+        def _value(value):
+            if isinstance(value, _Message):
+                return value.to_dict()
+            if isinstance(value, list):
+                return [_value(item) for item in value]
+            return value
+        return dict((name, _value(value)) for name, value in self.fields.iteritems())
+
+    def to_bytes_packed(self):
+        return json.dumps(self.to_dict()) + '\n'
+
+    def write(self, fpout):
+        fpout.write(self.to_bytes_packed())
+
+    write_packed = write
+
+
+class _MessageType(object):
+    new_message = _Message
+
+
+class _Schema(object):
+    Session = Event = _MessageType
+
+
+class BatchedCapnpSessionRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patched = dict((name, getattr(fmt_capnp, name)) for name in ('LOG_ROOT', 'session_capnp', 'get_terminal_size'))
+        fmt_capnp.LOG_ROOT = self.tmpdir
+        fmt_capnp.session_capnp = _Schema
+        fmt_capnp.get_terminal_size = lambda: (24, 80)
+
+    def tearDown(self):
+        for name, value in self.patched.iteritems():
+            setattr(fmt_capnp, name, value)
+        shutil.rmtree(self.tmpdir)
+
+    def record(self, recorder, events):
+        """Record (time, method, args) events, and returns the recorded (type, data or window size, time) events"""
+        recorder.start()
+        start = recorder.last_ts
+        for when, method, args in events:
+            recorder.event_time = start + when
+            getattr(recorder, method)(*args)
+        recorder.event_time = start + events[-1][0]
+        recorder.end(3)
+        with open(recorder.filename) as fpin:
+            lines = [json.loads(line) for line in fpin]
+        self.assertEqual(24, lines[0]['windowSize']['lines'])
+        recorded = []
+        when = 0.0
+        for event in lines[1:]:
+            when += event['timecode']
+            value = event.get('data', event.get('windowSize', event.get('status')))
+            recorded.append((event['type'], value if not isinstance(value, dict) else (value['lines'], value['columns']),
+                             round(when, 6)))
+        return recorded
+
+    def test_coalescing(self):
+        recorder = fmt_capnp.BatchedCapnpSessionRecorder(granularity=0.05, flush_period=3600, max_event_size=6)
+        events = [
+            (0.0, 'record_server_output', ('ab',)),
+            (0.01, 'record_server_output', ('cd',)),
+            (0.02, 'record_user_input', ('x',)),  # different type
+            (0.03, 'record_user_input', ('y',)),
+            (0.04, 'record_server_output', ('ef',)),
+            (0.05, 'record_server_output', ('gh',)),
+            (0.06, 'record_server_output', ('ij',)),
+            (0.07, 'record_server_output', ('klmn',)),  # too large to merge
+            (0.2, 'record_server_output', ('op',)),  # too late to merge
+            (0.21, 'record_window_resize', (30, 100)),
+            (0.22, 'record_server_output', ('qr',)),
+        ]
+        self.assertEqual([
+            ('ptyInput', 'abcd', 0.0),
+            ('userInput', 'xy', 0.02),
+            ('ptyInput', 'efghij', 0.04),
+            ('ptyInput', 'klmn', 0.07),
+            ('ptyInput', 'op', 0.2),
+            ('windowResized', (30, 100), 0.21),
+            ('ptyInput', 'qr', 0.22),
+            ('sessionEnd', 3, 0.22),
+        ], self.record(recorder, events))
+
+    def test_same_as_unbatched(self):
+        events = [(number * 0.01, 'record_server_output', ('%d,' % number,)) for number in range(50)]
+        unbatched = self.record(fmt_capnp.CapnpSessionRecorder(), events)
+        batched = self.record(fmt_capnp.BatchedCapnpSessionRecorder(granularity=0, flush_period=3600), events)
+        self.assertEqual(unbatched, batched)
+
+    def test_buffering(self):
+        recorder = fmt_capnp.BatchedCapnpSessionRecorder(granularity=0, flush_period=3600, max_buffer_size=200)
+        recorder.start()
+        header_size = recorder.out_fp.tell()
+        recorder.event_time = recorder.last_ts
+        recorder.record_server_output('a')
+        recorder.record_window_resize(30, 100)  # writes the pending output event
+        self.assertEqual(2, len(recorder.buffer))
+        self.assertEqual(header_size, recorder.out_fp.tell())  # not written yet
+
+        for _ in range(4):
+            recorder.record_window_resize(30, 100)
+        self.assertTrue(recorder.out_fp.tell() > header_size)  # the buffer filled up, and was flushed
+        self.assertTrue(recorder.buffer_size < 200)
+        recorder.end()
+        self.assertTrue(recorder.out_fp.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
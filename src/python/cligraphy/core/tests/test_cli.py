@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Cligraph tests
+"""
+
+from cligraphy.core import parsers
+from cligraphy.core.cli import Cligraph
+from cligraphy.core.config import ConfigNode
+from cligraphy.core.decorators import Tag, tag
+from cligraphy.core.util import CALL_ARGS, CALL_KWARGS, CALL_NONE
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import uuid
+
+
+class _Cligraph(Cligraph):
+    """A Cligraph with a given configuration"""
+
+    def __init__(self, path, conf):
+        self.tool_name = self.tool_shortname = 'octest'
+        self.tool_path = path
+        self.conf = ConfigNode(conf)
+        self.reporter = None
+        self._audit_command = None
+
+
+class _Warnings(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class CommandMapsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.good, self.partial = ['oc_test_commands_%s' % uuid.uuid4().hex for _ in range(2)]
+        self.write(self.good, 'hello.py', '"""Say hello"""\n\ndef main():\n    pass\n')
+        self.write(self.partial, 'needsdep.py', '"""Needs a missing dependency"""\n\nimport oc_test_missing_dependency\n')
+        self.write(self.partial, 'status.py', '"""Show status"""\n\ndef main():\n    pass\n')
+        sys.path.insert(0, self.tmpdir)
+        self.warnings = _Warnings()
+        logging.getLogger().addHandler(self.warnings)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.warnings)
+        sys.path.remove(self.tmpdir)
+        for name in list(sys.modules):
+            if name.startswith('oc_test_commands_'):
+                del sys.modules[name]
+        del parsers.UNAVAILABLE_MODULES[:]
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, package, name, source):
+        directory = os.path.join(self.tmpdir, package)
+        if not os.path.isdir(directory):
+            os.mkdir(directory)
+            open(os.path.join(directory, '__init__.py'), 'w').close()
+        with open(os.path.join(directory, name), 'w') as fpout:
+            fpout.write(source)
+
+    def cligraph(self, build_processes):
+        commands = {self.good: None, self.partial: {'namespace': 'partial'}, 'oc_test_commands_missing': None}
+        cligraph = _Cligraph(self.tmpdir, {'tool': {'shortname': 'octest'}, 'user': {'dotdir': self.tmpdir},
+                                           'commands': commands})
+        cligraph.build_processes = build_processes
+        return cligraph
+
+    def test_build(self):
+        for build_processes in (1, 2):
+            command_maps = dict(self.cligraph(build_processes).get_command_maps(autodiscover=True))
+            self.assertEqual(['', 'partial'], sorted(command_maps))  # the missing module is skipped
+            self.assertEqual(['hello'], list(command_maps['']['commands']))
+            self.assertEqual(['needsdep', 'status'], sorted(command_maps['partial']['commands']))
+            self.assertTrue(command_maps['partial']['commands']['needsdep'].get('error'))
+
+            self.assertEqual(['%s.needsdep' % self.partial], [name for name, _ in parsers.UNAVAILABLE_MODULES])
+            self.assertEqual(1, self.warnings.messages.count('The following modules are not available:'))
+            self.assertIn('oc_test_commands_missing', ' '.join(self.warnings.messages))
+            del parsers.UNAVAILABLE_MODULES[:]
+            del self.warnings.messages[:]
+
+
+class RunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cligraph = _Cligraph(None, {})
+        self.calls = []
+
+    def run_command(self, func, call=None, **values):
+        args = argparse.Namespace(_func=func, _level=None, _parser='parser', a=1, b=2, **values)
+        if call is not None:
+            args._call = call
+        return self.cligraph._run(args)
+
+    def test_call_none(self):
+        self.assertEqual('done', self.run_command(lambda: 'done', [CALL_NONE, None]))
+        self.assertEqual('done', self.run_command(lambda: 'done'))
+        # the convention found by autodiscovery wins over introspection (which would pass a and b)
+        self.assertEqual(((), {}), self.run_command(lambda *args, **kwargs: (args, kwargs), [CALL_NONE, None]))
+
+    def test_call_args(self):
+        for call in ([CALL_ARGS, None], None):
+            args = self.run_command(lambda args: args, call)
+            self.assertEqual({'a': 1, 'b': 2, '_parser': 'parser'}, vars(args))  # internal args removed
+
+    def test_call_kwargs(self):
+        def main(a, b=0, c=3):
+            return a, b, c
+        self.assertEqual((1, 2, 3), self.run_command(main, [CALL_KWARGS, ['a', 'b', 'c']], d=4))  # only its params
+        self.assertEqual((1, 2, 3), self.run_command(main, d=4))  # introspected: same
+        self.assertEqual({'a': 1, 'b': 2, 'd': 4}, self.run_command(lambda **kwargs: kwargs, [CALL_KWARGS, None], d=4))
+        self.assertEqual({'a': 1, 'b': 2}, self.run_command(lambda a, **kwargs: dict(kwargs, a=a)))
+
+    def test_decorated(self):
+        @tag(Tag.strict)
+        def main(args):
+            self.calls.append(sorted(vars(args)))
+
+        @tag(Tag.strict)
+        def main_kwargs(a, b):
+            self.calls.append((a, b))
+        self.run_command(main)  # wrapper(*args, **kwargs): call_convention looks at the decorated function
+        self.run_command(main_kwargs)
+        self.assertEqual([['_parser', 'a', 'b'], (1, 2)], self.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
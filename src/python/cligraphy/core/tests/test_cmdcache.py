@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Command map cache format tests
+"""
+
+from cligraphy.core.cmdcache import CommandIndex, CommandShard, is_command, write_command_index
+from cligraphy.core.util import CALL_ARGS, CALL_KWARGS, CALL_NONE
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+COMMAND_MAP = {
+    'module': 'tool.commands',
+    'commands': {
+        'status': {'type': 'cmd', 'help': 'Show status', 'desc': 'Show status', 'call': [CALL_ARGS, None]},
+        'dev': {
+            'lint': {'type': 'cmd', 'help': 'Lint', 'desc': 'Lint all the things', 'call': [CALL_KWARGS, ['path', 'fix']]},
+            'broken': {'type': 'cmd', 'help': 'Broken', 'desc': 'ImportError: nope', 'error': True},
+            'Zed': {'type': 'cmd', 'help': 'Upper case', 'desc': 'Upper case', 'call': [CALL_NONE, None]},
+            u'caf\xe9': {'type': 'cmd', 'help': u'Caf\xe9', 'desc': u'Caf\xe9'},
+            'type': {'type': 'cmd', 'help': 'A command named type', 'desc': 'A command named type'},
+        },
+        'empty': {},
+    },
+}
+
+
+def _as_dict(node):
+    """Turn a (possibly index backed) command map node into plain dicts"""
+    if is_command(node):
+        return dict(node)
+    return dict((name, _as_dict(child)) for name, child in node.iteritems())
+
+
+class CommandIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'commands.idx')
+        write_command_index(self.filename, COMMAND_MAP)
+        self.index = CommandIndex(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        command_map = self.index.command_map()
+        self.assertEqual('tool.commands', command_map['module'])
+        self.assertEqual(COMMAND_MAP['commands'], _as_dict(command_map['commands']))
+
+    def test_children_sorted_by_utf8_bytes(self):
+        dev = self.index.command_map()['commands']['dev']
+        self.assertEqual(['Zed', 'broken', u'caf\xe9', 'lint', 'type'], list(dev))
+        self.assertEqual(5, len(dev))
+
+    def test_find_child(self):
+        commands = self.index.command_map()['commands']
+        for name in ('status', 'dev', 'empty'):
+            self.assertIn(name, commands)
+        dev = commands['dev']
+        for name in ('Zed', 'broken', u'caf\xe9', 'caf\xc3\xa9', 'lint', 'type'):
+            self.assertIn(name, dev)
+        for name in ('', 'a', 'zzz', 'lin', 'lints', 'zed'):
+            self.assertNotIn(name, dev)
+        self.assertRaises(KeyError, lambda: dev['nope'])
+        self.assertEqual(0, len(commands['empty']))
+
+    def test_namespaces_are_not_commands(self):
+        commands = self.index.command_map()['commands']
+        self.assertFalse(is_command(commands['dev']))  # has a child named type, still a namespace
+        self.assertTrue(is_command(commands['dev']['type']))
+        self.assertEqual('A command named type', commands['dev'].get('type')['help'])
+
+    def test_bad_index(self):
+        with open(self.filename, 'wb') as fpout:
+            fpout.write('NOTANIDX' + '\0' * 32)
+        self.assertRaises(ValueError, CommandIndex, self.filename)
+        with open(self.filename, 'wb') as fpout:
+            fpout.write('OCC')
+        self.assertRaises(ValueError, CommandIndex, self.filename)
+
+
+class CommandShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loads = []
+        self.shard = CommandShard(self._load)
+
+    def _load(self):
+        self.loads.append(True)
+        return COMMAND_MAP['commands']['dev']
+
+    def test_lazy(self):
+        self.assertFalse(is_command(self.shard))
+        self.assertEqual([], self.loads)
+        self.assertEqual(['Zed', 'broken', u'caf\xe9', 'lint', 'type'], sorted(self.shard))
+        self.assertIn('lint', self.shard)
+        self.assertEqual([True], self.loads)
+
+    def test_get_child_named_type(self):
+        self.assertEqual('A command named type', self.shard.get('type')['help'])
+        self.assertEqual(None, self.shard.get('nope'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright 2016 Netflix, Inc.
+
+"""Shell completion fast path tests
+"""
+
+from cligraphy.core.completion import complete_command_names, output_completions
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+COMMAND_MAPS = [
+    ('', {'module': 'tool.commands', 'commands': {
+        'status': {'type': 'cmd', 'help': 'Show status'},
+        'stats': {'type': 'cmd', 'help': 'Caf\xc3\xa9 statistics'},  # utf-8 byte string, like a py2 docstring
+        'dev': {'lint': {'type': 'cmd', 'help': u'Lint – all the things'}},
+    }}),
+]
+
+
+class CompleteCommandNamesTest(unittest.TestCase):
+
+    def test_root(self):
+        self.assertEqual(['stats', 'status'], [name for name, _ in complete_command_names(COMMAND_MAPS, [], 'st')])
+
+    def test_namespace(self):
+        self.assertEqual([('lint', u'Lint – all the things')], complete_command_names(COMMAND_MAPS, ['dev'], ''))
+        self.assertEqual([], complete_command_names(COMMAND_MAPS, ['nope'], ''))
+
+    def test_command_arguments(self):
+        self.assertIsNone(complete_command_names(COMMAND_MAPS, ['status'], ''))
+        self.assertIsNone(complete_command_names(COMMAND_MAPS, [], '--deb'))
+
+    def test_global_options(self):
+        self.assertEqual(['lint'], [name for name, _ in complete_command_names(COMMAND_MAPS, ['--debug', 'dev'], '')])
+        self.assertEqual(['lint'], [name for name, _ in complete_command_names(COMMAND_MAPS, ['--batch', 'dev', 'dev'], '')])
+        self.assertEqual(['lint'], [name for name, _ in complete_command_names(COMMAND_MAPS, ['--batch=dev', 'dev'], '')])
+        self.assertIsNone(complete_command_names(COMMAND_MAPS, ['--batch'], ''))  # a file name
+
+
+class OutputCompletionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['_ARGCOMPLETE_STDOUT_FILENAME'] = os.path.join(self.tmpdir, 'out')
+        os.environ['_ARGCOMPLETE_IFS'] = '\n'
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def output(self, completions):
+        output_completions(completions)
+        with open(os.environ['_ARGCOMPLETE_STDOUT_FILENAME'], 'rb') as fpin:
+            return fpin.read()
+
+    def test_non_ascii_help(self):
+        os.environ['_ARGCOMPLETE_DFS'] = '\t'
+        completions = complete_command_names(COMMAND_MAPS, [], '') + complete_command_names(COMMAND_MAPS, ['dev'], '')
+        self.assertEqual('dev\tDev sub-command group\nstats\tCaf\xc3\xa9 statistics\nstatus\tShow status\n'
+                         'lint\tLint \xe2\x80\x93 all the things', self.output(completions))
+
+    def test_names(self):
+        self.assertEqual('stats\nstatus', self.output([('stats', 'Caf\xc3\xa9'), (u'status', None)]))
+        self.assertEqual('status ', self.output([('status', None)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Configuration tests
+"""
+
+from cligraphy.core import dictify_recursive, read_configuration, resolve_config
+from cligraphy.core.config import ConfigNode
+
+import copy
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class _Tool(object):
+    """Just what read_configuration needs from a Cligraph"""
+
+    def __init__(self, path):
+        self.tool_name = 'testtool'
+        self.tool_shortname = 'tt'
+        self.tool_path = path
+
+
+DATA = {
+    'report': {'enabled': True, 'max_output_size': 1024},
+    'commands': {'tool.commands': None, 'other.commands': {'namespace': 'other'}},
+    'paths': ['a', {'b': 1}],
+}
+
+
+class ConfigNodeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conf = ConfigNode(DATA)
+
+    def test_freeze(self):
+        self.assertEqual(DATA, self.conf.to_dict())
+        self.assertIsInstance(self.conf['report'], ConfigNode)
+        self.assertEqual(('a', ConfigNode({'b': 1})), self.conf.paths)
+        self.assertIsInstance(self.conf.paths[1], ConfigNode)
+        self.assertIs(self.conf.report, ConfigNode(self.conf).report)  # already frozen nodes are reused
+
+    def test_attributes(self):
+        self.assertTrue(self.conf.report.enabled)
+        self.assertEqual('other', self.conf.commands['other.commands'].namespace)
+        self.assertEqual(1024, self.conf.report.get('max_output_size'))
+        self.assertRaises(AttributeError, getattr, self.conf, 'nope')
+        self.assertFalse(hasattr(self.conf.report, 'nope'))
+
+    def test_lookup(self):
+        self.assertEqual(1024, self.conf.lookup('report.max_output_size'))
+        self.assertIs(self.conf.report, self.conf.lookup('report'))
+        self.assertIsNone(self.conf.lookup('commands.tool.commands'))  # keys with dots can't be told apart
+        self.assertEqual('default', self.conf.lookup('report.nope', 'default'))
+        self.assertEqual('default', self.conf.lookup('paths.b', 'default'))  # no lookups through lists
+
+    def test_immutable(self):
+        for mutate in (lambda: setattr(self.conf, 'report', None),
+                       lambda: self.conf.__setitem__('report', None),
+                       lambda: delattr(self.conf, 'report'),
+                       lambda: self.conf.report.update(enabled=False),
+                       lambda: self.conf.pop('report'),
+                       lambda: self.conf.setdefault('new', 1),
+                       self.conf.clear):
+            self.assertRaises(TypeError, mutate)
+        self.assertEqual(DATA, self.conf.to_dict())
+        self.assertIs(self.conf, self.conf.copy())
+
+    def test_thaw(self):
+        for thawed in (self.conf.to_dict(), dictify_recursive(self.conf)):
+            self.assertEqual(DATA, thawed)
+            self.assertIs(dict, type(thawed['report']))
+            self.assertIs(list, type(thawed['paths']))
+            self.assertIs(dict, type(thawed['paths'][1]))
+
+    def test_copies(self):
+        for copied in (pickle.loads(pickle.dumps(self.conf, pickle.HIGHEST_PROTOCOL)), copy.deepcopy(self.conf)):
+            self.assertIsInstance(copied, ConfigNode)
+            self.assertIsInstance(copied.report, ConfigNode)
+            self.assertEqual(self.conf, copied)
+
+
+class ResolveConfigTest(unittest.TestCase):
+
+    def assertCircular(self, cfg, cycle):
+        """Check that resolving cfg reports the given reference cycle (starting anywhere in it)"""
+        try:
+            resolve_config(cfg)
+        except Exception as exc:  # pylint:disable=broad-except
+            chain = str(exc).split(': ')[-1].split(' -> ')
+            self.assertEqual(chain[0], chain[-1])
+            start = cycle.index(chain[0])
+            self.assertEqual(cycle[start:] + cycle[:start], chain[:-1])
+        else:
+            self.fail('circular references not detected')
+
+    def test_resolve(self):
+        cfg = {
+            'a': '%cfg.b%/a',
+            'b': '%cfg.c.d%/b',
+            'c': {'d': '%cfg.e% and %cfg.e%', 'f': 'plain %cfg'},
+            'e': 1,
+            'g': 'tree: %cfg.c%',
+        }
+        resolve_config(cfg)
+        self.assertEqual('1 and 1/b/a', cfg['a'])
+        self.assertEqual('plain %cfg', cfg['c']['f'])
+        self.assertEqual("tree: {'d': '1 and 1', 'f': 'plain %cfg'}", cfg['g'])  # sub trees are resolved first
+
+    def test_long_chain(self):
+        cfg = dict(('k%d' % number, '%%cfg.k%d%%' % (number + 1)) for number in range(100))
+        cfg['k100'] = 'end'
+        resolve_config(cfg)
+        self.assertEqual('end', cfg['k0'])
+
+    def test_circular(self):
+        self.assertCircular({'a': '%cfg.a%'}, ['a'])
+        self.assertCircular({'a': '%cfg.b%', 'b': '%cfg.a%', 'c': '%cfg.a%'}, ['a', 'b'])
+        self.assertCircular({'d': '%cfg.a%', 'a': '%cfg.b.c%', 'b': {'c': 'x %cfg.d%'}}, ['d', 'a', 'b.c'])
+        self.assertCircular({'a': '%cfg.t%', 't': {'x': 'y', 'z': '%cfg.a%'}}, ['a', 't.z'])
+
+    def test_unresolved(self):
+        self.assertRaisesRegexp(Exception, r"a: %cfg.nope% \(no such configuration key: nope\)",
+                                resolve_config, {'a': '%cfg.nope%'})
+        self.assertRaisesRegexp(Exception, r"a: x%cfg.b% \(references unresolved b\)",
+                                resolve_config, {'a': 'x%cfg.b%', 'b': '%cfg.nope%'})
+
+
+class ConfCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['HOME'] = self.tmpdir
+        os.environ['USER'] = 'tester'
+        os.makedirs(os.path.join(self.tmpdir, '.tt'))
+        os.makedirs(os.path.join(self.tmpdir, 'tool', 'conf'))
+        self.tool = _Tool(os.path.join(self.tmpdir, 'tool'))
+        self.shared = os.path.join(self.tmpdir, 'tool', 'conf', 'tt.yaml')
+        self.custom = os.path.join(self.tmpdir, '.tt', 'tt.yaml')
+        self.cache = os.path.join(self.tmpdir, '.tt', 'conf.cache')
+        self.write(self.shared, 'greeting: hello %cfg.user.name%\nreport:\n  enabled: true\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, filename, text, mtime=None):
+        with open(filename, 'w') as fpout:
+            fpout.write(text)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def test_cached(self):
+        conf, layers = read_configuration(self.tool)
+        self.assertTrue(os.path.exists(self.cache))
+        self.assertEqual('hello tester', conf.greeting)
+
+        mtime = os.stat(self.cache).st_mtime
+        cached_conf, cached_layers = read_configuration(self.tool)
+        self.assertEqual(conf, cached_conf)
+        self.assertEqual(layers, cached_layers)
+        self.assertEqual(mtime, os.stat(self.cache).st_mtime)
+
+    def test_cache_is_used(self):
+        read_configuration(self.tool)
+        with open(self.cache, 'rb') as fpin:
+            data = fpin.read()
+        self.write(self.cache, data.replace('enabled', 'ENABLED'))
+        self.assertTrue(read_configuration(self.tool)[0].report.ENABLED)
+
+    def test_invalidation(self):
+        mtime = time.time() - 60
+        self.write(self.shared, 'value: 1\n', mtime)
+        self.assertEqual(1, read_configuration(self.tool)[0].value)
+
+        self.write(self.shared, 'value: 2\n', mtime + 1)
+        self.assertEqual(2, read_configuration(self.tool)[0].value)
+
+        self.write(self.shared, 'value: 30\n', mtime + 1)  # same mtime, different size
+        self.assertEqual(30, read_configuration(self.tool)[0].value)
+
+        self.write(self.custom, 'value: 4\n')  # a new layer file
+        self.assertEqual(4, read_configuration(self.tool)[0].value)
+
+        os.environ['USER'] = 'someone'  # the automatic layer changed
+        self.assertEqual('someone', read_configuration(self.tool)[0].user.name)
+
+    def test_bad_cache(self):
+        read_configuration(self.tool)
+        self.write(self.cache, 'garbage')
+        self.assertEqual('hello tester', read_configuration(self.tool)[0].greeting)
+
+    def test_custom_suffix_is_not_cached(self):
+        self.write(self.custom + '.edit', 'value: 5\n')
+        self.assertEqual(5, read_configuration(self.tool, custom_suffix='.edit')[0].value)
+        self.assertFalse(os.path.exists(self.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Static discovery and isolated workers tests
+"""
+
+from cligraphy.core import discovery
+from cligraphy.core.util import CALL_ARGS, CALL_KWARGS, CALL_NONE, call_convention
+
+import ast
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+MAINS = [
+    ('def main():\n    pass\n', [CALL_NONE, None]),
+    ('def main(args):\n    pass\n', [CALL_ARGS, None]),
+    ('def main(a, b=1):\n    pass\n', [CALL_KWARGS, ['a', 'b']]),
+    ('def main(args, *rest):\n    pass\n', [CALL_KWARGS, ['args']]),
+    ('def main(a, **kwargs):\n    pass\n', [CALL_KWARGS, None]),
+    ('def main(**kwargs):\n    pass\n', [CALL_NONE, None]),  # no named parameters
+]
+
+
+class StaticCallConventionTest(unittest.TestCase):
+
+    def convention(self, source):
+        return discovery._static_call_convention(ast.parse(source).body[-1])
+
+    def test_same_as_introspection(self):
+        for source, expected in MAINS:
+            namespace = {}
+            exec source in namespace  # pylint:disable=exec-used
+            self.assertEqual(expected, call_convention(namespace['main']))
+            self.assertEqual(expected, self.convention(source), source)
+
+    def test_undetermined(self):
+        for source in ('@decorate\ndef main(args):\n    pass\n',  # the decorator could change the signature
+                       'def main(item):\n    pass\n',  # programming error, reported when run
+                       'def main((a, b)):\n    pass\n',
+                       'main = lambda: None\n'):
+            self.assertIsNone(self.convention(source), source)
+
+    def test_metadata(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'command.py')
+            for source, expected in MAINS:
+                with open(filename, 'w') as fpout:
+                    fpout.write('"""Help"""\n\n' + source)
+                self.assertEqual({'doc': 'Help', 'main': True, 'file': filename, 'call': expected},
+                                 discovery.static_module_metadata(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class StaticModuleMetadataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'command.py')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def metadata(self, source):
+        with open(self.filename, 'w') as fpout:
+            fpout.write(source)
+        return discovery.static_module_metadata(self.filename)
+
+    def test_static(self):
+        for source in ('def main():\n    pass\n',
+                       'from tool.util import main\n',
+                       'def run():\n    for main in []:\n        pass\n\nmain = run\n'):  # function locals
+            self.assertTrue(self.metadata(source)['main'], source)
+        for source in ('MAIN = 1\n',
+                       'def run():\n    main = 1\n'):
+            self.assertFalse(self.metadata(source)['main'], source)
+
+    def test_dynamic(self):
+        for source in ('from tool.util import *\n',
+                       'if True:\n    from tool.util import *\n',
+                       'for main in [len]:\n    pass\n',
+                       'for name, main in []:\n    pass\n',
+                       'with open(__file__) as main:\n    pass\n',
+                       'try:\n    pass\nexcept Exception as main:\n    pass\n',
+                       '[0 for main in [1]]\n',
+                       'def run():\n    global main\n    main = len\n\nrun()\n',
+                       'def main():\n    pass\n\nfor main in []:\n    pass\n',
+                       'def main():\n    pass\n\nglobals()["main"] = None\n'):
+            self.assertIsNone(self.metadata(source), source)
+
+
+def _work(item):
+    """imap_isolated test function: items are action:value strings"""
+    action, _, value = item.partition(':')
+    if action == 'die':
+        os._exit(1)
+    elif action == 'hang':
+        time.sleep(60)
+    return {'value': value, 'pid': os.getpid(), 'retire': action == 'retire'}
+
+
+class ImapIsolatedTest(unittest.TestCase):
+
+    def imap(self, items, **kwargs):
+        return dict(discovery.imap_isolated(_work, items, **kwargs))
+
+    def test_results(self):
+        items = ['ok:%d' % number for number in range(6)] + ['retire:6']
+        results = self.imap(items, processes=2)
+        self.assertEqual(sorted(items), sorted(results))
+        self.assertEqual([str(number) for number in range(7)], sorted(result['value'] for result in results.itervalues()))
+        self.assertTrue(all('retire' not in result for result in results.itervalues()))
+        self.assertTrue(len(set(result['pid'] for result in results.itervalues())) <= 3)  # workers are reused
+
+    def test_lazy(self):
+        pulled = []
+        skipped = set()
+
+        def _items():
+            for number in range(5):
+                if number not in skipped:
+                    pulled.append(number)
+                    yield 'ok:%d' % number
+
+        seen = []
+        for _, result in discovery.imap_isolated(_work, _items(), processes=1):
+            number = int(result['value'])
+            seen.append((number, list(pulled)))
+            skipped.add(number + 1)  # eg. modules below a package that could not be imported
+        self.assertEqual([(0, [0]), (2, [0, 2]), (4, [0, 2, 4])], seen)
+
+    def test_worker_death(self):
+        results = self.imap(['ok:1', 'die:2', 'ok:3'], processes=1)
+        self.assertEqual({'error': 'WorkerError: worker process died while importing die:2'}, results['die:2'])
+        self.assertEqual('3', results['ok:3']['value'])  # run by a new worker
+        self.assertNotEqual(results['ok:1']['pid'], results['ok:3']['pid'])
+
+    def test_timeout(self):
+        start = time.time()
+        results = self.imap(['hang:1', 'ok:2', 'ok:3'], processes=2, timeout=0.5)
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual({'error': 'TimeoutError: import took more than 0.5 seconds'}, results['hang:1'])
+        self.assertEqual(['2', '3'], [results['ok:2']['value'], results['ok:3']['value']])
+
+    def test_nothing(self):
+        self.assertEqual({}, self.imap(iter([])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Fuzzy command matching tests
+"""
+
+from cligraphy.core.fuzzy import FuzzyIndex, FuzzyMatcher, match_score
+
+import os
+import shutil
+import tempfile
+import unittest
+
+
+PATHS = ['dev lint', 'dev lint fix', 'deploy', 'status', 'stats show', 'my project build', u'caf\xe9 list']
+
+
+class FuzzyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = FuzzyIndex.build(PATHS)
+
+    def search(self, words, prefix=''):
+        return sorted(self.index.search(words, prefix), reverse=True)
+
+    def test_match_score(self):
+        self.assertEqual(15, match_score(['lint'], 'lint'))
+        self.assertEqual(8, match_score(['lin'], 'dev lint'))
+        self.assertEqual(-2, match_score(['in'], 'dev lint'))
+        self.assertIsNone(match_score(['x'], 'dev lint'))
+
+    def test_search(self):
+        self.assertEqual([(8, 'dev lint'), (6, 'dev lint fix')], self.search(['lin']))
+        self.assertEqual([(30, 'dev lint'), (28, 'dev lint fix')], self.search(['dev', 'lint']))
+        self.assertEqual([(18, 'dev lint fix')], self.search(['li', 'f']))
+        self.assertEqual([(13, 'caf\xc3\xa9 list')], self.search(['caf\xc3\xa9']))
+        self.assertEqual([], self.search(['zzz']))
+        self.assertEqual([], self.search(['lint', 'dev']))  # words match in order
+
+    def test_short_words(self):
+        self.assertEqual(['status', 'stats show', 'caf\xc3\xa9 list'], [path for _, path in self.search(['st'])])
+        self.assertEqual(self.search(['st']), self.search(['s']))  # not indexed, every path is a candidate
+
+    def test_prefix(self):
+        self.assertEqual([(11, 'tools dev lint'), (9, 'tools dev lint fix')], self.search(['lint'], 'tools'))
+        self.assertEqual([(23, 'tools dev lint'), (21, 'tools dev lint fix')], self.search(['to', 'lint'], 'tools'))
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'fuzzy.idx')
+            self.index.save(filename)
+            loaded = FuzzyIndex.load(filename)
+            self.assertEqual(self.index.paths, loaded.paths)
+            self.assertEqual(self.index.postings, loaded.postings)
+            self.assertEqual(self.search(['dev', 'lint']), sorted(loaded.search(['dev', 'lint']), reverse=True))
+
+            with open(filename, 'wb') as fpout:
+                fpout.write('not an index')
+            self.assertRaises(ValueError, FuzzyIndex.load, filename)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class FuzzyMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+        self.matcher = FuzzyMatcher()
+        self.matcher.add_source('', lambda: self._load('', PATHS))
+        self.matcher.add_source('tools', lambda: self._load('tools', ['lint']))
+
+    def _load(self, namespace, paths):
+        self.loaded.append(namespace)
+        return FuzzyIndex.build(paths)
+
+    def test_ranking(self):
+        self.assertEqual([], self.loaded)
+        self.assertEqual((['dev lint', 'tools lint', 'dev lint fix'], False), self.matcher.match(['lint']))
+        self.assertEqual((['deploy'], True), self.matcher.match(['dep']))
+        self.assertEqual(['', 'tools'], self.loaded)  # indexes are loaded once, when first needed
+
+
+if __name__ == '__main__':
+    unittest.main()
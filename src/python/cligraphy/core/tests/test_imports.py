@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Import time budget: importing our cli module must stay cheap, heavy dependencies are loaded when actually needed
+"""
+
+import json
+import subprocess
+import sys
+import unittest
+
+
+# Top level packages, besides the standard library, that importing cligraphy.core.cli may load
+ALLOWED_PACKAGES = frozenset(('cligraphy', 'yaml', '_yaml', 'enum'))
+
+# Heavy dependencies that must only be loaded on the code paths that use them
+DEFERRED_PACKAGES = frozenset(('requests', 'urllib3', 'argcomplete', 'faulthandler', 'setproctitle', 'remember',
+                               'gevent', 'multiprocessing', '_multiprocessing'))
+
+_LIST_MODULES = '''
+import json, sys
+before = set(sys.modules)
+import cligraphy.core.cli
+json.dump(sorted(name for name in set(sys.modules) - before if sys.modules[name] is not None), sys.stdout)
+'''
+
+
+def _is_stdlib(module):
+    """Returns True if module is a builtin or comes from the standard library"""
+    filename = getattr(module, '__file__', None)
+    if filename is None:
+        return True
+    return 'site-packages' not in filename and 'dist-packages' not in filename
+
+
+class ImportBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        # import in a fresh interpreter, as our own test runner may have loaded anything already
+        output = subprocess.check_output([sys.executable, '-c', _LIST_MODULES])
+        self.loaded = json.loads(output)
+
+    def test_no_deferred_packages(self):
+        loaded = set(name.split('.')[0] for name in self.loaded)
+        self.assertFalse(loaded & DEFERRED_PACKAGES, 'heavy modules loaded at import time: %s' %
+                         sorted(loaded & DEFERRED_PACKAGES))
+
+    def test_whitelist(self):
+        unexpected = set()
+        for name in self.loaded:
+            package = name.split('.')[0]
+            if package in ALLOWED_PACKAGES:
+                continue
+            __import__(name)
+            if not _is_stdlib(sys.modules[name]):
+                unexpected.add(package)
+        self.assertFalse(unexpected, 'unexpected modules loaded at import time: %s' % sorted(unexpected))
+
+
+if __name__ == '__main__':
+    unittest.main()
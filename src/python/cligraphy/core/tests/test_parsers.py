@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Command tree and autodiscovery tests
+"""
+
+from cligraphy.core import parsers
+from cligraphy.core.cmdcache import is_command
+from cligraphy.core.config import ConfigNode
+from cligraphy.core.discovery import fingerprint
+from cligraphy.core.parsers import AutoDiscoveryCommandMap, ExecCommandMap, LazyCommandLevel, ParserError, \
+    SmartCommandMapParser, exec_command, split_args
+
+import StringIO
+import argparse
+import importlib
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+import uuid
+
+
+MODULES = {
+    '__init__.py': '',
+    'hello.py': '"""Say hello"""\n\ndef main(args):\n    pass\n',
+    'needsdep.py': '"""Needs a missing dependency"""\n\nimport oc_test_missing_dependency\n\ndef main(args):\n    pass\n',
+    'helpers.py': 'VALUE = 1\n',
+    'sub/__init__.py': '',
+    'sub/inner.py': '"""Inner command"""\n\ndef main():\n    pass\n',
+}
+
+
+def _cmd(help_text='help'):
+    return {'type': 'cmd', 'help': help_text, 'desc': help_text}
+
+
+class LazyCommandLevelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = LazyCommandLevel('')
+        self.dev = self.root.namespace('dev')  # configured namespace
+        self.dev.add_source('first.commands', {'lint': _cmd()})
+        self.root.add_source('second.commands', {'dev': {'fmt': _cmd()}, 'top': _cmd()})
+
+    def test_merge(self):
+        children = self.root.children
+        self.assertEqual(['dev', 'top'], list(children))
+        self.assertEqual(['lint', 'fmt'], list(children['dev'].children))
+        self.assertEqual(('second.commands', _cmd()), children['top'])
+
+    def test_merge_leaves_configured_levels_alone(self):
+        for _ in xrange(3):
+            self.root.add_source('third.commands', {})  # forces children to be computed again
+            self.assertEqual(['lint', 'fmt'], list(self.root.children['dev'].children))
+        self.assertEqual([('first.commands', {'lint': _cmd()})], self.dev.sources)
+
+    def test_iter_commands(self):
+        self.assertEqual(['dev fmt', 'dev lint', 'top'], sorted(path for path, _, _ in self.root.iter_commands()))
+
+
+class SmartCommandMapParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.package = 'oc_test_commands_%s' % uuid.uuid4().hex
+        for name, source in (('__init__.py', ''),
+                             ('hello.py', 'def configure(parser):\n    parser.add_argument("--loud", action="store_true")\n\n'
+                                          'def main(args):\n    pass\n'),
+                             ('dev/__init__.py', ''),
+                             ('dev/lint.py', 'def main():\n    pass\n')):
+            filename = os.path.join(self.tmpdir, self.package, name)
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'w') as fpout:
+                fpout.write(source)
+        sys.path.insert(0, self.tmpdir)
+
+        self.parser = SmartCommandMapParser(prog='oc', lazy=True)
+        self.parser.add_argument('--debug', dest='_level', action='store_const', const=10)
+        self.parser.add_argument('--batch-results', dest='_batch_results', metavar='FILE')
+        self.parser.add_command_map('', {'module': self.package, 'commands': {'hello': _cmd('Say hello'),
+                                                                              'dev': {'lint': _cmd('Lint')}}})
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        for name in list(sys.modules):
+            if name.startswith(self.package):
+                del sys.modules[name]
+        del parsers.FUZZY_PARSED[:]
+        del parsers.RECENT_SUB_PARSERS[:]
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_args(self):
+        args = ['--batch-results', 'out.json', '--debug', 'dev', 'lint', '-x', 'y']
+        self.assertEqual((args[:3], ['dev', 'lint'], ['-x', 'y']), split_args(args, self.parser))
+        self.assertEqual((['--batch-results'], ['out.json', 'dev', 'lint'], []), split_args(args[:2] + args[3:5]))
+        self.assertEqual((['--batch-results=out.json'], ['dev'], []), split_args(['--batch-results=out.json', 'dev'], self.parser))
+        self.assertEqual((['--unknown'], ['dev'], []), split_args(['--unknown', 'dev'], self.parser))
+
+    def test_option_values(self):
+        args = self.parser.parse_args(['--batch-results', 'out.json', 'hello', '--loud'])
+        self.assertEqual('out.json', args._batch_results)
+        self.assertTrue(args.loud)
+        self.assertEqual(self.parser, self.parser.resolve_command(['--batch-results', 'dev']))  # dev is the file
+
+    def test_parse_args(self):
+        args = self.parser.parse_args(['--debug', 'dev', 'lint'])
+        self.assertEqual(10, args._level)
+        self.assertEqual('%s.dev.lint' % self.package, args._func.__module__)
+        self.assertEqual(['oc', 'oc dev', 'oc dev lint'], [parser.prog for parser in parsers.RECENT_SUB_PARSERS])
+        self.assertEqual([], parsers.FUZZY_PARSED)
+
+    def test_fuzzy(self):
+        args, func = self.parser.pre_parse_args(['--debug', 'lin', '-x'])
+        self.assertEqual(['--debug', 'dev', 'lint', '-x'], args)
+        self.assertEqual('%s.dev.lint' % self.package, func.__module__)
+        self.assertEqual([('--debug lin -x', '--debug dev lint -x')], parsers.FUZZY_PARSED)
+        self.assertTrue(self.parser.parse_args(['hel', '--loud']).loud)
+
+    def test_no_command(self):
+        self.assertEqual((['dev'], None), self.parser.pre_parse_args(['dev']))
+        try:
+            self.parser.parse_args(['dev'])
+        except ParserError as exc:
+            self.assertEqual('oc dev', exc.parser.prog)
+            self.assertEqual('too few arguments', exc.message)
+        else:
+            self.fail('namespace parsed as a command')
+
+    def test_unknown_option(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.parser.parse_args(['hello', '--nope'])
+        except ParserError as exc:
+            self.assertRaises(SystemExit, exc.report)
+            output = sys.stderr.getvalue()
+        else:
+            self.fail('unknown option accepted')
+        finally:
+            sys.stderr = stderr
+        self.assertEqual('oc hello', parsers.RECENT_SUB_PARSERS[-1].prog)
+        self.assertTrue(output.startswith('usage: oc hello [--loud] [-h]\n'))  # the command's help
+        self.assertIn('oc: error: unrecognized arguments: --nope', output)
+
+
+class _RecordingCommandMap(AutoDiscoveryCommandMap):
+    """Remembers which modules it inspects"""
+
+    def inspect_modules(self, module_names, filenames):
+        module_names = list(module_names)
+        self.inspected.extend(module_names)
+        return super(_RecordingCommandMap, self).inspect_modules(module_names, filenames)
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.package = 'oc_test_commands_%s' % uuid.uuid4().hex
+        for name, source in MODULES.iteritems():
+            self.write(name, source)
+        sys.path.insert(0, self.tmpdir)
+
+    def tearDown(self):
+        sys.path.remove(self.tmpdir)
+        for name in list(sys.modules):
+            if name.startswith(self.package):
+                del sys.modules[name]
+        del parsers.UNAVAILABLE_MODULES[:]
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, source):
+        filename = os.path.join(self.tmpdir, self.package, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fpout:
+            fpout.write(source)
+
+    def discover(self, previous, discovery='import'):
+        command_map = _RecordingCommandMap(None, self.package, discovery=discovery)
+        command_map.inspected = []
+        records = command_map.discover(importlib.import_module(self.package), previous)
+        return records, [name[len(self.package) + 1:] for name in command_map.inspected]
+
+    def command(self, records, name):
+        return records['%s.%s' % (self.package, name)]['command']
+
+    def test_discover(self):
+        records, inspected = self.discover({})
+        self.assertEqual(['hello', 'helpers', 'needsdep', 'sub', 'sub.inner'], sorted(inspected))
+        self.assertEqual('Say hello', self.command(records, 'hello')['help'])
+        self.assertEqual('Inner command', self.command(records, 'sub.inner')['help'])
+        self.assertTrue(self.command(records, 'needsdep')['error'])
+        self.assertIsNone(self.command(records, 'helpers'))
+        self.assertEqual(set(['import']), set(record['mode'] for record in records.itervalues()))
+
+    def test_incremental(self):
+        records, _ = self.discover({})
+        again, inspected = self.discover(records)
+        self.assertEqual(['needsdep'], inspected)  # unavailable modules are always inspected again
+        self.assertEqual(records, again)
+
+        self.write('hello.py', '"""Say hello again"""\n\ndef main(args):\n    pass\n')
+        _, inspected = self.discover(records)
+        self.assertEqual(['hello', 'needsdep'], sorted(inspected))
+
+    def test_fingerprint_reuse(self):
+        filename = os.path.join(self.tmpdir, self.package, 'hello.py')
+        previous = fingerprint(filename)
+        self.assertIs(previous, fingerprint(filename, previous))  # same mtime and size: not read again
+        changed = list(previous)
+        changed[1] += 1
+        self.assertEqual(previous, fingerprint(filename, changed))
+
+    def test_static_records_are_not_trusted_by_import_discovery(self):
+        records, _ = self.discover({}, discovery='static')
+        self.assertFalse(self.command(records, 'needsdep').get('error'))  # static discovery can't tell
+        self.assertEqual('static', records['%s.needsdep' % self.package]['mode'])
+
+        records, inspected = self.discover(records, discovery='import')
+        self.assertEqual(['hello', 'helpers', 'needsdep', 'sub', 'sub.inner'], sorted(inspected))
+        self.assertTrue(self.command(records, 'needsdep')['error'])
+
+        _, inspected = self.discover(records, discovery='static')
+        self.assertEqual(['needsdep'], inspected)
+
+    def test_records_without_mode_are_inspected_again(self):
+        records, _ = self.discover({})
+        for record in records.itervalues():
+            del record['mode']
+        _, inspected = self.discover(records)
+        self.assertEqual(['hello', 'helpers', 'needsdep', 'sub', 'sub.inner'], sorted(inspected))
+
+
+class _Cligraph(object):
+    """Just what command maps need from a Cligraph"""
+
+    def __init__(self, path):
+        self.tool_path = path
+        self.conf = ConfigNode({'tool': {'shortname': 'octest'}, 'user': {'dotdir': path}})
+
+
+def _thaw(node):
+    """A command map node as plain dicts, loading shards"""
+    return dict((name, dict(child) if is_command(child) else _thaw(child)) for name, child in node.iteritems())
+
+
+class ShardedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cligraph = _Cligraph(self.tmpdir)
+        self.commands = {'top': _cmd('Top'), 'dev': {'lint': _cmd('Lint'), 'db': {'migrate': _cmd('Migrate')}},
+                         'ops': {'deploy': _cmd('Deploy')}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, command_map, commands):
+        """Write commands to command_map's cache, with the mtimes of the files already there set to the past.
+        Returns whether anything changed, and the names of the (top level package) shards written"""
+        cache_files = [os.path.join(self.tmpdir, name) for name in os.listdir(self.tmpdir)]
+        for filename in cache_files:
+            os.utime(filename, (1, 1))
+        changed = command_map.write_cache(command_map.get_cache_filename(), {'module': 'tool.commands', 'commands': commands})
+        written = [name for name in commands if not is_command(commands[name])
+                   and os.stat(command_map.get_shard_filename(name)).st_mtime != 1]
+        return changed, sorted(written)
+
+    def read(self, command_map):
+        return _thaw(command_map.read_cache(command_map.get_cache_filename())['commands'])
+
+    def check_incremental(self, cache_format):
+        command_map = AutoDiscoveryCommandMap(self.cligraph, 'tool.commands', cache_format=cache_format)
+        self.assertEqual((True, ['dev', 'ops']), self.write(command_map, self.commands))
+        self.assertEqual(self.commands, self.read(command_map))
+        self.assertEqual((False, []), self.write(command_map, self.commands))
+
+        self.commands['dev']['db']['migrate'] = _cmd('Migrate the database')
+        self.assertEqual((True, ['dev']), self.write(command_map, self.commands))
+        self.assertEqual(self.commands, self.read(command_map))
+
+        self.commands['top'] = _cmd('Top level')  # in the manifest
+        self.assertEqual((True, []), self.write(command_map, self.commands))
+        self.assertEqual(self.commands, self.read(command_map))
+
+        del self.commands['ops']
+        self.commands['new'] = {'thing': _cmd('Thing')}
+        self.assertEqual((True, ['new']), self.write(command_map, self.commands))
+        self.assertEqual(self.commands, self.read(command_map))
+        self.assertFalse(os.path.exists(command_map.get_shard_filename('ops')))
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'commands.json')))  # only names the prefix
+        self.assertEqual([], [name for name in os.listdir(self.tmpdir) if name.endswith('.new')])
+
+    def test_incremental_json(self):
+        self.check_incremental('json')
+
+    def test_incremental_index(self):
+        self.check_incremental('index')
+
+    def test_missing_shard(self):
+        command_map = AutoDiscoveryCommandMap(self.cligraph, 'tool.commands')
+        self.write(command_map, self.commands)
+        os.unlink(command_map.get_shard_filename('ops'))
+        self.assertEqual((False, ['ops']), self.write(command_map, self.commands))  # written again
+        self.assertEqual(self.commands, self.read(command_map))
+
+
+class ExecCommandMapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.tmpdir, 'bin'))
+        self.write('greet.sh', '#!/bin/sh\n# Say hello\n#\n# Prints hello and its arguments.\necho hello "$@"\n')
+        self.write('plain', '#!/bin/sh\nexit 0\n')
+        self.write('notes.txt', '# Not executable\n', mode=0o644)
+        self.command_map = ExecCommandMap(_Cligraph(self.tmpdir), 'tools', 'bin')
+        self.indexed = []
+        original_get_help = self.command_map.get_help
+
+        def _get_help(filename):
+            self.indexed.append(os.path.basename(filename))
+            return original_get_help(filename)
+        self.command_map.get_help = _get_help
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text, mode=0o755, mtime=None):
+        filename = os.path.join(self.tmpdir, 'bin', name)
+        with open(filename, 'w') as fpout:
+            fpout.write(text)
+        os.chmod(filename, mode)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+
+    def commands(self, force_autodiscover=False):
+        return self.command_map.build(force_autodiscover)['commands']
+
+    def test_build(self):
+        commands = self.commands()
+        self.assertEqual(['greet', 'plain'], sorted(commands))
+        self.assertEqual('Say hello', commands['greet']['help'])
+        self.assertEqual(os.path.join(self.tmpdir, 'bin', 'greet.sh'), commands['greet']['exec'])
+        self.assertTrue(os.path.exists(self.command_map.get_cache_filename()))
+
+    def test_cached(self):
+        commands = self.commands()
+        del self.indexed[:]
+        self.assertEqual(commands, self.commands())
+        self.assertEqual([], self.indexed)
+        self.assertEqual(commands, self.commands(force_autodiscover=True))
+        self.assertEqual([], self.indexed)  # unchanged executables are not indexed again
+
+    def test_edited_in_place(self):
+        self.commands()
+        del self.indexed[:]
+        directory = os.path.join(self.tmpdir, 'bin')
+        directory_mtime = os.stat(directory).st_mtime
+        self.write('greet.sh', '#!/bin/sh\n# Say hi\necho hi "$@"\n', mtime=time.time() + 10)
+        os.utime(directory, (directory_mtime, directory_mtime))
+        self.assertEqual('Say hi', self.commands()['greet']['help'])
+        self.assertEqual(['greet.sh'], self.indexed)
+
+    def test_removed(self):
+        self.commands()
+        os.unlink(os.path.join(self.tmpdir, 'bin', 'plain'))
+        self.assertEqual(['greet'], sorted(self.commands()))
+
+
+class ExecCommandTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'show')
+        with open(self.filename, 'w') as fpout:
+            fpout.write('#!/bin/sh\necho "$@"\ngrep SigIgn /proc/$$/status\n')
+        os.chmod(self.filename, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def exec_command(self, argv):
+        """Returns the output of exec_command(argv) in a child process, and the signals the executable ignores"""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(read_fd)
+                os.dup2(write_fd, 1)
+                signal.signal(signal.SIGPIPE, signal.SIG_IGN)  # as python sets them up
+                signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+                exec_command(self.filename, argparse.Namespace(args=argv))
+            finally:
+                os._exit(1)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as fpin:
+            output = fpin.read()
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        args, ignored = output.splitlines()
+        ignored = int(ignored.split()[1], 16)
+        return args, [signum for signum in (signal.SIGPIPE, signal.SIGXFSZ) if ignored & (1 << (signum - 1))]
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs /proc')
+    def test_exec_command(self):
+        self.assertEqual(('-x --y z', []), self.exec_command(['--', '-x', '--y', 'z']))  # pre_parse_args separator
+        self.assertEqual(('a -- b', []), self.exec_command(['a', '--', 'b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Terminal capture I/O tests
+"""
+
+from cligraphy.core.capture import Recorder
+from cligraphy.core.capture import ptysnoop
+
+import errno
+import fcntl
+import os
+import pty
+import select
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+
+class _ListRecorder(Recorder):
+
+    def __init__(self):
+        self.output = []
+
+    def record_user_input(self, data):
+        pass
+
+    def record_server_output(self, data):
+        self.output.append(data)
+
+
+class ScriptIOTest(unittest.TestCase):
+    """Exercises the parent side of Script on a pty opened by the test, with our stdout redirected to a file"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.master, self.slave = pty.openpty()
+        self.recorder = _ListRecorder()
+        self.script = ptysnoop.Script(self.recorder, buff_size=16, max_buff_size=64, idle_timeout=0.2, select_timeout=0.05)
+        self.script.master = self.master
+        self.stdout = os.dup(ptysnoop.STDOUT)
+        self.output = os.path.join(self.tmpdir, 'stdout')
+        fileno = os.open(self.output, os.O_WRONLY | os.O_CREAT)
+        os.dup2(fileno, ptysnoop.STDOUT)
+        os.close(fileno)
+
+    def tearDown(self):
+        os.dup2(self.stdout, ptysnoop.STDOUT)
+        for fileno in (self.stdout, self.master, self.slave, self.script.wakeup_r, self.script.wakeup_w):
+            try:
+                os.close(fileno)
+            except OSError:
+                pass  # closed by the test
+        shutil.rmtree(self.tmpdir)
+
+    def written(self):
+        with open(self.output) as fpin:
+            return fpin.read()
+
+    def test_read_sizes(self):
+        os.write(self.slave, 'x' * 200)
+        sizes = []
+        for _ in range(4):
+            sizes.append(len(self.script._read(self.master)))
+        self.assertEqual([16, 32, 64, 64], sizes)  # doubling, up to max_buff_size
+        self.assertEqual('x' * 24, self.script._read(self.master))
+        self.assertEqual(64, self.script.read_sizes[self.master])  # more than a quarter of 64: unchanged
+
+        os.write(self.slave, 'y' * 4)
+        self.assertEqual('y' * 4, self.script._read(self.master))  # less than a quarter of 64: halves
+        self.assertEqual(32, self.script.read_sizes[self.master])
+        os.write(self.slave, 'z')
+        self.script._read(self.master)
+        self.assertEqual(16, self.script.read_sizes[self.master])
+        os.write(self.slave, 'z')
+        self.script._read(self.master)
+        self.assertEqual(16, self.script.read_sizes[self.master])  # not below buff_size
+
+    def test_drain_at_eof(self):
+        data = ''.join(chr(ord('a') + number % 26) for number in range(1000))
+        os.write(self.slave, data)
+        os.close(self.slave)  # like our child exiting: reading the master fails with EIO once it's drained
+        self.script._drain_pty()
+        self.assertEqual(data, self.written())
+        self.assertEqual(data, ''.join(self.recorder.output))
+        self.assertTrue(all(len(chunk) <= 64 for chunk in self.recorder.output))
+
+    def test_drain_nothing_left(self):
+        self.script._drain_pty()  # the slave is still open: EAGAIN
+        self.assertEqual('', self.written())
+
+    def run_loop(self, use_epoll):
+        io_actions = {self.master: self.script._on_pty_input}
+        os.write(self.slave, 'hello')
+        epoll = self.script._get_epoll(io_actions) if use_epoll else None
+        if epoll is not None:
+            try:
+                self.script._epoll_io_loop(epoll, io_actions)
+            finally:
+                epoll.close()
+        else:
+            self.script._select_io_loop(io_actions)
+        self.assertTrue(self.script.stop_event.is_set())  # the idle timeout expired
+        self.assertEqual('hello', self.written())
+        self.assertEqual(['hello'], self.recorder.output)
+
+    @unittest.skipUnless(hasattr(select, 'epoll'), 'needs epoll')
+    def test_epoll_loop(self):
+        self.run_loop(True)
+
+    def test_select_loop(self):
+        self.run_loop(False)
+
+    @unittest.skipUnless(hasattr(select, 'epoll'), 'needs epoll')
+    def test_select_fallback(self):
+        with open(self.output) as fpin:  # epoll can't watch regular files
+            self.assertIsNone(self.script._get_epoll({self.master: None, fpin.fileno(): None}))
+        epoll = self.script._get_epoll({self.master: None})
+        self.assertIsNotNone(epoll)
+        epoll.close()
+
+
+def _set_non_blocking(fileno):
+    fcntl.fcntl(fileno, fcntl.F_SETFL, fcntl.fcntl(fileno, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+def _read_all(fileno, chunks, delay=0):
+    """Read fileno until end of file, in a thread; returns the thread. Read data is appended to chunks"""
+    def _read():
+        time.sleep(delay)
+        while True:
+            select.select([fileno], [], [])
+            try:
+                data = os.read(fileno, 65536)
+            except OSError as ose:
+                if ose.errno == errno.EAGAIN:
+                    continue
+                raise
+            if not data:
+                return
+            chunks.append(data)
+    thread = threading.Thread(target=_read)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def _write_all(fileno, data):
+    """Write data to fileno and close it, in a thread; returns the thread"""
+    def _write():
+        ptysnoop.xwrite(fileno, data)
+        os.close(fileno)
+    thread = threading.Thread(target=_write)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class ForwarderTest(unittest.TestCase):
+
+    size = 4096
+    data = ''.join(chr(number % 251) for number in xrange(300 * 1024))
+
+    def setUp(self):
+        self.in_r, self.in_w = os.pipe()
+        self.out_r, self.out_w = os.pipe()
+        self.forwarders = [ptysnoop.BufferForwarder(self.size)]
+        if ptysnoop._get_splice() is not None:
+            self.forwarders.append(ptysnoop.SpliceForwarder(self.size))
+
+    def tearDown(self):
+        for forwarder in self.forwarders:
+            forwarder.close()
+        for fileno in (self.in_r, self.in_w, self.out_r, self.out_w):
+            try:
+                os.close(fileno)
+            except OSError:
+                pass  # closed by the test
+
+    def forward_data(self, forwarder):
+        """Forward our data through new pipes, with a thread writing it and another one reading it"""
+        in_r, in_w = os.pipe()
+        out_r, out_w = os.pipe()
+        chunks = []
+        reader = _read_all(out_r, chunks)
+        writer = _write_all(in_w, self.data)
+        results = []
+        while not results or results[-1] != 0:
+            select.select([in_r], [], [])
+            results.append(forwarder.forward(in_r, out_w))
+        os.close(out_w)
+        writer.join(10)
+        reader.join(10)
+        os.close(in_r)
+        os.close(out_r)
+        self.assertEqual(len(self.data), sum(results))
+        self.assertTrue(max(results) <= self.size)
+        return ''.join(chunks)
+
+    def test_byte_for_byte(self):
+        forwarded = [self.forward_data(forwarder) for forwarder in self.forwarders]
+        for output in forwarded:
+            self.assertEqual(len(self.data), len(output))
+            self.assertTrue(output == self.data)  # not assertEqual: no 300KiB diffs
+
+    def test_nothing_available(self):
+        _set_non_blocking(self.in_r)
+        for forwarder in self.forwarders:
+            self.assertIsNone(forwarder.forward(self.in_r, self.out_w))
+            os.write(self.in_w, 'abc')
+            self.assertEqual(3, forwarder.forward(self.in_r, self.out_w))
+            self.assertEqual('abc', os.read(self.out_r, 10))
+
+    @unittest.skipIf(ptysnoop._get_splice() is None, 'needs splice')
+    def test_splice_output_full(self):
+        _set_non_blocking(self.out_w)
+        filler = 0
+        try:
+            while True:
+                filler += os.write(self.out_w, 'f' * 4096)
+        except OSError as ose:
+            self.assertEqual(errno.EAGAIN, ose.errno)
+        chunks = []
+        reader = _read_all(self.out_r, chunks, delay=0.1)  # forward() waits for it to make room
+        os.write(self.in_w, self.data[:self.size])
+        self.assertEqual(self.size, self.forwarders[-1].forward(self.in_r, self.out_w))
+        os.close(self.out_w)
+        reader.join(10)
+        output = ''.join(chunks)
+        self.assertEqual('f' * filler, output[:filler])
+        self.assertTrue(output[filler:] == self.data[:self.size])
+
+
+if __name__ == '__main__':
+    unittest.main()
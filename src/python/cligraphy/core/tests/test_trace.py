@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Startup tracing tests
+"""
+
+from cligraphy.core import trace
+
+import StringIO
+import __builtin__
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import uuid
+
+
+class StartupTracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = 'oc_test_trace_%s' % uuid.uuid4().hex
+        self.write('outer', 'import os\nimport %s_inner\n' % self.prefix)
+        self.write('inner', 'VALUE = 1\n')
+        self.write('broken', 'import %s_missing\n' % self.prefix)
+        sys.path.insert(0, self.tmpdir)
+        self.original_import = __builtin__.__import__
+        self.tracer = trace.TRACER = trace.StartupTracer('oc test')
+
+    def tearDown(self):
+        trace.TRACER = None
+        __builtin__.__import__ = self.original_import
+        sys.path.remove(self.tmpdir)
+        for name in list(sys.modules):
+            if name.startswith(self.prefix):
+                del sys.modules[name]
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, source):
+        with open(os.path.join(self.tmpdir, '%s_%s.py' % (self.prefix, name)), 'w') as fpout:
+            fpout.write(source)
+
+    def tree(self, span):
+        return (span.category, span.name.replace(self.prefix, 'x'), [self.tree(child) for child in span.children])
+
+    def test_spans(self):
+        self.tracer.install_import_hook()
+        self.assertIsNot(self.original_import, __builtin__.__import__)
+        with trace.span('configure'):
+            __import__('%s_outer' % self.prefix)
+            self.assertRaises(ImportError, __import__, '%s_broken' % self.prefix)
+        with trace.span('parse'):
+            __import__('%s_inner' % self.prefix)  # already loaded: not traced
+        self.tracer.finish()
+
+        self.assertIs(self.original_import, __builtin__.__import__)
+        self.assertEqual(('main', 'oc test', [
+            ('phase', 'configure', [
+                ('import', 'x_outer', [('import', 'x_inner', [])]),  # os is already loaded
+                ('import', 'x_broken', [('import', 'x_missing', [])]),
+            ]),
+            ('phase', 'parse', []),
+        ]), self.tree(self.tracer.root))
+
+        def _check(span):
+            self.assertTrue(span.end is not None and span.start <= span.end)
+            for child in span.children:
+                self.assertTrue(span.start <= child.start and child.end <= span.end)
+                _check(child)
+        _check(self.tracer.root)
+
+    def test_unbalanced(self):
+        outer = self.tracer.begin('outer')
+        self.tracer.begin('inner')
+        self.tracer.end(outer)  # ends inner too
+        self.assertEqual([self.tracer.root], self.tracer.stack)
+        self.tracer.end(outer)  # already ended
+        self.assertEqual([self.tracer.root], self.tracer.stack)
+
+    def test_disabled(self):
+        trace.TRACER = None
+        with trace.span('nothing'):
+            pass
+        self.assertEqual([], self.tracer.root.children)
+
+    def test_report(self):
+        self.tracer.install_import_hook()
+        with trace.span('configure'):
+            __import__('%s_outer' % self.prefix)
+        filename = os.path.join(self.tmpdir, 'trace.json')
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.tracer.report(filename)
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+        self.assertIs(self.original_import, __builtin__.__import__)
+        self.assertTrue(output.startswith('Startup trace:\n'))
+        self.assertIn(' ms  oc test\n', output)
+        self.assertIn('import %s_inner' % self.prefix, self.tracer.format_tree(min_duration=0))  # may be too short to show
+        self.assertIn('Chrome trace saved to %s' % filename, output)
+        with open(filename) as fpin:
+            events = json.load(fpin)['traceEvents']
+        self.assertEqual(['oc test', 'configure', '%s_outer' % self.prefix, '%s_inner' % self.prefix],
+                         [event['name'] for event in events])
+        self.assertEqual(set(['X']), set(event['ph'] for event in events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Zygote server tests
+"""
+
+from cligraphy.core import trace, zygote
+from cligraphy.core.cmdcache import CommandShard
+from cligraphy.core.config import ConfigNode
+
+import collections
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+
+class _Cligraph(object):
+    """Just what the zygote server needs from a Cligraph. main() prints its working directory and environment, and
+    exits with the status given as its first argument"""
+
+    tool_shortname = 'zt'
+
+    def __init__(self, tmpdir):
+        self.tmpdir = tmpdir
+        self.layer = os.path.join(tmpdir, 'zt.yaml')
+        self.configure()
+
+    def configure(self):
+        if trace.is_enabled(self.tool_shortname):
+            trace.start('zt', self.get_trace_filename)
+        self.conf = ConfigNode({'commands': {}, 'user': os.getenv('ZT_USER', 'tester')})
+        self.conf_layers = collections.OrderedDict([('custom', [self.layer, None])])
+
+    def get_trace_filename(self):
+        return os.path.join(self.tmpdir, 'trace.json')
+
+    def get_command_maps(self, autodiscover=False):
+        return []
+
+    def main(self):
+        sys.stdout.write('%s %s\n' % (os.getcwd(), os.getenv('ZT_VALUE')))
+        return int(sys.argv[1])
+
+
+class _ZygoteServer(zygote.ZygoteServer):
+
+    sources_check_period = 0
+
+    def source_files(self):
+        return [os.path.join(self.cligraph.tmpdir, 'source.py')]
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@unittest.skipIf(zygote.sendfd is None, 'file descriptor passing not supported')
+class ZygoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        self.socket_path = os.path.join(self.tmpdir, 'zygote.sock')
+        for name in ('zt.yaml', 'source.py'):
+            self.touch(name, 'x')
+        self.server_pid = os.fork()
+        if self.server_pid == 0:
+            try:
+                _ZygoteServer(_Cligraph(self.tmpdir), self.socket_path).serve_forever()
+            finally:
+                os._exit(0)
+        self.assertTrue(_wait_for(lambda: os.path.exists(self.socket_path)))
+
+    def tearDown(self):
+        if not self.server_exited():
+            os.kill(self.server_pid, signal.SIGKILL)
+            os.waitpid(self.server_pid, 0)
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, name, text):
+        with open(os.path.join(self.tmpdir, name), 'w') as fpout:
+            fpout.write(text)
+
+    def server_exited(self):
+        if self.server_pid is not None and os.waitpid(self.server_pid, os.WNOHANG)[0] != 0:
+            self.server_pid = None
+        return self.server_pid is None
+
+    def run_client(self, argv, env=None):
+        """Run a client in a child process. Returns its exit status (None if it did not use the zygote), and its output"""
+        output = os.path.join(self.tmpdir, 'output')
+        pid = os.fork()
+        if pid == 0:
+            status = None
+            try:
+                fileno = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+                os.dup2(fileno, 1)
+                os.dup2(fileno, 2)
+                os.chdir(self.tmpdir)
+                os.environ.update(env or {})
+                sys.argv = ['zt'] + argv
+                status = zygote.run_client(self.socket_path)
+            finally:
+                os._exit(255 if status is None else status)
+        status = zygote._wait_status(os.waitpid(pid, 0)[1])
+        with open(output) as fpin:
+            return None if status == 255 else status, fpin.read()
+
+    def test_round_trip(self):
+        self.assertEqual((0, '%s hello\n' % self.tmpdir), self.run_client(['0'], {'ZT_VALUE': 'hello'}))
+        self.assertEqual((7, '%s None\n' % self.tmpdir), self.run_client(['7']))
+        self.assertFalse(self.server_exited())
+
+    def test_trace_startup(self):
+        status, output = self.run_client(['0', trace.TRACE_OPTION])
+        self.assertEqual(0, status)
+        self.assertIn('Startup trace:', output)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'trace.json')))
+
+    def test_configuration_mismatch(self):
+        self.assertEqual(None, self.run_client(['0'], {'ZT_USER': 'someone'})[0])  # runs in-process instead
+        self.assertEqual(0, self.run_client(['0'])[0])
+
+    def test_restart_when_configuration_changes(self):
+        self.assertEqual(0, self.run_client(['0'])[0])
+        self.touch('zt.yaml', 'changed')
+        self.assertEqual(None, self.run_client(['0'])[0])
+        self.assertTrue(_wait_for(self.server_exited))
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_restart_when_sources_change(self):
+        self.touch('source.py', 'changed')
+        self.assertEqual(3, self.run_client(['3'])[0])  # served, and then the server exits
+        self.assertTrue(_wait_for(self.server_exited))
+        self.assertEqual(None, self.run_client(['0'])[0])
+
+
+class ReapChildrenTest(unittest.TestCase):
+
+    def test_reap(self):
+        server = zygote.ZygoteServer(None, None)
+        expected = {}
+        for status, signum in ((0, None), (5, None), (None, signal.SIGKILL)):
+            pid = os.fork()
+            if pid == 0:
+                if signum is not None:
+                    os.kill(os.getpid(), signum)
+                os._exit(status)
+            conn, client = socket.socketpair()
+            server.children[pid] = conn
+            expected[pid] = (client, status if signum is None else 128 + signum)
+
+        while server.children:
+            server._reap_children(block=True)
+        for client, status in expected.itervalues():
+            self.assertEqual({'exit': status}, zygote._recv_message(client))
+            self.assertEqual(None, zygote._recv_message(client))  # the server closed its end
+            client.close()
+        self.assertEqual({}, server.children)
+
+
+class PreloadTest(unittest.TestCase):
+
+    def test_preload(self):
+        loaded = []
+
+        def _load(name, node):
+            loaded.append(name)
+            return node
+
+        commands = {
+            'status': {'type': 'cmd'},
+            'dev': CommandShard(lambda: _load('dev', {'lint': {'type': 'cmd'}, 'db': CommandShard(lambda: _load('db', {}))})),
+        }
+        zygote._preload(commands)
+        self.assertEqual(['dev', 'db'], loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
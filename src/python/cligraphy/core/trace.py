@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Startup tracing
+
+When enabled (--trace-startup, or the <SHORTNAME>_TRACE_STARTUP environment variable), we record how long each startup
+phase takes, as well as every module import, as a tree of timed spans. At exit, the tree is printed on stderr and saved
+in Chrome trace format (load it in chrome://tracing or https://ui.perfetto.dev).
+
+Instrumented code uses the module level span() context manager, which does nothing unless tracing is enabled.
+"""
+
+from contextlib import contextmanager
+import __builtin__
+import atexit
+import json
+import os
+import sys
+import time
+
+
+TRACER = None
+
+TRACE_OPTION = '--trace-startup'
+
+
+class Span(object):
+    """A timed, named span of execution, with its nested spans"""
+
+    __slots__ = ('name', 'category', 'start', 'end', 'children')
+
+    def __init__(self, name, category, start):
+        self.name = name
+        self.category = category
+        self.start = start
+        self.end = None
+        self.children = []
+
+    @property
+    def duration(self):
+        return (self.end or time.time()) - self.start
+
+
+class StartupTracer(object):
+    """Records a tree of spans, including module imports"""
+
+    def __init__(self, name):
+        self.pid = os.getpid()
+        self.root = Span(name, 'main', time.time())
+        self.stack = [self.root]
+        self._original_import = None
+
+    def begin(self, name, category='phase'):
+        span = Span(name, category, time.time())
+        self.stack[-1].children.append(span)
+        self.stack.append(span)
+        return span
+
+    def end(self, span):
+        span.end = time.time()
+        if span not in self.stack:
+            return
+        while self.stack[-1] is not span:
+            self.stack.pop().end = span.end  # an inner span did not end properly, eg. because of an exception
+        self.stack.pop()
+
+    def install_import_hook(self):
+        """Trace module imports: wraps __import__, recording imports of modules not yet loaded"""
+        original_import = self._original_import = __builtin__.__import__
+
+        def _traced_import(name, globals=None, locals=None, fromlist=None, level=-1):
+            if name in sys.modules or os.getpid() != self.pid:
+                return original_import(name, globals, locals, fromlist, level)
+            span = self.begin(name, 'import')
+            try:
+                return original_import(name, globals, locals, fromlist, level)
+            finally:
+                self.end(span)
+
+        __builtin__.__import__ = _traced_import
+
+    def uninstall_import_hook(self):
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def finish(self):
+        self.uninstall_import_hook()
+        while self.stack:
+            self.stack.pop().end = time.time()
+
+    def format_tree(self, min_duration=0.0001):
+        """Returns our span tree as text, skipping spans shorter than min_duration seconds"""
+        lines = []
+
+        def _format(span, depth):
+            lines.append('%8.1f ms  %s%s%s' % (span.duration * 1000, '  ' * depth,
+                                              'import ' if span.category == 'import' else '', span.name))
+            hidden = 0
+            for child in span.children:
+                if child.duration >= min_duration:
+                    _format(child, depth + 1)
+                else:
+                    hidden += 1
+            if hidden:
+                lines.append('%8s     %s(%d shorter spans)' % ('', '  ' * (depth + 1), hidden))
+
+        _format(self.root, 0)
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """Returns our spans as a list of Chrome trace format complete events"""
+        events = []
+
+        def _add(span):
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': int(span.start * 1e6),
+                'dur': int(span.duration * 1e6),
+                'pid': self.pid,
+                'tid': 0,
+            })
+            for child in span.children:
+                _add(child)
+
+        _add(self.root)
+        return events
+
+    def report(self, filename):
+        """Print our span tree on stderr, and save it in Chrome trace format to filename"""
+        if os.getpid() != self.pid:
+            return  # forked command process
+        self.finish()
+        sys.stderr.write('Startup trace:\n%s\n' % self.format_tree())
+        try:
+            with open(filename, 'w') as fpout:
+                json.dump({'traceEvents': self.chrome_trace(), 'displayTimeUnit': 'ms'}, fpout)
+            sys.stderr.write('Chrome trace saved to %s\n' % filename)
+        except (IOError, OSError) as exc:
+            sys.stderr.write('Could not save chrome trace to %s: %s\n' % (filename, exc))
+
+
+def is_enabled(shortname):
+    """Startup tracing is enabled by our command line option or environment variable, which we have to spot before
+    parsing the command line"""
+    return TRACE_OPTION in sys.argv or os.getenv('%s_TRACE_STARTUP' % shortname.upper()) == '1'
+
+
+def start(name, get_filename):
+    """Start tracing. At exit, the trace is reported and saved to get_filename()"""
+    global TRACER
+    TRACER = StartupTracer(name)
+    TRACER.install_import_hook()
+    atexit.register(lambda: TRACER.report(get_filename()))
+    return TRACER
+
+
+@contextmanager
+def span(name, category='phase'):
+    """Trace the execution of the with block, if tracing is enabled"""
+    tracer = TRACER
+    if tracer is None or os.getpid() != tracer.pid:
+        yield
+        return
+    current = tracer.begin(name, category)
+    try:
+        yield
+    finally:
+        tracer.end(current)
@@ -5,6 +5,8 @@
 """
 
 from contextlib import contextmanager
+import functools
+import importlib
 import logging
 import signal
 import sys
@@ -42,6 +44,28 @@ def undecorate_func(func, decorators=None):
         return func, decorators
 
 
+CALL_NONE = 'none'  # main()
+CALL_ARGS = 'args'  # main(args)
+CALL_KWARGS = 'kwargs'  # main(**kwargs)
+
+
+def call_convention(func):
+    """Returns how a command's main function wants its arguments, as a [convention, parameter names] list:
+    [CALL_NONE, None], [CALL_ARGS, None], or [CALL_KWARGS, names of its parameters (None if it takes any keyword)]
+    """
+    import inspect
+    # if the main method has been decorated, we need to look at the original function's argspec
+    orig_func, _ = undecorate_func(func)
+    argspec = inspect.getargspec(orig_func)
+    if len(argspec.args) == 0:
+        return [CALL_NONE, None]
+    elif argspec.varargs or argspec.keywords or len(argspec.args) > 1:
+        return [CALL_KWARGS, None if argspec.keywords else list(argspec.args)]
+    elif argspec.args[0] != 'args':
+        raise Exception('Programming error in command: if main() only has one argument it must be called "args"')
+    return [CALL_ARGS, None]
+
+
 def try_import(module_name):
     """Attempt to import the given module (by name), returning a tuple (True, module object) or (False,None) on ImportError"""
     try:
@@ -51,6 +75,62 @@ def try_import(module_name):
         return False, None
 
 
+def memoize(func):
+    """Memoize a function or method on its (hashable) arguments"""
+    cache = {}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = args, frozenset(kwargs.iteritems())
+        try:
+            return cache[key]
+        except KeyError:
+            value = cache[key] = func(*args, **kwargs)
+            return value
+    return wrapper
+
+
+class _PostImportHook(object):
+    """sys.meta_path hook calling callbacks right after a module has been imported"""
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.callbacks = []
+        self.loading = False
+
+    def find_module(self, fullname, path=None):
+        if fullname == self.module_name and not self.loading:
+            return self
+        return None
+
+    def load_module(self, fullname):
+        self.loading = True
+        try:
+            module = importlib.import_module(fullname)  # regular import, which we don't intercept while loading
+        finally:
+            self.loading = False
+        sys.meta_path.remove(self)
+        for callback in self.callbacks:
+            callback(module)
+        return module
+
+
+def when_imported(module_name, callback):
+    """Call callback(module) once the given module is imported - right away if it already is.
+    Lets us configure optional, heavy modules without importing them ourselves."""
+    module = sys.modules.get(module_name)
+    if module is not None:
+        callback(module)
+        return
+    for hook in sys.meta_path:
+        if isinstance(hook, _PostImportHook) and hook.module_name == module_name:
+            break
+    else:
+        hook = _PostImportHook(module_name)
+        sys.meta_path.insert(0, hook)
+    hook.callbacks.append(callback)
+
+
 def call_chain(chain, *args, **kwargs):
     if len(chain) == 1:
         return chain[0](*args, **kwargs)
@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix, Inc.
+
+"""Zygote server: keep a warm, pre-configured oc process around and fork it for each invocation
+
+The zygote server is a per-user daemon listening on a unix socket (~/.<tool shortname>/zygote.sock). It loads our
+configuration and command maps once; each client connection gets a forked child, which receives the client's argv,
+environment, working directory and stdin/stdout/stderr file descriptors, and runs the command line as usual.
+
+Children run in their own session (and process group); when the client's stdin is a terminal that is not already
+the controlling terminal of another session, it becomes the child's controlling terminal. The thin client forwards the
+signals it receives to the child's process group (stopping it when the client is suspended) and exits with the child's
+status, which the server sends once it has reaped the child: commands that exec another program report its status.
+The server exits (and clients fall back to running in-process) when our configuration, commands caches or cligraphy
+itself change, or after being idle for a while. Children read our configuration again in their client's environment,
+and refuse to run (the client falls back to running in-process) if it is not the configuration the server warmed up.
+
+Tool launchers use it through main():
+
+    sys.exit(zygote.main(lambda: Cligraph(name, shortname, path), shortname))
+
+The zygote is only started if the <SHORTNAME>_ZYGOTE environment variable is set to 1.
+"""
+
+import errno
+import fcntl
+import importlib
+import logging
+import marshal
+import os
+import os.path
+import select
+import signal
+import socket
+import struct
+import sys
+import termios
+import time
+
+try:
+    from _multiprocessing import sendfd, recvfd
+except ImportError:
+    sendfd = recvfd = None
+
+MESSAGE_HEADER = struct.Struct('!I')
+FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGWINCH, signal.SIGUSR2)
+PRELOAD_MODULES = ('requests', 'argcomplete', 'setproctitle', 'faulthandler')
+
+
+def get_socket_path(shortname):
+    """Returns the zygote socket path for the given tool"""
+    return os.path.join(os.path.expanduser('~/.' + shortname), 'zygote.sock')
+
+
+def _retry_on_eintr(func, *args):
+    """Call func, retrying when interrupted by a signal"""
+    while True:
+        try:
+            return func(*args)
+        except (IOError, OSError, socket.error, select.error) as err:
+            if err.args[0] != errno.EINTR:
+                raise
+
+
+def _send_message(sock, message):
+    """Send a length prefixed message (marshalled, which preserves argv and environment byte strings)"""
+    data = marshal.dumps(message)
+    _retry_on_eintr(sock.sendall, MESSAGE_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    """Receive exactly size bytes, or return None on EOF"""
+    parts = []
+    while size > 0:
+        part = _retry_on_eintr(sock.recv, size)
+        if not part:
+            return None
+        parts.append(part)
+        size -= len(part)
+    return ''.join(parts)
+
+
+def _recv_message(sock):
+    """Receive a length prefixed message, or return None on EOF"""
+    header = _recv_exactly(sock, MESSAGE_HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, MESSAGE_HEADER.unpack(header)[0])
+    return None if data is None else marshal.loads(data)
+
+
+def _set_cloexec(fileno):
+    """Do not pass fileno on to the programs we exec"""
+    fcntl.fcntl(fileno, fcntl.F_SETFD, fcntl.fcntl(fileno, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+
+def _wait_status(status):
+    """Returns the exit status of a process, given its waitpid status"""
+    return os.WEXITSTATUS(status) if os.WIFEXITED(status) else 128 + os.WTERMSIG(status)
+
+
+def _fingerprints(filenames):
+    """Returns the (mtime, size) of each of filenames (None if it does not exist)"""
+    fingerprints = {}
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            fingerprints[filename] = (stat.st_mtime, stat.st_size)
+        except OSError:
+            fingerprints[filename] = None
+    return fingerprints
+
+
+def _preload(node):
+    """Load all the namespaces of a command map, eg. the shards of sharded commands caches"""
+    from cligraphy.core.cmdcache import is_command
+    for child in node.itervalues():
+        if not is_command(child):
+            _preload(child)
+
+
+def _kill_group(pgid, signum):
+    try:
+        os.killpg(pgid, signum)
+    except OSError:
+        pass
+
+
+def run_client(socket_path):
+    """Run our command line through the zygote server listening on socket_path.
+    Returns the command's exit status, or None if no (usable) zygote server is available.
+    """
+    if sendfd is None or not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        _send_message(sock, {'argv': sys.argv, 'env': dict(os.environ), 'cwd': os.getcwd()})
+        for fileno in (0, 1, 2):
+            sendfd(sock.fileno(), fileno)
+        reply = _recv_message(sock)
+    except socket.error:
+        logging.debug('Could not use zygote server at %s', socket_path, exc_info=True)
+        sock.close()
+        return None
+
+    if not reply or reply.get('status') != 'started':
+        logging.debug('Zygote server at %s is not available (reply: %r)', socket_path, reply)
+        sock.close()
+        return None
+
+    child_pgid = reply.get('pgid', reply['pid'])
+
+    def _forward_signal(signum, _):
+        _kill_group(child_pgid, signum)
+
+    def _suspend(*_):
+        # the child's process group is orphaned unless it got our terminal: SIGTSTP would be discarded
+        _kill_group(child_pgid, signal.SIGTSTP if reply.get('tty') else signal.SIGSTOP)
+        signal.signal(signal.SIGTSTP, signal.SIG_DFL)
+        os.kill(os.getpid(), signal.SIGTSTP)
+        signal.signal(signal.SIGTSTP, _suspend)  # we've been continued, and have forwarded SIGCONT
+
+    for signum in FORWARDED_SIGNALS + (signal.SIGCONT,):
+        signal.signal(signum, _forward_signal)
+    signal.signal(signal.SIGTSTP, _suspend)
+
+    try:
+        result = _recv_message(sock)
+    finally:
+        sock.close()
+    return result['exit'] if result else 1
+
+
+class ZygoteServer(object):
+    """Per-user server forking pre-configured oc processes"""
+
+    idle_timeout = 3600  # seconds
+    reap_period = 10  # seconds
+    sources_check_period = 10  # seconds; cligraph sources are checked that often at most, never while accepting clients
+
+    def __init__(self, cligraph, socket_path):
+        self.cligraph = cligraph
+        self.socket_path = socket_path
+        self.socket_inode = None
+        self.watched = ()
+        self.fingerprints = None
+        self.sources = ()
+        self.sources_fingerprints = None
+        self.sources_checked = 0
+        self.children = {}  # pid: client connection, to send the exit status of the child to
+        self.wakeup_r = self.wakeup_w = None
+
+    def watched_files(self):
+        """Files that invalidate this server when they change, checked for each client: our configuration layers,
+        commands caches (including exec command maps indexes) and the directories of cligraphy's own sources (whose
+        mtime changes when sources are added, removed or replaced)"""
+        import cligraphy
+        from cligraphy.core.parsers import AutoDiscoveryCommandMap, ExecCommandMap
+
+        filenames = [layer[0] for layer in self.cligraph.conf_layers.values() if not callable(layer[0])]
+        for module, options in self.cligraph.conf.commands.items():
+            options = options or {}
+            opt_type = options.get('type', 'python')
+            if opt_type == 'python':
+                command_map = AutoDiscoveryCommandMap(self.cligraph, module, cache_format=options.get('cache_format', 'json'))
+                filenames.append(command_map.get_cache_filename())
+            elif opt_type == 'exec':
+                command_map = ExecCommandMap(self.cligraph, module, options.get('paths'),
+                                             help_source=options.get('help', 'header'))
+                filenames.append(command_map.get_cache_filename())
+
+        for package_path in cligraphy.__path__:
+            filenames.extend(dirpath for dirpath, _, _ in os.walk(package_path))
+        return filenames
+
+    def source_files(self):
+        """cligraphy's own sources, which also invalidate this server when edited in place"""
+        import cligraphy
+        filenames = []
+        for package_path in cligraphy.__path__:
+            for dirpath, _, names in os.walk(package_path):
+                filenames.extend(os.path.join(dirpath, name) for name in names if name.endswith('.py'))
+        return filenames
+
+    def is_stale(self):
+        return _fingerprints(self.watched) != self.fingerprints
+
+    def sources_changed(self):
+        """Whether a cligraph source changed - checked every sources_check_period seconds at most"""
+        if time.time() - self.sources_checked < self.sources_check_period:
+            return False
+        self.sources_checked = time.time()
+        return _fingerprints(self.sources) != self.sources_fingerprints
+
+    def warm_up(self):
+        """Load everything an invocation needs that does not depend on its command line"""
+        for module_name in PRELOAD_MODULES:
+            try:
+                __import__(module_name)
+            except ImportError:
+                logging.debug('Could not preload %s', module_name)
+        # same arguments as Cligraph._parse_args, to hit the memoized value
+        for _, command_map in self.cligraph.get_command_maps(False):
+            _preload(command_map['commands'])
+        for module, options in self.cligraph.conf.commands.items():
+            if (options or {}).get('type', 'python') == 'python':
+                try:
+                    importlib.import_module(module)
+                except Exception:  # pylint:disable=broad-except
+                    logging.debug('Could not preload commands package %s', module, exc_info=True)
+        self.watched = self.watched_files()
+        self.fingerprints = _fingerprints(self.watched)
+        self.sources = self.source_files()
+        self.sources_fingerprints = _fingerprints(self.sources)
+        self.sources_checked = time.time()
+
+    def _bind(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(path)
+        except socket.error:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        return sock
+
+    def _listen(self):
+        """Bind our socket. A stale socket file (left behind by a server that died) is replaced atomically, so that we
+        never remove the socket of a live server"""
+        try:
+            sock = self._bind(self.socket_path)
+        except socket.error as err:
+            if err.args[0] != errno.EADDRINUSE:
+                raise
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise Exception('Another zygote server is already listening on %s' % self.socket_path)
+            except socket.error:
+                pass
+            finally:
+                probe.close()
+            temp_path = '%s.%d' % (self.socket_path, os.getpid())
+            sock = self._bind(temp_path)
+            os.rename(temp_path, self.socket_path)
+        self.socket_inode = os.stat(self.socket_path).st_ino
+        _set_cloexec(sock.fileno())
+        sock.listen(16)
+        return sock
+
+    def _unlink_socket(self):
+        """Remove our socket file, unless another server replaced it"""
+        try:
+            if os.stat(self.socket_path).st_ino == self.socket_inode:
+                os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def _on_sigchld(self, *_):
+        try:
+            os.write(self.wakeup_w, '!')
+        except OSError:
+            pass  # EAGAIN: a wakeup is already pending
+
+    def serve_forever(self):
+        """Accept and fork clients until we become stale or idle, then wait for our children to exit"""
+        self.warm_up()
+        sock = self._listen()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        for fileno in (self.wakeup_r, self.wakeup_w):
+            fcntl.fcntl(fileno, fcntl.F_SETFL, fcntl.fcntl(fileno, fcntl.F_GETFL) | os.O_NONBLOCK)
+            _set_cloexec(fileno)
+        signal.signal(signal.SIGCHLD, self._on_sigchld)
+        last_activity = time.time()
+        try:
+            while True:
+                self._reap_children()
+                readable = _retry_on_eintr(select.select, [sock, self.wakeup_r], [], [], self.reap_period)[0]
+                if self.wakeup_r in readable:
+                    try:
+                        os.read(self.wakeup_r, 4096)
+                    except OSError:
+                        pass
+                if sock not in readable:
+                    if self.sources_changed():
+                        logging.info('cligraphy changed, zygote server exiting')
+                        return
+                    if not self.children and time.time() - last_activity > self.idle_timeout:
+                        logging.info('Zygote server idle for %d seconds, exiting', self.idle_timeout)
+                        return
+                    continue
+
+                conn, _ = _retry_on_eintr(sock.accept)
+                _set_cloexec(conn.fileno())  # the exit status of exec'd commands is sent by us, see _reap_children
+                last_activity = time.time()
+                if self.is_stale():
+                    logging.info('Configuration, commands caches or cligraphy changed, zygote server exiting')
+                    _send_message(conn, {'status': 'stale'})
+                    conn.close()
+                    return
+
+                pid = os.fork()
+                if pid == 0:
+                    sock.close()
+                    self._run_child(conn)
+                self.children[pid] = conn
+                if self.sources_changed():  # once the client has been served
+                    logging.info('cligraphy changed, zygote server exiting')
+                    return
+        finally:
+            sock.close()
+            self._unlink_socket()
+            while self.children:
+                self._reap_children(block=True)
+
+    def _reap_children(self, block=False):
+        """Reap exited children, and send their exit status to their client"""
+        while True:
+            try:
+                pid, status = _retry_on_eintr(os.waitpid, -1, 0 if block else os.WNOHANG)
+            except OSError:  # ECHILD
+                for conn in self.children.itervalues():
+                    conn.close()
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            conn = self.children.pop(pid, None)
+            if conn is None:
+                continue
+            try:
+                _send_message(conn, {'exit': _wait_status(status)})
+            except socket.error:
+                logging.debug('Could not send the exit status of %d to its client', pid, exc_info=True)
+            conn.close()
+            if block:
+                return
+
+    def _run_child(self, conn):
+        """Forked child: become the client's oc process and run its command line. Never returns."""
+        from cligraphy.core import trace, tracking
+        from cligraphy.core.batch import exit_status
+        status = 1
+        try:
+            for other in self.children.itervalues():
+                other.close()
+            os.close(self.wakeup_r)
+            os.close(self.wakeup_w)
+            for signum in FORWARDED_SIGNALS + (signal.SIGCHLD,):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            request = _recv_message(conn)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = request['argv']
+
+            # tracing (our client's --trace-startup), and our configuration, in our client's environment
+            trace.TRACER = None
+            conf = self.cligraph.conf
+            self.cligraph.configure()
+            if self.cligraph.conf != conf:
+                _send_message(conn, {'status': 'mismatch'})
+                return
+
+            for target in (0, 1, 2):
+                fileno = recvfd(conn.fileno())
+                os.dup2(fileno, target)
+                os.close(fileno)
+
+            # our own session and process group, which the client signals as a whole; and the client's terminal as
+            # our controlling terminal, if we can get it (that fails if it is the controlling terminal of its session)
+            os.setsid()
+            tty = False
+            if os.isatty(0):
+                try:
+                    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+                    tty = True
+                except IOError:
+                    logging.debug('Could not make the client terminal our controlling terminal', exc_info=True)
+
+            tracking.TRACKING = tracking.get_tracking()
+
+            _send_message(conn, {'status': 'started', 'pid': os.getpid(), 'pgid': os.getpgrp(), 'tty': tty})
+            conn.close()
+            status = exit_status(self.cligraph.main())
+        except SystemExit as exc:
+            status = exit_status(exc.code)
+        except BaseException:  # pylint:disable=broad-except
+            logging.exception('Top level exception in zygote child')
+        finally:
+            try:
+                if trace.TRACER is not None:  # we exit without running atexit handlers
+                    trace.TRACER.report(self.cligraph.get_trace_filename())
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+
+def start_server(cligraph_factory, socket_path):
+    """Start a zygote server in a detached daemon process"""
+    pid = os.fork()
+    if pid != 0:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fileno in (0, 1, 2):
+            os.dup2(devnull, fileno)
+        ZygoteServer(cligraph_factory(), socket_path).serve_forever()
+    finally:
+        os._exit(0)
+
+
+def main(cligraph_factory, shortname):
+    """Tool launcher helper: run our command line through the zygote server if one is available, in-process otherwise
+    (starting a zygote server for the next invocations, if enabled).
+    """
+    socket_path = get_socket_path(shortname)
+    status = run_client(socket_path)
+    if status is None:
+        if os.getenv('%s_ZYGOTE' % shortname.upper()) == '1' and sendfd is not None:
+            start_server(cligraph_factory, socket_path)
+        status = cligraph_factory().main()
+    return status
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""
+Benchmark commands
+
+Measure the performance of cligraphy internals
+"""
+
+import time
+
+
+def synthetic_command_map(command_count, module='benchcmds', fanout=50):
+    """Build a command map with command_count commands, spread over two levels of namespaces of fanout items each"""
+    commands = {}
+    for index in xrange(command_count):
+        group = commands.setdefault('group%d' % (index // (fanout * fanout)), {})
+        namespace = group.setdefault('ns%d' % ((index // fanout) % fanout), {})
+        namespace['command%d' % index] = {
+            'type': 'cmd',
+            'help': 'Synthetic command number %d' % index,
+            'desc': 'Synthetic command number %d\n\nThis command was generated for benchmarking purposes.' % index,
+        }
+    return {'module': module, 'commands': commands}
+
+
+def best_of(func, repeat=5):
+    """Call func repeat times and return the best elapsed time, in seconds"""
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
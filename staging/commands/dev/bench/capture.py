@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""Benchmark terminal capture throughput
+
+Run a command printing lots of output under capture (ptysnoop.Script, itself running in a pseudo terminal we read
+from), and measure how fast its output gets through, and how much cpu time capture takes: with output recording (with
+fixed 128 bytes reads, like capture used to, and with adaptive reads), and with each of the forwarding modes used when
+output is not recorded.
+"""
+
+from cligraphy.core.capture import HeadTailOutputRecorder, NoopOutputRecorder
+from cligraphy.core.capture import ptysnoop
+
+import fcntl
+import json
+import os
+import sys
+import termios
+import time
+
+
+LINE = 'x' * 99 + '\n'
+CASES = (  # output recording, forwarding mode, maximum read size
+    ('recorded', 'read', ptysnoop.DEFAULT_BUFF_SIZE),
+    ('recorded', 'read', ptysnoop.MAX_BUFF_SIZE),
+    ('unrecorded', 'read', ptysnoop.MAX_BUFF_SIZE),
+    ('unrecorded', 'readinto', ptysnoop.MAX_BUFF_SIZE),
+    ('unrecorded', 'splice', ptysnoop.MAX_BUFF_SIZE),
+)
+
+
+def _spew(megabytes):
+    """Captured command: print megabytes of output, and exit"""
+    block = LINE * (1024 * 1024 // len(LINE))
+    for _ in xrange(megabytes):
+        ptysnoop.xwrite(ptysnoop.STDOUT, block)
+    os._exit(0)  # pylint:disable=protected-access
+
+
+def _capture(recording, forwarding, max_buff_size, megabytes, result_fd):
+    """Capture process: runs in a pseudo terminal, and sends back how long capturing our command took, and how much
+    cpu time we used"""
+    if recording == 'recorded':
+        recorder = HeadTailOutputRecorder(max_head_size=8192, max_tail_size=8192)
+    else:
+        recorder = NoopOutputRecorder()
+    script = ptysnoop.Script(recorder, forwarding=forwarding, max_buff_size=max_buff_size)
+    start = time.time()
+    status = script.run(_spew, None, megabytes)
+    cpu = sum(os.times()[:2])
+    os.write(result_fd, json.dumps({'seconds': time.time() - start, 'cpu': cpu, 'status': status}))
+    os._exit(0)  # pylint:disable=protected-access
+
+
+def bench_case(recording, forwarding, max_buff_size, megabytes):
+    """Measure one case. Returns its (elapsed time, cpu time) in seconds, or None if it failed (eg. splice is not
+    available)"""
+    master, slave = os.openpty()
+    result_r, result_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            fcntl.ioctl(slave, termios.TIOCSCTTY, 0)
+            for fileno in (ptysnoop.STDIN, ptysnoop.STDOUT, ptysnoop.STDERR):
+                os.dup2(slave, fileno)
+            os.close(master)
+            os.close(slave)
+            os.close(result_r)
+            _capture(recording, forwarding, max_buff_size, megabytes, result_w)
+        finally:
+            os._exit(1)  # pylint:disable=protected-access
+
+    os.close(slave)
+    os.close(result_w)
+    while True:  # be the terminal: read and discard everything
+        try:
+            if not os.read(master, ptysnoop.MAX_BUFF_SIZE):
+                break
+        except OSError:
+            break  # EIO: the capture process exited
+    os.waitpid(pid, 0)
+    os.close(master)
+    result = os.read(result_r, 4096)
+    os.close(result_r)
+    if not result:
+        return None
+    result = json.loads(result)
+    return (result['seconds'], result['cpu']) if result['status'] == 0 else None
+
+
+def configure(parser):
+    parser.add_argument('-m', '--megabytes', help='output size, in megabytes', type=int, default=100)
+    parser.add_argument('-r', '--repeat', help='repeat each measurement this many times, keep the best', type=int, default=3)
+    parser.add_argument('--json', help='Output in json format', action='store_true')
+
+
+def main(args):
+    results = []
+    for recording, forwarding, max_buff_size in CASES:
+        timings = [bench_case(recording, forwarding, max_buff_size, args.megabytes) for _ in xrange(args.repeat)]
+        timings = [timing for timing in timings if timing is not None]
+        best = min(timings) if timings else (None, None)
+        results.append({
+            'recording': recording,
+            'forwarding': forwarding,
+            'max_read_size': max_buff_size,
+            'seconds': best[0],
+            'cpu_seconds': best[1],
+            'throughput': args.megabytes / best[0] if timings else None,
+        })
+
+    if args.json:
+        print json.dumps(results, indent=4)
+        return
+
+    print '%-12s %-10s %8s %10s %14s %12s' % ('output', 'forwarding', 'reads', 'seconds', 'throughput', 'capture cpu')
+    for result in results:
+        if result['seconds'] is None:
+            print '%-12s %-10s %8d %10s' % (result['recording'], result['forwarding'], result['max_read_size'], 'failed')
+        else:
+            print '%-12s %-10s %8d %10.3f %9.1f MB/s %10.3f s' % (result['recording'], result['forwarding'],
+                                                                 result['max_read_size'], result['seconds'],
+                                                                 result['throughput'], result['cpu_seconds'])
+    sys.stdout.flush()
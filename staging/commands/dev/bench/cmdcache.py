@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""Compare command cache formats
+
+Measure how long it takes to load a command map and look up one command, using the json and index cache formats.
+"""
+
+from cligraphy.core.cmdcache import CommandIndex, write_command_index
+from nflx_oc.commands.dev.bench import best_of, synthetic_command_map
+
+import json
+import os
+import shutil
+import tempfile
+
+
+def _lookup(commands, path):
+    node = commands
+    for part in path:
+        node = node[part]
+    return node
+
+
+def bench_size(tempdir, command_count, repeat):
+    """Benchmark both cache formats for a synthetic command map of the given size"""
+    command_map = synthetic_command_map(command_count)
+    path = ('group0', 'ns0', 'command0')
+
+    json_filename = os.path.join(tempdir, 'commands-%d.json' % command_count)
+    with open(json_filename, 'w') as fpout:
+        json.dump(command_map, fpout, indent=4)
+
+    index_filename = os.path.join(tempdir, 'commands-%d.idx' % command_count)
+    write_command_index(index_filename, command_map)
+
+    def _json():
+        with open(json_filename) as fpin:
+            _lookup(json.load(fpin)['commands'], path)
+
+    def _index():
+        _lookup(CommandIndex(index_filename).command_map()['commands'], path)
+
+    return {
+        'commands': command_count,
+        'json_size': os.path.getsize(json_filename),
+        'json_seconds': best_of(_json, repeat),
+        'index_size': os.path.getsize(index_filename),
+        'index_seconds': best_of(_index, repeat),
+    }
+
+
+def configure(parser):
+    parser.add_argument('-s', '--sizes', help='comma separated command map sizes', default='1000,10000,50000')
+    parser.add_argument('-r', '--repeat', help='repeat each measurement this many times, keep the best', type=int, default=5)
+    parser.add_argument('--json', help='Output in json format', action='store_true')
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp(prefix='oc-bench-cmdcache-')
+    try:
+        results = [bench_size(tempdir, int(size), args.repeat) for size in args.sizes.split(',')]
+    finally:
+        shutil.rmtree(tempdir)
+
+    if args.json:
+        print json.dumps(results, indent=4)
+        return
+
+    print '%10s %12s %12s %12s %12s %8s' % ('commands', 'json bytes', 'json ms', 'index bytes', 'index ms', 'speedup')
+    for result in results:
+        print '%10d %12d %12.2f %12d %12.2f %7.0fx' % (result['commands'], result['json_size'], result['json_seconds'] * 1000,
+                                                       result['index_size'], result['index_seconds'] * 1000,
+                                                       result['json_seconds'] / max(result['index_seconds'], 1e-9))
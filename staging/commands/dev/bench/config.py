@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""Compare configuration tree types
+
+Measure construction, attribute, item and dotted path lookups of our ConfigNode tree against AttrDict.
+"""
+
+from cligraphy.core import get
+from cligraphy.core.config import ConfigNode
+
+from attrdict import AttrDict
+
+import json
+import timeit
+
+
+def synthetic_configuration(sections=50, keys=20):
+    """Build a configuration tree with sections of keys each, plus the sections our own code looks up"""
+    cfg = dict(('section%d' % section, dict(('key%d' % key, 'value%d' % key) for key in xrange(keys)))
+               for section in xrange(sections))
+    cfg['report'] = {'enabled': True, 'server': 'https://example.net', 'max_output_size': 8192}
+    cfg['ssh'] = {'proxy': {'host': 'bastion.example.net'}}
+    return cfg
+
+
+def bench(number, repeat):
+    cfg = synthetic_configuration()
+    attrdict, confnode = AttrDict(**cfg), ConfigNode(cfg)
+
+    def _time(func):
+        return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+    cases = (
+        ('construction', lambda conf_type: lambda: conf_type(cfg)),
+        ('conf.report.enabled', lambda conf: lambda: conf.report.enabled),
+        ('conf.ssh.proxy.host', lambda conf: lambda: conf.ssh.proxy.host),
+        ("conf['report']['enabled']", lambda conf: lambda: conf['report']['enabled']),
+        ("get(conf, 'ssh.proxy.host')", lambda conf: lambda: get(conf, 'ssh.proxy.host')),
+    )
+    results = []
+    for name, make in cases:
+        if name == 'construction':
+            attrdict_func, confnode_func = make(lambda data: AttrDict(**data)), make(ConfigNode)
+        else:
+            attrdict_func, confnode_func = make(attrdict), make(confnode)
+        results.append({'case': name, 'attrdict_seconds': _time(attrdict_func), 'confnode_seconds': _time(confnode_func)})
+    results.append({'case': "conf.lookup('ssh.proxy.host')", 'attrdict_seconds': None,
+                    'confnode_seconds': _time(lambda: confnode.lookup('ssh.proxy.host'))})
+    return results
+
+
+def configure(parser):
+    parser.add_argument('-n', '--number', help='run each case this many times per measurement', type=int, default=10000)
+    parser.add_argument('-r', '--repeat', help='repeat each measurement this many times, keep the best', type=int, default=5)
+    parser.add_argument('--json', help='Output in json format', action='store_true')
+
+
+def main(args):
+    results = bench(args.number, args.repeat)
+
+    if args.json:
+        print json.dumps(results, indent=4)
+        return
+
+    print '%-32s %14s %14s %8s' % ('case', 'AttrDict us', 'ConfigNode us', 'speedup')
+    for result in results:
+        if result['attrdict_seconds'] is None:
+            print '%-32s %14s %14.3f %8s' % (result['case'], '-', result['confnode_seconds'] * 1e6, '')
+        else:
+            print '%-32s %14.3f %14.3f %7.1fx' % (result['case'], result['attrdict_seconds'] * 1e6,
+                                                  result['confnode_seconds'] * 1e6,
+                                                  result['attrdict_seconds'] / max(result['confnode_seconds'], 1e-12))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""Benchmark fuzzy command matching
+
+Compare the n-gram index based fuzzy matcher with a plain regex scan of all command paths.
+"""
+
+from cligraphy.core.fuzzy import FuzzyIndex, FuzzyMatcher
+from cligraphy.core.parsers import build_fuzzy_index, iter_commands
+from nflx_oc.commands.dev.bench import best_of, synthetic_command_map
+
+import json
+import os
+import re
+import shutil
+import tempfile
+
+
+QUERIES = (
+    ('command4242',),
+    ('ns3', 'command1'),
+    ('grp', 'mand12345'),
+    ('group1', 'ns', 'nothing'),
+)
+
+
+def _regex_scan(paths, words):
+    """What fuzzy matching used to do: one regex search per command path"""
+    pattern = re.compile('.*'.join(words))
+    return [path for path in paths if pattern.search(path)]
+
+
+def bench_size(tempdir, command_count, repeat):
+    """Benchmark fuzzy matching for a synthetic command map of the given size"""
+    command_map = synthetic_command_map(command_count)
+    paths = [path for path, _, _ in iter_commands(command_map['module'], command_map['commands'])]
+
+    filename = os.path.join(tempdir, 'commands-%d.fuzzy' % command_count)
+    build_seconds = best_of(lambda: build_fuzzy_index(command_map).save(filename), 1)
+    index = FuzzyIndex.load(filename)
+
+    matcher = FuzzyMatcher()
+    matcher.add_source('', lambda: index)
+
+    result = {
+        'commands': command_count,
+        'index_size': os.path.getsize(filename),
+        'build_seconds': build_seconds,
+        'load_seconds': best_of(lambda: FuzzyIndex.load(filename), repeat),
+        'queries': [],
+    }
+    for words in QUERIES:
+        result['queries'].append({
+            'words': ' '.join(words),
+            'matches': len(_regex_scan(paths, words)),
+            'regex_seconds': best_of(lambda: _regex_scan(paths, words), repeat),
+            'index_seconds': best_of(lambda: matcher.match(list(words)), repeat),
+        })
+    return result
+
+
+def configure(parser):
+    parser.add_argument('-s', '--sizes', help='comma separated command map sizes', default='1000,10000,50000')
+    parser.add_argument('-r', '--repeat', help='repeat each measurement this many times, keep the best', type=int, default=5)
+    parser.add_argument('--json', help='Output in json format', action='store_true')
+
+
+def main(args):
+    tempdir = tempfile.mkdtemp(prefix='oc-bench-fuzzy-')
+    try:
+        results = [bench_size(tempdir, int(size), args.repeat) for size in args.sizes.split(',')]
+    finally:
+        shutil.rmtree(tempdir)
+
+    if args.json:
+        print json.dumps(results, indent=4)
+        return
+
+    for result in results:
+        print '%d commands: index %d bytes, built in %.0f ms, loaded in %.2f ms' % (
+            result['commands'], result['index_size'], result['build_seconds'] * 1000, result['load_seconds'] * 1000)
+        print '    %-24s %8s %10s %10s %8s' % ('query', 'matches', 'regex ms', 'index ms', 'speedup')
+        for query in result['queries']:
+            print '    %-24s %8d %10.3f %10.3f %7.0fx' % (query['words'], query['matches'], query['regex_seconds'] * 1000,
+                                                       query['index_seconds'] * 1000,
+                                                       query['regex_seconds'] / max(query['index_seconds'], 1e-9))
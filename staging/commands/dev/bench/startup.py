@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# Copyright 2016 Netflix
+
+"""Benchmark oc startup and dispatch
+
+Generate synthetic command packages (of 100 to 50k modules, in namespaces) and time autodiscovery, parser setup,
+command line parsing, fuzzy matching and whole oc invocations. Each measurement runs in a fresh python process.
+Results can be saved as json (--output) and compared with the results of another run, eg. on another commit (--compare).
+"""
+
+from nflx_oc.commands.dev.bench import best_of
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SHORTNAME = 'ocbench'
+COMMAND_TEMPLATE = '''"""Synthetic command %(index)d
+
+Generated for benchmarking purposes.
+"""
+
+
+def configure(parser):
+    parser.add_argument('--flag', action='store_true')
+
+
+def main(args):
+    pass
+'''
+INIT_TEMPLATE = '"""Synthetic namespace"""\n'
+
+# worker: python -c WORKER <measurement> <package> <repeat> <tool path> <discovery mode>
+WORKER = 'import sys; from nflx_oc.commands.dev.bench import startup; startup.worker(*sys.argv[1:])'
+# launcher for end to end measurements: python -c LAUNCHER <tool path> <args...>
+LAUNCHER = 'import sys; from cligraphy.core.cli import Cligraph; sys.exit(Cligraph(%r, %r, sys.argv.pop(1)).main())' % (
+    SHORTNAME, SHORTNAME)
+
+MEASUREMENTS = ('build_cold', 'build_cached', 'add_command_map', 'pre_parse_args', 'fuzzy')
+
+
+def command_path(index, fanout):
+    """Returns the (group, namespace, command) path of synthetic command number index"""
+    return 'group%d' % (index // (fanout * fanout)), 'ns%d' % ((index // fanout) % fanout), 'command%d' % index
+
+
+def generate_package(root, package, module_count, fanout):
+    """Write a synthetic command package with module_count command modules, in two levels of namespaces"""
+    created = set()
+    for index in xrange(module_count):
+        group, namespace, command = command_path(index, fanout)
+        directory = os.path.join(root, package, group, namespace)
+        if directory not in created:
+            for path in (os.path.join(root, package), os.path.join(root, package, group), directory):
+                if not os.path.exists(path):
+                    os.makedirs(path)
+                    with open(os.path.join(path, '__init__.py'), 'w') as fpout:
+                        fpout.write(INIT_TEMPLATE)
+            created.add(directory)
+        with open(os.path.join(directory, command + '.py'), 'w') as fpout:
+            fpout.write(COMMAND_TEMPLATE % {'index': index})
+
+
+def write_tool_configuration(tool_path, package):
+    """Write the shared configuration of our benchmark tool, which only has our synthetic command package"""
+    conf_dir = os.path.join(tool_path, 'conf')
+    if not os.path.exists(conf_dir):
+        os.makedirs(conf_dir)
+    with open(os.path.join(conf_dir, '%s.yaml' % SHORTNAME), 'w') as fpout:
+        fpout.write('commands:\n    %s:\nreport:\n    enabled: false\n' % package)
+
+
+def worker(measurement, package, repeat, tool_path, discovery):
+    """Fresh process side of a measurement: prints the best elapsed time, in seconds"""
+    from cligraphy.core.cli import Cligraph
+    from cligraphy.core.parsers import AutoDiscoveryCommandMap, SmartCommandMapParser, attempt_fuzzy_matching
+
+    repeat = int(repeat)
+    cligraph = Cligraph(SHORTNAME, SHORTNAME, tool_path)
+    command_map = AutoDiscoveryCommandMap(cligraph, package, discovery=discovery)
+
+    if measurement == 'build_cold':
+        # only the first discovery actually imports modules, so this one is measured once
+        start = time.time()
+        command_map.build(force_autodiscover=True, incremental=False)
+        elapsed = time.time() - start
+    elif measurement == 'build_cached':
+        elapsed = best_of(lambda: AutoDiscoveryCommandMap(cligraph, package).build(), repeat)
+    else:
+        cached = command_map.build()
+
+        def _parser():
+            parser = SmartCommandMapParser(prog=SHORTNAME, lazy=cligraph.lazy_parser)
+            parser.add_command_map('', cached)
+            return parser
+
+        if measurement == 'add_command_map':
+            elapsed = best_of(_parser, repeat)
+        elif measurement == 'pre_parse_args':
+            elapsed = best_of(lambda: _parser().pre_parse_args(['group0', 'ns0', 'command0']), repeat)
+        elif measurement == 'fuzzy':
+            parser = _parser()
+            attempt_fuzzy_matching(['mand1'], parser.fuzzy_matcher)  # loads the index
+            elapsed = best_of(lambda: attempt_fuzzy_matching(['ns1', 'mand1'], parser.fuzzy_matcher), repeat)
+        else:
+            raise ValueError('Unknown measurement %s' % measurement)
+
+    sys.stdout.write(json.dumps(elapsed))
+
+
+def run_worker(env, measurement, package, repeat, tool_path, discovery):
+    output = subprocess.check_output([sys.executable, '-c', WORKER, measurement, package, str(repeat), tool_path,
+                                      discovery], env=env)
+    return json.loads(output)
+
+
+def run_main(env, tool_path, args, repeat):
+    """Time whole oc invocations, in a subprocess. Returns the best elapsed time, in seconds"""
+    with open(os.devnull, 'w') as devnull:
+        return best_of(lambda: subprocess.check_call([sys.executable, '-c', LAUNCHER, tool_path] + args, env=env,
+                                                     stdout=devnull, stderr=devnull), repeat)
+
+
+def bench_size(tempdir, module_count, fanout, repeat, discovery):
+    """Run all measurements for a synthetic command package of the given size"""
+    package = 'benchcmds%d' % module_count
+    lib_path = os.path.join(tempdir, 'lib')
+    tool_path = os.path.join(tempdir, 'tool%d' % module_count)
+    generate_package(lib_path, package, module_count, fanout)
+    write_tool_configuration(tool_path, package)
+
+    env = dict(os.environ)
+    env['HOME'] = os.path.join(tempdir, 'home')
+    env['PYTHONPATH'] = os.pathsep.join([lib_path] + sys.path)
+    env['%s_COMMANDS_CACHE' % SHORTNAME.upper()] = os.path.join(tempdir, 'commands%d.json' % module_count)
+    env.pop('_ARGCOMPLETE', None)
+
+    result = {'modules': module_count}
+    for measurement in MEASUREMENTS:
+        result[measurement] = run_worker(env, measurement, package, repeat, tool_path, discovery)
+    result['main'] = run_main(env, tool_path, list(command_path(0, fanout)), repeat)
+    result['main_help'] = run_main(env, tool_path, ['--help'], repeat)
+    return result
+
+
+def get_metadata():
+    """Describe what we benchmarked, so that results can be compared across commits"""
+    import cligraphy
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.PIPE,
+                                         cwd=os.path.dirname(cligraphy.__file__)).strip()
+    except (subprocess.CalledProcessError, OSError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def print_results(results, baseline=None):
+    columns = MEASUREMENTS + ('main', 'main_help')
+    baseline = dict((result['modules'], result) for result in (baseline or {}).get('results', []))
+    print '%8s %s' % ('modules', ' '.join('%16s' % column for column in columns))
+    for result in results['results']:
+        cells = []
+        for column in columns:
+            cell = '%.2f ms' % (result[column] * 1000)
+            previous = baseline.get(result['modules'], {}).get(column)
+            if previous:
+                cell = '%s %+4.0f%%' % (cell, (result[column] - previous) * 100 / previous)
+            cells.append('%16s' % cell)
+        print '%8d %s' % (result['modules'], ' '.join(cells))
+
+
+def configure(parser):
+    parser.add_argument('-s', '--sizes', help='comma separated command package sizes', default='100,1000,10000,50000')
+    parser.add_argument('-f', '--fanout', help='namespaces per group, and commands per namespace', type=int, default=20)
+    parser.add_argument('-r', '--repeat', help='repeat each measurement this many times, keep the best', type=int, default=5)
+    parser.add_argument('-d', '--discovery', help='autodiscovery mode', default='import',
+                        choices=('import', 'parallel', 'static'))
+    parser.add_argument('-o', '--output', help='save results to this json file')
+    parser.add_argument('-c', '--compare', help='compare with results saved in this json file')
+    parser.add_argument('--json', help='Output in json format', action='store_true')
+
+
+def main(args):
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fpin:
+            baseline = json.load(fpin)
+
+    tempdir = tempfile.mkdtemp(prefix='oc-bench-startup-')
+    try:
+        results = {
+            'metadata': get_metadata(),
+            'results': [bench_size(tempdir, int(size), args.fanout, args.repeat, args.discovery)
+                        for size in args.sizes.split(',')],
+        }
+    finally:
+        shutil.rmtree(tempdir)
+
+    if args.output:
+        with open(args.output, 'w') as fpout:
+            json.dump(results, fpout, indent=4, sort_keys=True)
+
+    if args.json:
+        print json.dumps(results, indent=4, sort_keys=True)
+    else:
+        print_results(results, baseline)
@@ -9,7 +9,8 @@ refresh updates your oc tools install:
 - precompiles python files
 - refreshes commands cache
 
-Quick mode disables most of this and only refreshes the commands cache.
+Quick mode disables most of this and only refreshes the commands cache, using static discovery (command modules are
+parsed instead of being imported).
 """
 
 import subprocess
@@ -21,6 +22,7 @@ import urlparse
 from pip.req.req_install import parse_editable
 from pip.utils import get_installed_distributions
 
+from cligraphy.core.cmdcache import is_command
 from cligraphy.core.parsers import NO_HELP
 from cligraphy.core import ctx
 
@@ -36,7 +38,7 @@ TIPS = [
 def _build_tips(command_maps):
     def _explore(command_map, path):
         for name, node in command_map.iteritems():
-            if node.get('type') == 'cmd':
+            if is_command(node):
                 full_name = ' '.join(path + (name,))
                 node_help = node.get('help')
                 if node_help not in (None, NO_HELP) and len(node_help) > 1:
@@ -143,7 +145,7 @@ def refresh(cligraph, quick):
             hookup_repo(os.getenv('OC_REPO_PATH'), get_oc_hooks_path(), preflight=False)
 
         print '[refresh] refreshing commands cache...'
-        command_maps = cligraph.get_command_maps(autodiscover=True)
+        command_maps = cligraph.get_command_maps(autodiscover=True, discovery='static' if quick else None)
         _build_tips(command_maps)
     finally:
         os.chdir(oldcwd)
@@ -15,10 +15,17 @@ def shell():
     os.execl(*cmdline)
 
 
+def configure(parser):
+    parser.add_argument('--overflow', help='what to do when the session recorder falls behind (default: coalesce)',
+                        choices=capture.OVERFLOW_POLICIES, default='coalesce')
+    parser.add_argument('-g', '--granularity', help='replay timing granularity, in seconds (default: 0.05)', type=float,
+                        default=0.05)
+
+
 @decorators.tag(decorators.Tag.interactive)
 def main(args):
     logging.basicConfig(level=logging.INFO)
-    recorder = fmt_capnp.CapnpSessionRecorder()
+    recorder = fmt_capnp.BatchedCapnpSessionRecorder(granularity=args.granularity)
     print 'Session start - recording in %s' % (recorder.filename)
-    capture.spawn_and_record(recorder, shell, None)
+    capture.spawn_and_record(capture.AsyncRecorder(recorder, overflow=args.overflow), shell, None)
     print 'Session done - recorded in %s' % (recorder.filename)